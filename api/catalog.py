@@ -0,0 +1,73 @@
+"""
+Готовый снимок каталога для главного экрана мобильного приложения.
+
+Категории, активные услуги и активные филиалы вместе со статистикой оценок
+сериализуются один раз, сжимаются и хранятся в кэше под ключом из версий
+моделей (см. core.cache). Ответ отдается из кэша как готовые байты, поэтому
+в установившемся режиме запрос к каталогу не обращается к базе.
+
+После изменения любой из моделей меняется ключ снимка, и первый следующий
+запрос к каталогу перестраивает его синхронно (остальные запросы ждут
+блокировку и получают уже готовый снимок). Фоновых потоков нет, поэтому
+изменения из команд, обработчиков очередей и тестов ничего не запускают:
+несколько изменений подряд приводят к одной перестройке при следующем чтении.
+"""
+import gzip
+import hashlib
+import threading
+
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from core.cache import versioned_key
+from locations.models import Location
+from services.models import Service, ServiceCategory
+from .serializers import LocationSerializer, ServiceCategorySerializer, ServiceSerializer
+
+CATALOG_MODELS = (ServiceCategory, Service, Location)
+# Снимок перестраивается при изменениях, срок хранения лишь страхует от рассинхронизации
+CATALOG_TIMEOUT = 24 * 60 * 60
+
+_build_lock = threading.Lock()
+
+
+def get_catalog_key():
+    return versioned_key('catalog:snapshot', *CATALOG_MODELS)
+
+
+def build_catalog():
+    """Данные каталога; связанные объекты заменены их id"""
+    return {
+        'built': timezone.now(),
+        'categories': ServiceCategorySerializer(ServiceCategory.objects.all(), many=True, expand='').data,
+        'services': ServiceSerializer(Service.objects.filter(is_active=True), many=True, expand='').data,
+        'locations': LocationSerializer(Location.objects.filter(is_active=True), many=True, expand='').data,
+    }
+
+
+def build_snapshot(key=None):
+    """Строит снимок каталога и сохраняет его в кэше"""
+    # Версии читаются до выборки данных: изменение во время сборки даст новый ключ,
+    # и снимок перестроится при следующем чтении
+    key = key or get_catalog_key()
+    body = JSONRenderer().render(build_catalog())
+    digest = hashlib.sha256(body).hexdigest()
+    snapshot = {
+        'body': body,
+        'gzip': gzip.compress(body, mtime=0),
+        'etag': f'"{digest}"',
+        'gzip_etag': f'"{digest}-gzip"',
+    }
+    cache.set(key, snapshot, CATALOG_TIMEOUT)
+    return snapshot
+
+
+def get_snapshot():
+    """Текущий снимок каталога; после изменений или при пустом кэше строится сразу"""
+    key = get_catalog_key()
+    snapshot = cache.get(key)
+    if snapshot is None:
+        with _build_lock:
+            snapshot = cache.get(key) or build_snapshot(key)
+    return snapshot
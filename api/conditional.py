@@ -0,0 +1,62 @@
+"""
+Условные GET-запросы (ETag / Last-Modified) для справочных данных API.
+
+Валидатор ответа строится по queryset одним агрегирующим запросом:
+число строк и максимальное значение updated (в том числе у связанных
+моделей, которые попадают в ответ). Если клиент прислал совпадающий
+If-None-Match или If-Modified-Since, возвращается 304 без сериализации.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """Миксин для viewset'ов только для чтения"""
+    # Пути к связанным моделям, изменения которых видны в ответе (например, 'category')
+    conditional_related = ()
+
+    def get_validators(self, queryset):
+        """Возвращает (ETag, время последнего изменения в виде timestamp или None)"""
+        fields = ['updated', *(f'{path}__updated' for path in self.conditional_related)]
+        aggregates = {f'updated_{index}': Max(field) for index, field in enumerate(fields)}
+        data = queryset.order_by().aggregate(count=Count('pk'), **aggregates)
+
+        stamps = [data[name] for name in aggregates if data[name] is not None]
+        last_modified = max(stamps) if stamps else None
+        parts = [
+            self.request.accepted_renderer.format,
+            str(data['count']),
+            *(stamp.isoformat() for stamp in stamps),
+        ]
+        etag = quote_etag(hashlib.md5(':'.join(parts).encode()).hexdigest())
+        return etag, int(last_modified.timestamp()) if last_modified else None
+
+    def conditional_response(self, queryset, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(queryset)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response.headers.setdefault('ETag', etag)
+            if last_modified is not None:
+                response.headers.setdefault('Last-Modified', http_date(last_modified))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_response(queryset, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]}
+            )
+        except (TypeError, ValueError, ValidationError):
+            # Некорректный идентификатор: ответ 404 сформирует get_object()
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_response(queryset, super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.catalog import build_snapshot
+
+
+class Command(BaseCommand):
+    help = "Строит снимок каталога для мобильного приложения и сохраняет его в кэше (например, после деплоя)"
+
+    def handle(self, *args, **options):
+        snapshot = build_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f"Снимок каталога построен: {len(snapshot['body'])} байт, сжатый {len(snapshot['gzip'])} байт."
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import Tombstone
+from api.sync import TOMBSTONE_RETENTION
+
+
+class Command(BaseCommand):
+    help = "Удаляет отметки об удалении старше срока хранения (клиенты с таким курсором получат полный снимок)"
+
+    def handle(self, *args, **options):
+        deleted, _ = Tombstone.objects.filter(deleted__lt=timezone.now() - TOMBSTONE_RETENTION).delete()
+        self.stdout.write(self.style.SUCCESS(f"Удалено отметок: {deleted}."))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=50, verbose_name='Тип данных')),
+                ('object_id', models.PositiveBigIntegerField(verbose_name='ID объекта')),
+                ('deleted', models.DateTimeField(auto_now_add=True, verbose_name='Удален')),
+                ('owner', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Владелец')),
+            ],
+            options={
+                'verbose_name': 'Удаленный объект',
+                'verbose_name_plural': 'Удаленные объекты',
+                'indexes': [models.Index(fields=['deleted'], name='tombstone_deleted_idx'), models.Index(fields=['owner', 'deleted'], name='tombstone_owner_deleted_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,25 @@
 from django.db import models
+from django.contrib.auth import get_user_model
 
-# Create your models here.
+User = get_user_model()
+
+class Tombstone(models.Model):
+    """Отметка об удалении объекта для синхронизации мобильного приложения (см. api.sync)"""
+    resource = models.CharField(max_length=50, verbose_name="Тип данных")
+    object_id = models.PositiveBigIntegerField(verbose_name="ID объекта")
+    # Владелец для личных данных (например, записей клиента); для каталога не заполняется.
+    # Без ограничения внешнего ключа, чтобы отметки создавались и при удалении самого пользователя
+    owner = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                              related_name='+', verbose_name="Владелец")
+    deleted = models.DateTimeField(auto_now_add=True, verbose_name="Удален")
+    
+    class Meta:
+        verbose_name = "Удаленный объект"
+        verbose_name_plural = "Удаленные объекты"
+        indexes = [
+            models.Index(fields=['deleted'], name='tombstone_deleted_idx'),
+            models.Index(fields=['owner', 'deleted'], name='tombstone_owner_deleted_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.resource} #{self.object_id}"
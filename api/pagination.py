@@ -0,0 +1,112 @@
+"""
+Постраничный вывод по курсору (keyset pagination).
+
+Следующая страница выбирается условием "строго после последней строки"
+по упорядоченному набору полей, например (date, time, id), а не через
+OFFSET, поэтому глубокие страницы стоят столько же, сколько первая,
+и новые записи не сдвигают уже выданные страницы. COUNT(*) не выполняется.
+
+Для обратной совместимости при передаче параметров page или ordering
+используется обычная постраничная навигация по номерам страниц.
+Курсор и условие выборки общие с HTML-списками (core.pagination).
+"""
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+from core.pagination import decode_cursor, encode_cursor, flip_ordering, keyset_condition
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по курсору. Порядок задается атрибутом cursor_ordering представления;
+    последнее поле должно быть уникальным (обычно id).
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    ordering = ('-created', '-id')
+    # Параметры запроса, при которых используется нумерация страниц
+    page_number_query_params = ('page', api_settings.ORDERING_PARAM)
+    page_number_class = PageNumberPagination
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_number = None
+        if any(param in request.query_params for param in self.page_number_query_params):
+            self.page_number = self.page_number_class()
+            return self.page_number.paginate_queryset(queryset, request, view)
+
+        self.ordering = tuple(getattr(view, 'cursor_ordering', self.ordering))
+        self.model = queryset.model
+        values, reverse = self.decode_cursor(request)
+
+        ordering = flip_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(keyset_condition(ordering, values))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = True if reverse else has_more
+        self.has_previous = has_more if reverse else values is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.page_number is not None:
+            return self.page_number.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Курсор страницы из полей next/previous предыдущего ответа.',
+            'schema': {'type': 'string'},
+        }]
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._link(self.page[0], reverse=True)
+
+    def _link(self, obj, reverse):
+        cursor = encode_cursor(obj, self.ordering, reverse)
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """Возвращает (значения полей последней выданной строки, направление) или (None, False)"""
+        try:
+            return decode_cursor(request.query_params.get(self.cursor_query_param), self.model, self.ordering)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
@@ -0,0 +1,86 @@
+"""
+Автоматическая подгрузка связанных объектов для сериализаторов.
+
+По дереву полей сериализатора определяется, какие связи нужно загрузить
+через select_related (внешние ключи и один-к-одному) и какие через
+prefetch_related (связи "многие"), чтобы вывод списка не порождал
+отдельный запрос на каждый объект.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+
+
+def _relation(model, name):
+    """Поле модели, через которое идет связь, или None"""
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return field if field.is_relation else None
+
+
+def _walk(serializer, model, prefix, many, select, prefetch):
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        if isinstance(field, serializers.ListSerializer):
+            child, field_many = field.child, True
+        elif isinstance(field, serializers.ManyRelatedField):
+            child, field_many = None, True
+        elif isinstance(field, serializers.BaseSerializer):
+            child, field_many = field, False
+        else:
+            # Связанные поля вида PrimaryKeyRelatedField читают только *_id
+            continue
+
+        current_model, path, path_many = model, prefix, many
+        for name in field.source.split('.'):
+            relation = _relation(current_model, name)
+            if relation is None:
+                break
+            path = f'{path}__{name}' if path else name
+            path_many = path_many or relation.many_to_many or relation.one_to_many
+            current_model = relation.related_model
+        else:
+            (prefetch if path_many or field_many else select).add(path)
+            if child is not None:
+                _walk(child, current_model, path, path_many or field_many, select, prefetch)
+
+
+def get_related_lookups(serializer):
+    """
+    Возвращает пару множеств (select_related, prefetch_related) для экземпляра сериализатора.
+    Учитываются только поля, которые есть в сериализаторе, поэтому урезанный
+    набор полей дает и урезанный набор связей.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    select, prefetch = set(), set()
+    _walk(serializer, serializer.Meta.model, '', False, select, prefetch)
+
+    # Вложенные пути делают родительские лишними
+    select = {path for path in select if not any(other.startswith(f'{path}__') for other in select)}
+    prefetch = {path for path in prefetch if not any(other.startswith(f'{path}__') for other in prefetch)}
+    return sorted(select), sorted(prefetch)
+
+
+def optimize_queryset(queryset, serializer):
+    """Добавляет к queryset подгрузку связей, нужных сериализатору"""
+    select, prefetch = get_related_lookups(serializer)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+class PrefetchSerializerMixin:
+    """
+    Миксин для viewset'ов: подгружает связанные объекты,
+    необходимые сериализатору текущего действия.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return optimize_queryset(queryset, self.get_serializer())
@@ -1,28 +1,120 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from services.models import Service, ServiceCategory, ServiceReview
 from locations.models import Location
-from appointments.models import Appointment, Review
+from appointments.models import Appointment, Review, get_salon_timezone
+from appointments.availability import MAX_RANGE_DAYS, is_bookable_time
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 User = get_user_model()
 
-class UserSerializer(serializers.ModelSerializer):
+def parse_field_paths(value):
+    """
+    Разбирает список путей через запятую ("id,service.name,service.category")
+    в дерево {"id": {}, "service": {"name": {}, "category": {}}}.
+    """
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for name in filter(None, (part.strip() for part in path.split('.'))):
+            node = node.setdefault(name, {})
+    return tree
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    Сериализатор с выбором полей через параметры запроса:
+    ?fields= оставляет только перечисленные поля (вложенные указываются через точку),
+    ?expand= перечисляет вложенные объекты, которые нужно вывести целиком,
+    остальные вложенные объекты заменяются их id.
+    Без параметров, а также при запросах на запись выводятся все поля
+    со всеми вложенными объектами.
+    """
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        # Набор полей можно задать и явно, тогда параметры запроса не учитываются
+        super().__init__(*args, **kwargs)
+        if fields is not None or expand is not None:
+            self._field_spec = (
+                parse_field_paths(fields) or None if fields is not None else None,
+                parse_field_paths(expand) if expand is not None else None,
+            )
+    
+    def get_field_spec(self):
+        """Возвращает пару деревьев (fields, expand), где None означает отсутствие ограничений"""
+        if hasattr(self, '_field_spec'):
+            return self._field_spec
+        root = self.parent if isinstance(self.parent, serializers.ListSerializer) else self
+        request = self.context.get('request')
+        # При записи нужны все поля, иначе часть данных не пройдет валидацию
+        if root.parent is not None or request is None or request.method not in SAFE_METHODS:
+            return None, None
+        query_params = request.query_params
+        fields = parse_field_paths(query_params['fields']) if 'fields' in query_params else None
+        expand = parse_field_paths(query_params['expand']) if 'expand' in query_params else None
+        return fields or None, expand
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        only, expand = self.get_field_spec()
+        if only is None and expand is None:
+            return fields
+        
+        for name, field in list(fields.items()):
+            if field.write_only:
+                continue
+            if only is not None and name not in only:
+                del fields[name]
+                continue
+            if not isinstance(field, serializers.BaseSerializer):
+                continue
+            
+            nested_only = only.get(name) if only is not None else None
+            if expand is not None and name not in expand and not nested_only:
+                # Вложенный объект не запрошен: выводим только его id
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    source=field.source, read_only=True,
+                    many=isinstance(field, serializers.ListSerializer)
+                )
+                continue
+            
+            child = field.child if isinstance(field, serializers.ListSerializer) else field
+            child._field_spec = (nested_only or None, expand.get(name, {}) if expand is not None else None)
+        return fields
+
+class UserSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'email']
 
-class LocationSerializer(serializers.ModelSerializer):
+class LocationSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Location
-        fields = ['id', 'name', 'address', 'phone', 'email', 'working_hours', 'description', 'is_active']
+        fields = ['id', 'name', 'address', 'phone', 'email', 'working_hours', 'description', 'is_active',
+                  'rating_avg', 'rating_count']
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    """Параметры запроса свободного времени филиала"""
+    service = serializers.PrimaryKeyRelatedField(queryset=Service.objects.filter(is_active=True))
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    
+    def validate(self, attrs):
+        attrs.setdefault('start', timezone.localdate(timezone=get_salon_timezone()))
+        attrs.setdefault('end', attrs['start'])
+        if attrs['end'] < attrs['start']:
+            raise serializers.ValidationError("Дата окончания периода не может быть раньше даты начала.")
+        if (attrs['end'] - attrs['start']).days >= MAX_RANGE_DAYS:
+            raise serializers.ValidationError(f"Период не может превышать {MAX_RANGE_DAYS} дней.")
+        return attrs
 
-class ServiceCategorySerializer(serializers.ModelSerializer):
+class ServiceCategorySerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = ServiceCategory
         fields = ['id', 'name', 'description', 'image', 'icon']
 
-class ServiceSerializer(serializers.ModelSerializer):
+class ServiceSerializer(DynamicFieldsModelSerializer):
     category = ServiceCategorySerializer(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=ServiceCategory.objects.all(),
         write_only=True,
@@ -31,9 +123,10 @@ class ServiceSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Service
-        fields = ['id', 'name', 'description', 'price', 'duration', 'image', 'is_active', 'category', 'category_id']
+        fields = ['id', 'name', 'description', 'price', 'duration', 'image', 'is_active', 'category', 'category_id',
+                  'rating_avg', 'rating_count', 'rating_histogram']
 
-class ServiceReviewSerializer(serializers.ModelSerializer):
+class ServiceReviewSerializer(DynamicFieldsModelSerializer):
     user = UserSerializer(read_only=True)
     service = ServiceSerializer(read_only=True)
     service_id = serializers.PrimaryKeyRelatedField(
@@ -50,14 +143,14 @@ class ServiceReviewSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = ServiceReview
-        fields = ['id', 'user', 'service', 'service_id', 'location', 'location_id', 'rating', 'comment', 'is_published', 'created', 'modified']
-        read_only_fields = ['is_published', 'created', 'modified']
+        fields = ['id', 'user', 'service', 'service_id', 'location', 'location_id', 'rating', 'comment', 'is_published', 'created', 'updated']
+        read_only_fields = ['is_published', 'created', 'updated']
     
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(DynamicFieldsModelSerializer):
     client = UserSerializer(read_only=True)
     service = ServiceSerializer(read_only=True)
     service_id = serializers.PrimaryKeyRelatedField(
@@ -74,14 +167,52 @@ class AppointmentSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Appointment
-        fields = ['id', 'client', 'service', 'service_id', 'location', 'location_id', 'date', 'time', 'status', 'notes', 'created', 'modified']
-        read_only_fields = ['status', 'created', 'modified']
+        fields = ['id', 'client', 'service', 'service_id', 'location', 'location_id', 'date', 'time', 'status', 'notes', 'created', 'updated']
+        read_only_fields = ['status', 'created', 'updated']
+    
+    def validate(self, attrs):
+        """
+        Проверяем время по расписанию филиала, если оно задается или меняется.
+        Занятость другими записями проверяется при сохранении (ответ 409).
+        """
+        slot = {name: attrs.get(name, getattr(self.instance, name, None))
+                for name in ('service', 'location', 'date', 'time')}
+        changed = self.instance is None or any(slot[name] != getattr(self.instance, name) for name in slot)
+        if changed and None not in slot.values():
+            if not is_bookable_time(slot['location'], slot['service'], slot['date'], slot['time'],
+                                    exclude=self.instance.pk if self.instance else None):
+                raise serializers.ValidationError({
+                    'time': "Выбранное время недоступно для записи. Пожалуйста, выберите другое время."
+                })
+        return attrs
     
     def create(self, validated_data):
         validated_data['client'] = self.context['request'].user
         return super().create(validated_data)
 
-class ReviewSerializer(serializers.ModelSerializer):
+class AppointmentBulkItemSerializer(serializers.Serializer):
+    """
+    Элемент пакетного создания записей. Услуга, филиал и клиент передаются id
+    и проверяются во view общими запросами для всего пакета.
+    """
+    service_id = serializers.IntegerField()
+    location_id = serializers.IntegerField()
+    client_id = serializers.IntegerField(required=False)
+    date = serializers.DateField()
+    time = serializers.TimeField()
+    status = serializers.ChoiceField(choices=Appointment.STATUS_CHOICES, default='pending')
+    notes = serializers.CharField(required=False, allow_blank=True, default='')
+
+class AppointmentStatusItemSerializer(serializers.Serializer):
+    """Элемент пакетной смены статуса записей"""
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=Appointment.STATUS_CHOICES)
+
+class AppointmentIdsSerializer(serializers.Serializer):
+    """Список id записей для пакетной отмены"""
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+class ReviewSerializer(DynamicFieldsModelSerializer):
     appointment = AppointmentSerializer(read_only=True)
     appointment_id = serializers.PrimaryKeyRelatedField(
         queryset=Appointment.objects.all(),
@@ -91,8 +222,8 @@ class ReviewSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Review
-        fields = ['id', 'appointment', 'appointment_id', 'rating', 'comment', 'is_published', 'created', 'modified']
-        read_only_fields = ['is_published', 'created', 'modified']
+        fields = ['id', 'appointment', 'appointment_id', 'rating', 'comment', 'is_published', 'created', 'updated']
+        read_only_fields = ['is_published', 'created', 'updated']
     
     def validate_appointment_id(self, value):
         # Проверяем, что заявка принадлежит текущему пользователю и имеет статус "completed"
@@ -0,0 +1,137 @@
+"""
+Дельта-синхронизация для мобильного приложения.
+
+Клиент передает курсор из предыдущего ответа и получает только строки,
+у которых updated не раньше курсора, а также id удаленных объектов
+(отметки Tombstone) и объектов, ставших недоступными (неактивные услуги
+и филиалы, снятые с публикации отзывы). Без курсора, а также если курсор
+старше срока хранения отметок, отдается полный снимок с флагом reset.
+
+Курсор - время начала формирования ответа. Изменения выбираются с небольшим
+перекрытием (SYNC_OVERLAP), чтобы не потерять строки из транзакций, которые
+зафиксировались позже, поэтому часть строк может прийти повторно.
+"""
+import datetime
+from functools import partial
+
+from django.db.models import Q
+from django.db.models.signals import post_delete
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from appointments.models import Appointment
+from locations.models import Location
+from services.models import Service, ServiceCategory, ServiceReview
+from .models import Tombstone
+from .serializers import (
+    AppointmentSerializer, LocationSerializer, ServiceCategorySerializer,
+    ServiceReviewSerializer, ServiceSerializer,
+)
+
+SYNC_OVERLAP = datetime.timedelta(minutes=1)
+# Срок хранения отметок об удалении; с более старым курсором нужна полная синхронизация
+TOMBSTONE_RETENTION = datetime.timedelta(days=90)
+
+
+class SyncResource:
+    """Тип данных, который отдается при синхронизации"""
+
+    def __init__(self, name, model, serializer_class, visible=None, owner_field=None):
+        self.name = name
+        self.model = model
+        self.serializer_class = serializer_class
+        # Условие, при котором объект виден клиенту, например {'is_active': True}
+        self.visible = visible or {}
+        # Поле с пользователем для личных данных; такие данные отдаются только владельцу
+        self.owner_field = owner_field
+
+    def is_available(self, user):
+        return self.owner_field is None or user.is_authenticated
+
+    def get_queryset(self, user):
+        queryset = self.model._default_manager.all()
+        if self.owner_field:
+            queryset = queryset.filter(**{self.owner_field: user})
+        return queryset
+
+    def is_visible(self, obj):
+        return all(getattr(obj, field) == value for field, value in self.visible.items())
+
+
+SYNC_RESOURCES = [
+    SyncResource('categories', ServiceCategory, ServiceCategorySerializer),
+    SyncResource('services', Service, ServiceSerializer, visible={'is_active': True}),
+    SyncResource('locations', Location, LocationSerializer, visible={'is_active': True}),
+    SyncResource('service_reviews', ServiceReview, ServiceReviewSerializer, visible={'is_published': True}),
+    SyncResource('appointments', Appointment, AppointmentSerializer, owner_field='client'),
+]
+
+
+def encode_cursor(moment):
+    # Время в UTC с суффиксом Z: знак "+" в строке запроса превратился бы в пробел
+    return moment.astimezone(datetime.timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def decode_cursor(value):
+    """Разбирает курсор; при неверном значении вызывает ValueError"""
+    moment = parse_datetime(value)
+    if moment is None or timezone.is_naive(moment):
+        raise ValueError(value)
+    return moment
+
+
+def build_sync(user, since=None, context=None):
+    """
+    Возвращает изменения после since по всем типам данных одним словарем.
+    Вложенные объекты заменяются их id: все они тоже приходят при синхронизации.
+    """
+    now = timezone.now()
+    if since is not None and since < now - TOMBSTONE_RETENTION:
+        since = None
+    threshold = since - SYNC_OVERLAP if since is not None else None
+
+    changes, deleted = {}, {}
+    for resource in SYNC_RESOURCES:
+        if not resource.is_available(user):
+            continue
+        queryset = resource.get_queryset(user)
+        if threshold is None:
+            rows = list(queryset.filter(**resource.visible))
+        else:
+            rows = list(queryset.filter(updated__gte=threshold))
+
+        serializer = resource.serializer_class(
+            [row for row in rows if resource.is_visible(row)], many=True, context=context, expand=''
+        )
+        changes[resource.name] = serializer.data
+        deleted[resource.name] = [row.pk for row in rows if not resource.is_visible(row)]
+
+    if threshold is not None:
+        owners = Q(owner__isnull=True)
+        if user.is_authenticated:
+            owners |= Q(owner=user)
+        tombstones = Tombstone.objects.filter(owners, deleted__gte=threshold)
+        for name, object_id in tombstones.values_list('resource', 'object_id'):
+            if name in deleted:
+                deleted[name].append(object_id)
+
+    return {
+        'cursor': encode_cursor(now),
+        'reset': threshold is None,
+        'changes': changes,
+        'deleted': deleted,
+    }
+
+
+def _create_tombstone(resource, sender, instance, **kwargs):
+    owner_id = getattr(instance, f'{resource.owner_field}_id') if resource.owner_field else None
+    Tombstone.objects.create(resource=resource.name, object_id=instance.pk, owner_id=owner_id)
+
+
+def track_deletions():
+    """Подключает создание отметок об удалении для всех синхронизируемых моделей"""
+    for resource in SYNC_RESOURCES:
+        post_delete.connect(
+            partial(_create_tombstone, resource), sender=resource.model,
+            weak=False, dispatch_uid=f'tombstone:{resource.name}',
+        )
@@ -1,3 +1,483 @@
+import datetime
+import gzip
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from appointments.models import Appointment, AppointmentStatusLog, Review, SlotReservation
+from appointments.tests import create_catalog, next_weekday
+from locations.models import Location
+from services.models import Service, ServiceCategory, ServiceReview
+from .pagination import KeysetPagination
+from .sync import SYNC_OVERLAP, TOMBSTONE_RETENTION, decode_cursor, encode_cursor
+
+User = get_user_model()
+
+# Запросов на страницу списка: справочники - проверка ETag, COUNT и страница,
+# списки с курсором - только страница со всеми связанными объектами
+LIST_QUERIES = {
+    '/api/v1/categories/': 3,
+    '/api/v1/services/': 3,
+    '/api/v1/locations/': 3,
+    '/api/v1/service-reviews/': 1,
+    '/api/v1/appointments/': 1,
+    '/api/v1/reviews/': 1,
+}
+
+
+class ListQueryCountTest(TestCase):
+    """Число запросов к спискам API не зависит от количества объектов на странице"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user('client', first_name="Анна", last_name="Иванова")
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cls.date = datetime.date.today() + datetime.timedelta(days=1)
+        cls.created = 0
+
+    def add_objects(self, count):
+        """Добавляет по count объектов каждого вида, каждый со своими связанными объектами"""
+        for _ in range(count):
+            index = self.created = self.created + 1
+            category = ServiceCategory.objects.create(name=f"Категория {index}")
+            service = Service.objects.create(
+                category=category, name=f"Услуга {index}", description="", price=1000,
+                duration=datetime.timedelta(minutes=30),
+            )
+            location = Location.objects.create(
+                name=f"Филиал {index}", address=f"ул. Ленина, {index}", phone="+7 900 000-00-00",
+                email=f"branch{index}@example.com", working_hours="Пн-Вс: 09:00-21:00",
+            )
+            user = User.objects.create_user(f'user{index}')
+            ServiceReview.objects.create(
+                user=user, service=service, location=location, rating=5, comment="Отлично",
+            )
+            appointment = Appointment.objects.create(
+                client=self.client_user, service=service, location=location,
+                date=self.date, time=datetime.time(10, 0), status='completed',
+            )
+            Review.objects.create(appointment=appointment, rating=5, comment="Спасибо")
+
+    def count_queries(self, api, url):
+        with CaptureQueriesContext(connection) as context:
+            response = api.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), len(response.data['results'])
+
+    def assert_query_counts(self, user):
+        api = APIClient()
+        api.force_authenticate(user)
+
+        self.add_objects(2)
+        small = {url: self.count_queries(api, url) for url in LIST_QUERIES}
+        self.add_objects(8)
+        large = {url: self.count_queries(api, url) for url in LIST_QUERIES}
+
+        for url, expected in LIST_QUERIES.items():
+            with self.subTest(url):
+                self.assertLess(small[url][1], large[url][1])
+                self.assertEqual(small[url][0], expected)
+                self.assertEqual(large[url][0], expected)
+
+    def test_staff(self):
+        self.assert_query_counts(self.staff)
+
+    def test_client(self):
+        self.assert_query_counts(self.client_user)
+
+    def test_expanded_fields(self):
+        api = APIClient()
+        api.force_authenticate(self.staff)
+        url = '/api/v1/reviews/?fields=id,appointment.client,appointment.service.category'
+        self.add_objects(2)
+        small = self.count_queries(api, url)
+        self.add_objects(8)
+        self.assertEqual(self.count_queries(api, url)[0], small[0])
+
+
+class AppointmentScheduleTest(TestCase):
+    """Записи через API проверяются по часам работы филиала"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.location.working_hours = "Пн-Пт: 10:00-19:00"
+        cls.location.save()
+        cls.monday = next_weekday(0)
+        cls.client_user = User.objects.create_user('client')
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+
+    def item(self, date, time):
+        return {
+            'service_id': self.service.pk, 'location_id': self.location.pk,
+            'date': date.isoformat(), 'time': time,
+        }
+
+    def test_outside_working_hours(self):
+        sunday = self.monday + datetime.timedelta(days=6)
+        for date, time in ((self.monday, '03:00'), (self.monday, '18:30'), (sunday, '12:00')):
+            with self.subTest(date=date, time=time):
+                response = self.api.post('/api/v1/appointments/', self.item(date, time), format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('time', response.data)
+        self.assertFalse(Appointment.objects.exists())
+
+        response = self.api.post('/api/v1/appointments/', self.item(self.monday, '18:00'), format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_bulk_reports_each_item(self):
+        self.api.force_authenticate(self.staff)
+        response = self.api.post('/api/v1/appointments/bulk/', [
+            self.item(self.monday, '10:00'),
+            self.item(self.monday, '03:00'),
+            self.item(self.monday, '10:30'),
+        ], format='json')
+        self.assertEqual(response.status_code, 207)
+        results = response.data['results']
+        self.assertIn('id', results[0])
+        self.assertEqual(results[1]['errors']['time'], ["Выбранное время недоступно для записи."])
+        self.assertIn('errors', results[2])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_update_keeps_off_grid_time(self):
+        appointment = Appointment.objects.create(
+            client=self.client_user, service=self.service, location=self.location,
+            date=self.monday, time=datetime.time(10, 15),
+        )
+        url = f'/api/v1/appointments/{appointment.pk}/'
+        response = self.api.patch(url, {'notes': "Без опозданий"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.api.patch(url, {'time': '10:45'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogSnapshotTest(TestCase):
+    URL = '/api/v1/catalog/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, **headers):
+        return self.client.get(self.URL, headers=headers)
+
+    def test_cached_snapshot_and_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(json.loads(response.content)['services'][0]['name'], "LPG массаж")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get().content, response.content)
+            response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+    def test_change_rebuilds_snapshot(self):
+        etag = self.get().headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.name = "LPG массаж лица"
+            self.service.save()
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(json.loads(response.content)['services'][0]['name'], "LPG массаж лица")
+
+    def test_gzip_negotiation(self):
+        plain = self.get()
+        self.assertNotIn('Content-Encoding', plain.headers)
+        cases = {
+            'gzip, deflate, br': True,
+            'br;q=1.0, gzip;q=0.5': True,
+            '*': True,
+            'gzip;q=0': False,
+            'GZIP; Q=0.000': False,
+            'br, *;q=0': False,
+            'identity': False,
+        }
+        for header, gzipped in cases.items():
+            with self.subTest(accept_encoding=header):
+                response = self.get(accept_encoding=header)
+                self.assertIn('Accept-Encoding', response.headers['Vary'])
+                if gzipped:
+                    self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+                    self.assertEqual(gzip.decompress(response.content), plain.content)
+                    self.assertNotEqual(response.headers['ETag'], plain.headers['ETag'])
+                else:
+                    self.assertNotIn('Content-Encoding', response.headers)
+                    self.assertEqual(response.content, plain.content)
+
+
+@mock.patch.object(KeysetPagination, 'page_size', 2)
+class KeysetPaginationTest(TestCase):
+    URL = '/api/v1/appointments/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.other_location = Location.objects.create(
+            name="Север", address="ул. Северная, 2", phone="+7 900 000-00-01",
+            email="north@example.com", working_hours="Пн-Вс: 09:00-21:00",
+        )
+        cls.client_user = User.objects.create_user('client')
+        cls.start = datetime.date.today() + datetime.timedelta(days=10)
+        # Две записи на одни дата и время в разных филиалах: порядок между ними задает id
+        cls.appointments = [
+            cls.book(cls.location, cls.start + datetime.timedelta(days=days))
+            for days in (0, 1, 2, 3)
+        ] + [cls.book(cls.other_location, cls.start + datetime.timedelta(days=2))]
+
+    @classmethod
+    def book(cls, location, date, time=datetime.time(12, 0)):
+        return Appointment.objects.create(
+            client=cls.client_user, service=cls.service, location=location, date=date, time=time,
+        )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+
+    def walk(self, url, link='next'):
+        """id записей на всех страницах начиная с url"""
+        ids = []
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.append([item['id'] for item in response.data['results']])
+            url = response.data[link]
+        return ids
+
+    def expected_order(self):
+        appointments = sorted(self.appointments, key=lambda a: (a.date, a.time, a.pk), reverse=True)
+        return [appointment.pk for appointment in appointments]
+
+    def test_pages_cover_all_rows_once(self):
+        pages = self.walk(self.URL)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), self.expected_order())
+
+    def test_inserts_do_not_shift_pages(self):
+        expected = self.expected_order()
+        first = self.api.get(self.URL).data
+        # Новые записи в начале и в середине списка после выдачи первой страницы
+        self.book(self.location, self.start + datetime.timedelta(days=30))
+        middle = self.book(self.location, self.start + datetime.timedelta(days=1), datetime.time(15, 0))
+        rest = sum(self.walk(first['next']), [])
+        self.assertEqual([item['id'] for item in first['results']], expected[:2])
+        self.assertEqual(rest, expected[2:3] + [middle.pk] + expected[3:])
+
+    def test_previous_link(self):
+        first = self.api.get(self.URL).data
+        second = self.api.get(first['next']).data
+        previous = self.api.get(second['previous']).data
+        self.assertEqual(previous['results'], first['results'])
+        self.assertIsNone(first['previous'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.api.get(self.URL, {'cursor': 'not-a-cursor'}).status_code, 404)
+
+
+class BulkStatusTest(TestCase):
+    """Пакетная смена статусов: результат по каждому элементу, ошибки одних не мешают другим"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.client_user = User.objects.create_user('client')
+        cls.other_user = User.objects.create_user('other')
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cls.date = datetime.date.today() + datetime.timedelta(days=5)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.staff)
+
+    def book(self, time, status='pending', client=None):
+        return Appointment.objects.create(
+            client=client or self.client_user, service=self.service, location=self.location,
+            date=self.date, time=time, status=status,
+        )
+
+    def test_same_status_is_error(self):
+        canceled = self.book(datetime.time(10, 0), status='canceled')
+        pending = self.book(datetime.time(12, 0))
+        response = self.api.post('/api/v1/appointments/bulk-status/', [
+            {'id': canceled.pk, 'status': 'canceled'}, {'id': pending.pk, 'status': 'pending'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [item['errors']['status'] for item in response.data['results']],
+            [["Запись уже в статусе «Отменена»."], ["Запись уже в статусе «Ожидает подтверждения»."]],
+        )
+
+        response = self.api.post(f'/api/v1/appointments/{canceled.pk}/cancel/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(AppointmentStatusLog.objects.exists())
+
+    def test_partial_failure(self):
+        pending = self.book(datetime.time(10, 0))
+        completed = self.book(datetime.time(12, 0), status='completed')
+        # Время отмененной записи уже заняла другая
+        canceled = self.book(datetime.time(14, 0), status='canceled')
+        self.book(datetime.time(14, 0), client=self.other_user)
+
+        response = self.api.post('/api/v1/appointments/bulk-status/', [
+            {'id': pending.pk, 'status': 'confirmed'},
+            {'id': 0, 'status': 'confirmed'},
+            {'id': pending.pk, 'status': 'completed'},
+            {'id': completed.pk, 'status': 'pending'},
+            {'id': canceled.pk, 'status': 'pending'},
+            {'id': pending.pk, 'status': 'unknown'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (1, 5))
+        results = response.data['results']
+        self.assertEqual(results[0]['status'], 'confirmed')
+        self.assertEqual(results[1]['errors'], {'id': ["Запись не найдена."]})
+        self.assertEqual(results[2]['errors'], {'id': ["Запись указана повторно."]})
+        self.assertIn('status', results[3]['errors'])
+        self.assertIn('status', results[4]['errors'])
+        self.assertIn('status', results[5]['errors'])
+
+        statuses = dict(Appointment.objects.values_list('pk', 'status'))
+        self.assertEqual(
+            [statuses[pending.pk], statuses[completed.pk], statuses[canceled.pk]],
+            ['confirmed', 'completed', 'canceled'],
+        )
+        self.assertEqual(AppointmentStatusLog.objects.get().appointment_id, pending.pk)
+
+    def test_all_failed(self):
+        response = self.api.post('/api/v1/appointments/bulk-status/', [{'id': 0, 'status': 'confirmed'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['failed'], 1)
+
+    def test_cancel_releases_and_restore_reserves(self):
+        first = self.book(datetime.time(10, 0))
+        second = self.book(datetime.time(12, 0))
+        response = self.api.post('/api/v1/appointments/bulk-status/', [
+            {'id': first.pk, 'status': 'canceled'}, {'id': second.pk, 'status': 'canceled'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SlotReservation.objects.exists())
+
+        response = self.api.post('/api/v1/appointments/bulk-status/', [
+            {'id': first.pk, 'status': 'confirmed'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SlotReservation.objects.filter(appointment=first).count(), 4)
+
+    def test_client_bulk_cancel(self):
+        self.api.force_authenticate(self.client_user)
+        own = self.book(datetime.time(10, 0))
+        completed = self.book(datetime.time(12, 0), status='completed')
+        foreign = self.book(datetime.time(14, 0), client=self.other_user)
+
+        response = self.api.post('/api/v1/appointments/bulk-cancel/', {
+            'ids': [own.pk, completed.pk, foreign.pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 207)
+        results = response.data['results']
+        self.assertNotIn('errors', results[0])
+        self.assertIn('status', results[1]['errors'])
+        self.assertEqual(results[2]['errors'], {'id': ["Запись не найдена."]})
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.status, 'pending')
+        self.assertEqual(Appointment.objects.get(pk=own.pk).status, 'canceled')
+
+
+class SyncTest(TestCase):
+    URL = '/api/v1/sync/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.client_user = User.objects.create_user('client')
+        cls.other_user = User.objects.create_user('other')
+        cls.date = datetime.date.today() + datetime.timedelta(days=5)
+        cls.appointment = Appointment.objects.create(
+            client=cls.client_user, service=cls.service, location=cls.location,
+            date=cls.date, time=datetime.time(12, 0),
+        )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.client_user)
+
+    def sync(self, since=None, api=None):
+        response = (api or self.api).get(self.URL, {'since': since} if since else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def ids(self, data, name, key='changes'):
+        return [item['id'] for item in data[key][name]] if key == 'changes' else data[key][name]
+
+    def test_full_sync(self):
+        inactive = Service.objects.create(
+            category=self.service.category, name="Архив", description="", price=1,
+            duration=datetime.timedelta(minutes=30), is_active=False,
+        )
+        data = self.sync()
+        self.assertTrue(data['reset'])
+        self.assertEqual(self.ids(data, 'services'), [self.service.pk])
+        self.assertNotIn(inactive.pk, self.ids(data, 'services'))
+        self.assertEqual(self.ids(data, 'appointments'), [self.appointment.pk])
+
+        anonymous = self.sync(api=APIClient())
+        self.assertNotIn('appointments', anonymous['changes'])
+
+    def test_deleted_objects_since_cursor(self):
+        cursor = self.sync()['cursor']
+        location = Location.objects.create(
+            name="Временный", address="", phone="", email="tmp@example.com", working_hours="",
+        )
+        location_id = location.pk
+        appointment_id = self.appointment.pk
+        location.delete()
+        self.appointment.delete()
+        self.service.is_active = False
+        self.service.save()
+
+        data = self.sync(cursor)
+        self.assertFalse(data['reset'])
+        self.assertIn(location_id, data['deleted']['locations'])
+        self.assertEqual(data['deleted']['appointments'], [appointment_id])
+        self.assertEqual(data['deleted']['services'], [self.service.pk])
+        self.assertEqual(data['changes']['services'], [])
+
+        # Удаленная запись клиента не видна другим пользователям
+        other = APIClient()
+        other.force_authenticate(self.other_user)
+        self.assertEqual(self.sync(cursor, api=other)['deleted']['appointments'], [])
+
+    def test_overlap_window(self):
+        data = self.sync()
+        since = decode_cursor(data['cursor'])
+        category = self.service.category
+        # Строка из транзакции, зафиксированной чуть позже выдачи курсора, но с более ранним updated
+        ServiceCategory.objects.filter(pk=category.pk).update(updated=since - SYNC_OVERLAP / 2)
+        Location.objects.filter(pk=self.location.pk).update(updated=since - SYNC_OVERLAP * 2)
+
+        data = self.sync(data['cursor'])
+        self.assertEqual(self.ids(data, 'categories'), [category.pk])
+        self.assertEqual(self.ids(data, 'locations'), [])
 
-# Create your tests here.
+    def test_stale_or_invalid_cursor(self):
+        stale = encode_cursor(timezone.now() - TOMBSTONE_RETENTION - datetime.timedelta(days=1))
+        self.assertTrue(self.sync(stale)['reset'])
+        self.assertEqual(self.api.get(self.URL, {'since': 'вчера'}).status_code, 400)
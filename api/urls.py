@@ -41,6 +41,12 @@ urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     
+    # Снимок каталога для главного экрана мобильного приложения
+    path('catalog/', views.catalog_snapshot, name='catalog'),
+    
+    # Дельта-синхронизация для мобильного приложения
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    
     # API endpoints
     path('', include(router.urls)),
 ]
\ No newline at end of file
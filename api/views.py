@@ -1,12 +1,31 @@
 from rest_framework import viewsets, permissions, filters, status
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from .serializers import *
+from .prefetch import PrefetchSerializerMixin, optimize_queryset
+from .pagination import KeysetPagination
+from .conditional import ConditionalGetMixin
+from .sync import build_sync, decode_cursor
+from .catalog import get_snapshot
 from services.models import Service, ServiceCategory, ServiceReview
 from locations.models import Location
 from appointments.models import Appointment, Review
+from appointments.availability import get_available_slots, SLOT_INTERVAL
+from appointments.booking import SlotUnavailable, bulk_book
+from appointments.transitions import InvalidTransition, apply_transitions, transition
+from appointments.export import export_response
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.http import require_safe
+
+User = get_user_model()
 
 class IsOwnerOrStaff(permissions.BasePermission):
     """
@@ -22,7 +41,13 @@ class IsOwnerOrStaff(permissions.BasePermission):
             return obj.appointment.client == request.user or request.user.is_staff
         return request.user.is_staff
 
-class ServiceCategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class SlotConflict(APIException):
+    """Выбранное время уже занято другой записью"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Выбранное время уже занято. Пожалуйста, выберите другое время."
+    default_code = 'slot_unavailable'
+
+class ServiceCategoryViewSet(ConditionalGetMixin, PrefetchSerializerMixin, viewsets.ReadOnlyModelViewSet):
     """
     API для просмотра категорий услуг.
     """
@@ -32,12 +57,13 @@ class ServiceCategoryViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'description']
 
-class ServiceViewSet(viewsets.ReadOnlyModelViewSet):
+class ServiceViewSet(ConditionalGetMixin, PrefetchSerializerMixin, viewsets.ReadOnlyModelViewSet):
     """
     API для просмотра услуг.
     """
     queryset = Service.objects.filter(is_active=True)
     serializer_class = ServiceSerializer
+    conditional_related = ('category',)
     permission_classes = [permissions.AllowAny]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['category', 'is_active']
@@ -49,11 +75,15 @@ class ServiceViewSet(viewsets.ReadOnlyModelViewSet):
         Получить отзывы о конкретной услуге.
         """
         service = self.get_object()
-        reviews = ServiceReview.objects.filter(service=service, is_published=True)
-        serializer = ServiceReviewSerializer(reviews, many=True)
+        context = self.get_serializer_context()
+        reviews = optimize_queryset(
+            ServiceReview.objects.filter(service=service, is_published=True),
+            ServiceReviewSerializer(many=True, context=context)
+        )
+        serializer = ServiceReviewSerializer(reviews, many=True, context=context)
         return Response(serializer.data)
 
-class LocationViewSet(viewsets.ReadOnlyModelViewSet):
+class LocationViewSet(ConditionalGetMixin, PrefetchSerializerMixin, viewsets.ReadOnlyModelViewSet):
     """
     API для просмотра филиалов.
     """
@@ -62,8 +92,34 @@ class LocationViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [permissions.AllowAny]
     filter_backends = [filters.SearchFilter]
     search_fields = ['name', 'address']
+    
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        """
+        Получить свободное время для записи на услугу в филиал.
+        Параметры: service (обязательный), start и end (даты в формате ГГГГ-ММ-ДД).
+        """
+        location = self.get_object()
+        query = AvailabilityQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        service = query.validated_data['service']
+        start = query.validated_data['start']
+        end = query.validated_data['end']
+        
+        slots = get_available_slots(location, service, start, end)
+        return Response({
+            'location': location.pk,
+            'service': service.pk,
+            'start': start,
+            'end': end,
+            'slot_interval': int(SLOT_INTERVAL.total_seconds() // 60),
+            'days': [
+                {'date': date, 'slots': [time.strftime('%H:%M') for time in times]}
+                for date, times in slots.items()
+            ],
+        })
 
-class ServiceReviewViewSet(viewsets.ModelViewSet):
+class ServiceReviewViewSet(PrefetchSerializerMixin, viewsets.ModelViewSet):
     """
     API для просмотра и создания отзывов об услугах.
     """
@@ -72,6 +128,8 @@ class ServiceReviewViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['service', 'location', 'rating', 'is_published']
     ordering_fields = ['created', 'rating']
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created', '-id')
     
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -81,7 +139,7 @@ class ServiceReviewViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user, is_published=False)
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(PrefetchSerializerMixin, viewsets.ModelViewSet):
     """
     API для управления записями на процедуры.
     """
@@ -90,6 +148,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['service', 'location', 'status', 'date']
     ordering_fields = ['date', 'time', 'created']
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-date', '-time', '-id')
+    # Максимальное количество элементов в пакетных запросах
+    bulk_max_items = 500
     
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -97,7 +159,16 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         return Appointment.objects.filter(client=self.request.user)
     
     def perform_create(self, serializer):
-        serializer.save(client=self.request.user, status='pending')
+        try:
+            serializer.save(client=self.request.user, status='pending')
+        except SlotUnavailable:
+            raise SlotConflict()
+    
+    def perform_update(self, serializer):
+        try:
+            serializer.save()
+        except SlotUnavailable:
+            raise SlotConflict()
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -105,18 +176,187 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         Отменить запись
         """
         appointment = self.get_object()
-        if appointment.status in ['completed', 'canceled']:
+        try:
+            transition(appointment, 'canceled', user=request.user, source='api')
+        except InvalidTransition:
             return Response(
                 {"error": "Невозможно отменить завершенную или уже отмененную запись."},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        appointment.status = 'canceled'
-        appointment.save()
         serializer = self.get_serializer(appointment)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'], url_path=r'export/(?P<file_format>csv|xlsx)')
+    def export(self, request, file_format=None):
+        """
+        Выгрузить записи в CSV или XLSX с учетом фильтров и сортировки (потоком, без пагинации)
+        """
+        return export_response(self.filter_queryset(self.get_queryset()), file_format)
+    
+    def get_bulk_items(self, data):
+        """Проверяет, что тело пакетного запроса - список допустимой длины"""
+        if not isinstance(data, list) or not data:
+            raise ValidationError({'non_field_errors': ["Ожидается непустой список объектов."]})
+        if len(data) > self.bulk_max_items:
+            raise ValidationError({'non_field_errors': [f"Не более {self.bulk_max_items} элементов за один запрос."]})
+        return data
+    
+    def bulk_response(self, results, success_status=status.HTTP_200_OK):
+        """Ответ с результатом по каждому элементу пакета"""
+        failed = sum('errors' in result for result in results)
+        if not failed:
+            response_status = success_status
+        elif failed == len(results):
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS
+        return Response({
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'results': results,
+        }, status=response_status)
+    
+    @action(detail=False, methods=['post'], url_path='bulk', permission_classes=[permissions.IsAdminUser])
+    def bulk_create(self, request):
+        """
+        Создать несколько записей одним запросом (только для администраторов).
+        Принимает список объектов с полями service_id, location_id, date, time
+        и необязательными client_id, status, notes.
+        """
+        items = self.get_bulk_items(request.data)
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = AppointmentBulkItemSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'index': index, 'errors': serializer.errors}
+        
+        # Услуги, филиалы и клиенты загружаются одним запросом на весь пакет
+        services = Service.objects.in_bulk({data['service_id'] for _, data in valid})
+        locations = Location.objects.in_bulk({data['location_id'] for _, data in valid})
+        clients = User.objects.in_bulk({data.get('client_id', request.user.pk) for _, data in valid})
+        
+        appointments = {}
+        for index, data in valid:
+            service = services.get(data['service_id'])
+            location = locations.get(data['location_id'])
+            client = clients.get(data.get('client_id', request.user.pk))
+            errors = {}
+            if service is None or not service.is_active:
+                errors['service_id'] = ["Услуга не найдена."]
+            if location is None or not location.is_active:
+                errors['location_id'] = ["Филиал не найден."]
+            if client is None:
+                errors['client_id'] = ["Клиент не найден."]
+            if errors:
+                results[index] = {'index': index, 'errors': errors}
+                continue
+            appointments[index] = Appointment(
+                client=client, service=service, location=location,
+                date=data['date'], time=data['time'], status=data['status'], notes=data['notes'],
+            )
+        
+        try:
+            with transaction.atomic():
+                errors = {id(appointment): error for appointment, error in bulk_book(list(appointments.values()))}
+        except SlotUnavailable:
+            raise SlotConflict()
+        
+        for index, appointment in appointments.items():
+            error = errors.get(id(appointment))
+            if isinstance(error, SlotUnavailable):
+                results[index] = {'index': index, 'errors': {'time': [SlotConflict.default_detail]}}
+            elif error is not None:
+                results[index] = {'index': index, 'errors': {'time': [str(error)]}}
+            else:
+                results[index] = {'index': index, 'id': appointment.pk}
+        return self.bulk_response(results, status.HTTP_201_CREATED)
+    
+    def apply_statuses(self, changes, results):
+        """
+        Применяет смену статусов {запись: (номер элемента, статус)} пакетно
+        в одной транзакции и записывает в results результат по каждому элементу.
+        """
+        try:
+            errors = apply_transitions(
+                {appointment: new_status for appointment, (index, new_status) in changes.items()},
+                user=self.request.user, source='api',
+            )
+        except SlotUnavailable:
+            raise SlotConflict()
+        
+        for appointment, (index, new_status) in changes.items():
+            error = errors.get(appointment)
+            if isinstance(error, SlotUnavailable):
+                results[index] = {'index': index, 'id': appointment.pk, 'errors': {'status': [SlotConflict.default_detail]}}
+            elif error is not None:
+                results[index] = {'index': index, 'id': appointment.pk, 'errors': {'status': [str(error)]}}
+            else:
+                results[index] = {'index': index, 'id': appointment.pk, 'status': appointment.status}
+    
+    @action(detail=False, methods=['post'], url_path='bulk-status', permission_classes=[permissions.IsAdminUser])
+    def bulk_status(self, request):
+        """
+        Изменить статус нескольких записей одним запросом (только для администраторов).
+        Принимает список объектов с полями id и status.
+        """
+        items = self.get_bulk_items(request.data)
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = AppointmentStatusItemSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'index': index, 'errors': serializer.errors}
+        
+        appointments = self.get_queryset().select_related('service').in_bulk({data['id'] for _, data in valid})
+        changes = {}
+        for index, data in valid:
+            appointment = appointments.get(data['id'])
+            if appointment is None:
+                results[index] = {'index': index, 'id': data['id'], 'errors': {'id': ["Запись не найдена."]}}
+            elif appointment in changes:
+                results[index] = {'index': index, 'id': data['id'], 'errors': {'id': ["Запись указана повторно."]}}
+            else:
+                changes[appointment] = (index, data['status'])
+        
+        self.apply_statuses(changes, results)
+        return self.bulk_response(results)
+    
+    @action(detail=False, methods=['post'], url_path='bulk-cancel')
+    def bulk_cancel(self, request):
+        """
+        Отменить несколько записей одним запросом.
+        Принимает объект с полем ids; клиенты могут отменять только свои записи.
+        """
+        serializer = AppointmentIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = self.get_bulk_items(serializer.validated_data['ids'])
+        
+        appointments = self.get_queryset().select_related('service').in_bulk(set(ids))
+        results = [None] * len(ids)
+        changes = {}
+        for index, pk in enumerate(ids):
+            appointment = appointments.get(pk)
+            if appointment is None:
+                results[index] = {'index': index, 'id': pk, 'errors': {'id': ["Запись не найдена."]}}
+            elif appointment in changes:
+                results[index] = {'index': index, 'id': pk, 'errors': {'id': ["Запись указана повторно."]}}
+            elif appointment.status in ['completed', 'canceled']:
+                results[index] = {'index': index, 'id': pk, 'errors': {
+                    'status': ["Невозможно отменить завершенную или уже отмененную запись."]
+                }}
+            else:
+                changes[appointment] = (index, 'canceled')
+        
+        self.apply_statuses(changes, results)
+        return self.bulk_response(results)
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(PrefetchSerializerMixin, viewsets.ModelViewSet):
     """
     API для управления отзывами о процедурах.
     """
@@ -125,6 +365,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_fields = ['appointment', 'rating', 'is_published']
     ordering_fields = ['created', 'rating']
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-created', '-id')
     
     def get_queryset(self):
         if self.request.user.is_staff:
@@ -160,3 +402,64 @@ class ReviewViewSet(viewsets.ModelViewSet):
             )
         
         serializer.save(is_published=False)
+
+
+class SyncView(APIView):
+    """
+    Дельта-синхронизация для мобильного приложения.
+    Параметр since - курсор из предыдущего ответа; без него отдаются все данные.
+    """
+    permission_classes = [permissions.AllowAny]
+    
+    def get(self, request):
+        since = request.query_params.get('since')
+        if since:
+            try:
+                since = decode_cursor(since)
+            except ValueError:
+                raise ValidationError({'since': ["Неверный курсор синхронизации."]})
+        return Response(build_sync(request.user, since or None, context={'request': request}))
+
+
+def accepts_encoding(request, coding):
+    """
+    Принимает ли клиент кодирование ответа по заголовку Accept-Encoding (RFC 9110, 12.5.3).
+    Учитываются веса q и "*": "gzip;q=0" - явный отказ от gzip.
+    """
+    qualities = {}
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities.get(coding, qualities.get('*', 0)) > 0
+
+
+@require_safe
+def catalog_snapshot(request):
+    """
+    Весь каталог одним ответом: категории, активные услуги и филиалы со статистикой оценок.
+    Отдается готовый снимок из кэша (см. api.catalog) без аутентификации и обращений к базе.
+    """
+    snapshot = get_snapshot()
+    use_gzip = accepts_encoding(request, 'gzip')
+    etag = snapshot['gzip_etag'] if use_gzip else snapshot['etag']
+    
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(snapshot['gzip'] if use_gzip else snapshot['body'], content_type='application/json')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.headers['ETag'] = etag
+    patch_vary_headers(response, ['Accept-Encoding'])
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
@@ -1,22 +1,45 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from django.urls import reverse
+from django.urls import path, reverse
 from django.contrib import messages
-from .models import Appointment, Review
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.db.models.functions import Now
+from django.http import Http404, HttpResponseRedirect
+from .models import Appointment, AppointmentStatusLog, Review
+from .forms import AppointmentAdminForm
+from .booking import SlotUnavailable
+from .transitions import InvalidTransition, apply_transitions, transition
+from .export import EXPORT_FORMATS, export_response
 
 class ReviewInline(admin.StackedInline):
     model = Review
     extra = 0
-    readonly_fields = ('get_stars_display',)
+    readonly_fields = ('get_stars_display', 'created')
     fields = ('rating', 'get_stars_display', 'comment', 'is_published', 'created')
     can_delete = False
 
+class AppointmentStatusLogInline(admin.TabularInline):
+    model = AppointmentStatusLog
+    extra = 0
+    fields = ('created', 'old_status', 'new_status', 'changed_by', 'source')
+    readonly_fields = fields
+    can_delete = False
+    
+    def has_add_permission(self, request, obj=None):
+        # Журнал заполняется только при смене статуса
+        return False
+
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
+    form = AppointmentAdminForm
     list_display = ('id', 'client_full_name', 'service', 'location', 'date', 'time', 'get_colored_status', 'client_phone', 'has_review')
     list_filter = ('status', 'location', 'date', 'service__category')
     search_fields = ('client__username', 'client__first_name', 'client__last_name', 'client__client__phone')
     date_hierarchy = 'date'
+    list_select_related = ('client', 'service', 'location')
     readonly_fields = ('created', 'updated', 'client_full_name', 'client_phone', 'get_colored_status')
     fieldsets = (
         ('Клиент', {
@@ -29,51 +52,179 @@ class AppointmentAdmin(admin.ModelAdmin):
             'fields': ('notes', 'admin_notes', 'notified', 'created', 'updated')
         }),
     )
-    inlines = [ReviewInline]
-    actions = ['mark_as_confirmed', 'mark_as_completed', 'mark_as_canceled', 'send_notification']
+    inlines = [ReviewInline, AppointmentStatusLogInline]
+    actions = ['mark_as_confirmed', 'mark_as_completed', 'mark_as_canceled', 'send_notification',
+               'export_csv', 'export_xlsx']
+    
+    def get_urls(self):
+        urls = [
+            path('export/<str:file_format>/', self.admin_site.admin_view(self.export_view),
+                 name='appointments_appointment_export'),
+        ]
+        return urls + super().get_urls()
+    
+    def export_view(self, request, file_format):
+        """Выгрузка всех записей с текущими фильтрами и поиском списка (ссылки над списком)"""
+        if file_format not in EXPORT_FORMATS:
+            raise Http404
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            changelist = self.get_changelist_instance(request)
+        except IncorrectLookupParameters:
+            return HttpResponseRedirect(reverse('admin:appointments_appointment_changelist'))
+        return export_response(changelist.get_queryset(request), file_format)
+    
+    def get_queryset(self, request):
+        """Телефон клиента и наличие отзыва берутся тем же запросом, что и сами записи"""
+        return super().get_queryset(request).annotate(
+            review_exists=Exists(Review.objects.filter(appointment=OuterRef('pk'))),
+            client_phone_value=F('client__client__phone'),
+        )
+    
+    def client_phone(self, obj):
+        """Телефон клиента (из аннотации get_queryset)"""
+        return getattr(obj, 'client_phone_value', None) or "Не указан"
+    client_phone.short_description = 'Телефон клиента'
+    client_phone.admin_order_field = 'client_phone_value'
     
     def has_review(self, obj):
-        """Проверяет, есть ли у записи отзыв"""
-        has_review = hasattr(obj, 'review')
-        if has_review:
+        """Проверяет, есть ли у записи отзыв (по аннотации get_queryset)"""
+        if getattr(obj, 'review_exists', False):
             return format_html('<span style="color: green;">✓</span>')
         return format_html('<span style="color: red;">✗</span>')
     has_review.short_description = 'Отзыв'
+    has_review.admin_order_field = 'review_exists'
+    
+    def set_status(self, request, queryset, status):
+        """
+        Меняет статус записей пакетно (см. transitions.apply_transitions) и возвращает количество измененных.
+        Отмененные записи, время которых уже занято, не восстанавливаются;
+        записи, которые уже в этом статусе, считаются ошибкой.
+        """
+        appointments = list(queryset.select_related('service'))
+        errors = apply_transitions(
+            {appointment: status for appointment in appointments}, user=request.user, source='admin'
+        )
+        conflicts = sum(isinstance(error, SlotUnavailable) for error in errors.values())
+        # apply_transitions записывает в appointment.status текущий статус записи
+        unchanged = sum(appointment.status == status for appointment in errors)
+        if unchanged:
+            self.message_user(request, f"{unchanged} записей уже в этом статусе.", messages.WARNING)
+        if conflicts:
+            self.message_user(
+                request,
+                f"{conflicts} записей не изменены: их время уже занято другими записями.",
+                messages.WARNING
+            )
+        if len(errors) > conflicts + unchanged:
+            self.message_user(
+                request,
+                f"{len(errors) - conflicts - unchanged} записей не изменены: переход в этот статус для них недопустим.",
+                messages.WARNING
+            )
+        return len(appointments) - len(errors)
+    
+    def save_model(self, request, obj, form, change):
+        """
+        Статус измененной записи меняется через transitions, чтобы попасть в журнал.
+        Если время заняли уже после проверки формы, запись не сохраняется,
+        а ошибка показывается в response_add/response_change.
+        """
+        try:
+            with transaction.atomic():
+                if not change or 'status' not in form.changed_data:
+                    return super().save_model(request, obj, form, change)
+                new_status = obj.status
+                obj.status = form.initial['status']
+                super().save_model(request, obj, form, change)
+                transition(obj, new_status, user=request.user, source='admin')
+        except (SlotUnavailable, InvalidTransition) as exc:
+            obj._save_error = exc
+    
+    def save_related(self, request, form, formsets, change):
+        if getattr(form.instance, '_save_error', None) is None:
+            super().save_related(request, form, formsets, change)
+    
+    def construct_change_message(self, request, form, formsets, add=False):
+        # Без сохранения связанных объектов у формсетов нет списка изменений
+        if getattr(form.instance, '_save_error', None) is not None:
+            return []
+        return super().construct_change_message(request, form, formsets, add)
+    
+    def log_addition(self, request, obj, message):
+        if getattr(obj, '_save_error', None) is None:
+            return super().log_addition(request, obj, message)
+    
+    def log_change(self, request, obj, message):
+        if getattr(obj, '_save_error', None) is None:
+            return super().log_change(request, obj, message)
+    
+    def response_add(self, request, obj, post_url_continue=None):
+        if getattr(obj, '_save_error', None) is None:
+            return super().response_add(request, obj, post_url_continue)
+        return self._save_error_response(request, obj)
+    
+    def response_change(self, request, obj):
+        if getattr(obj, '_save_error', None) is None:
+            return super().response_change(request, obj)
+        return self._save_error_response(request, obj)
+    
+    def _save_error_response(self, request, obj):
+        self.message_user(request, f"Запись не сохранена: {obj._save_error}", messages.ERROR)
+        return HttpResponseRedirect(request.path)
     
     def mark_as_confirmed(self, request, queryset):
         """Отмечает выбранные записи как подтвержденные"""
-        updated = queryset.update(status='confirmed')
+        updated = self.set_status(request, queryset, 'confirmed')
         self.message_user(request, f"{updated} записей отмечены как подтвержденные.")
     mark_as_confirmed.short_description = "Отметить как подтвержденные"
     
     def mark_as_completed(self, request, queryset):
         """Отмечает выбранные записи как завершенные"""
-        updated = queryset.update(status='completed')
+        updated = self.set_status(request, queryset, 'completed')
         self.message_user(request, f"{updated} записей отмечены как завершенные.")
     mark_as_completed.short_description = "Отметить как завершенные"
     
     def mark_as_canceled(self, request, queryset):
         """Отмечает выбранные записи как отмененные"""
-        updated = queryset.update(status='canceled')
+        updated = self.set_status(request, queryset, 'canceled')
         self.message_user(request, f"{updated} записей отмечены как отмененные.")
     mark_as_canceled.short_description = "Отметить как отмененные"
     
     def send_notification(self, request, queryset):
         """Отправляет уведомления клиентам о статусе заявок"""
         # В реальном проекте здесь будет код отправки email или SMS
-        updated = queryset.update(notified=True)
+        updated = queryset.update(notified=True, updated=Now())
         self.message_user(request, f"Отправлены уведомления для {updated} записей.")
     send_notification.short_description = "Отправить уведомления клиентам"
+    
+    def export_csv(self, request, queryset):
+        """Выгружает выбранные записи в CSV"""
+        return export_response(queryset, 'csv')
+    export_csv.short_description = "Выгрузить в CSV"
+    
+    def export_xlsx(self, request, queryset):
+        """Выгружает выбранные записи в XLSX"""
+        return export_response(queryset, 'xlsx')
+    export_xlsx.short_description = "Выгрузить в XLSX"
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('id', 'client_name', 'service_name', 'location_name', 'get_stars_display', 'created', 'is_published')
     list_filter = ('rating', 'is_published', 'appointment__location', 'appointment__service__category')
     search_fields = ('appointment__client__username', 'appointment__client__first_name', 'appointment__client__last_name', 'comment')
+    list_select_related = ('appointment__client', 'appointment__service', 'appointment__location')
     readonly_fields = ('get_stars_display', 'appointment_details', 'created', 'updated')
     fields = ('appointment', 'appointment_details', 'rating', 'get_stars_display', 'comment', 'is_published', 'created', 'updated')
     actions = ['publish_reviews', 'unpublish_reviews']
     
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'appointment':
+            # Название записи в списке выбора включает клиента и услугу
+            kwargs['queryset'] = Appointment.objects.select_related('client', 'service')
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+    
     def appointment_details(self, obj):
         """Отображает детали записи"""
         if not obj.appointment:
@@ -95,12 +246,12 @@ class ReviewAdmin(admin.ModelAdmin):
     
     def publish_reviews(self, request, queryset):
         """Публикует выбранные отзывы"""
-        updated = queryset.update(is_published=True)
+        updated = queryset.update(is_published=True, updated=Now())
         self.message_user(request, f"{updated} отзывов опубликовано.")
     publish_reviews.short_description = "Опубликовать выбранные отзывы"
     
     def unpublish_reviews(self, request, queryset):
         """Скрывает выбранные отзывы"""
-        updated = queryset.update(is_published=False)
+        updated = queryset.update(is_published=False, updated=Now())
         self.message_user(request, f"{updated} отзывов скрыто.")
     unpublish_reviews.short_description = "Скрыть выбранные отзывы"
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""
+Расчет свободного времени для записи на процедуры.
+
+Занятость филиала на каждый день хранится в виде битовой маски: один бит
+соответствует ячейке длиной SLOT_STEP. Все записи за период выбираются
+одним запросом, после чего свободные окна ищутся сдвигами масок в памяти.
+"""
+import datetime
+import re
+
+from django.utils import timezone
+
+from .models import Appointment, get_salon_timezone
+
+# Размер ячейки сетки занятости
+SLOT_STEP = datetime.timedelta(minutes=15)
+# Шаг, с которым клиенту предлагается время начала процедуры
+SLOT_INTERVAL = datetime.timedelta(minutes=30)
+# Максимальный период, который можно запросить за один раз
+MAX_RANGE_DAYS = 62
+
+STEP_MINUTES = int(SLOT_STEP.total_seconds() // 60)
+INTERVAL_CELLS = int(SLOT_INTERVAL // SLOT_STEP)
+
+# Часы работы по умолчанию (0 = понедельник, ..., 6 = воскресенье)
+DEFAULT_SCHEDULE = {
+    0: (datetime.time(10, 0), datetime.time(22, 0)),
+    1: (datetime.time(10, 0), datetime.time(22, 0)),
+    2: (datetime.time(10, 0), datetime.time(22, 0)),
+    3: (datetime.time(10, 0), datetime.time(22, 0)),
+    4: (datetime.time(10, 0), datetime.time(22, 0)),
+    5: (datetime.time(10, 0), datetime.time(20, 0)),
+    6: (datetime.time(10, 0), datetime.time(20, 0)),
+}
+
+WEEKDAYS = {'пн': 0, 'вт': 1, 'ср': 2, 'чт': 3, 'пт': 4, 'сб': 5, 'вс': 6}
+
+WORKING_HOURS_RE = re.compile(
+    r'(пн|вт|ср|чт|пт|сб|вс)\s*(?:-\s*(пн|вт|ср|чт|пт|сб|вс))?\s*:?\s*'
+    r'(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})',
+    re.IGNORECASE,
+)
+
+
+def parse_working_hours(working_hours):
+    """
+    Разбирает строку вида "Пн-Пт: 9:00-21:00, Сб-Вс: 10:00-19:00"
+    в словарь {день недели: (открытие, закрытие)}.
+    Если строку разобрать не удалось, возвращается расписание по умолчанию.
+    """
+    schedule = {}
+    for match in WORKING_HOURS_RE.finditer(working_hours or ''):
+        first_day = WEEKDAYS[match.group(1).lower()]
+        last_day = WEEKDAYS[(match.group(2) or match.group(1)).lower()]
+        try:
+            opens = datetime.time(int(match.group(3)), int(match.group(4)))
+            closes = datetime.time(int(match.group(5)), int(match.group(6)))
+        except ValueError:
+            continue
+
+        day = first_day
+        while True:
+            schedule[day] = (opens, closes)
+            if day == last_day:
+                break
+            day = (day + 1) % 7
+
+    return schedule or dict(DEFAULT_SCHEDULE)
+
+
+def _cells(duration):
+    """Количество ячеек сетки, которое занимает интервал (с округлением вверх)"""
+    return -(-duration // SLOT_STEP)
+
+
+def _time_to_cell(time, round_up=False):
+    """Номер ячейки сетки, в которую попадает время"""
+    minutes = time.hour * 60 + time.minute
+    if round_up:
+        return -(-minutes // STEP_MINUTES)
+    return minutes // STEP_MINUTES
+
+
+def cell_range(start_time, duration):
+    """Индексы первой и следующей за последней ячеек, занятых интервалом"""
+    start_seconds = (start_time.hour * 60 + start_time.minute) * 60
+    first = start_seconds // (STEP_MINUTES * 60)
+    last = -(-(start_seconds + int(duration.total_seconds())) // (STEP_MINUTES * 60))
+    return first, last
+
+
+def _mask(first, last):
+    """Битовая маска ячеек [first, last)"""
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def _cell_to_time(cell):
+    minutes = cell * STEP_MINUTES
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+def build_occupancy(location, start_date, end_date, exclude=None):
+    """
+    Возвращает словарь {дата: битовая маска занятых ячеек} для филиала.
+    Учитываются все записи, кроме отмененных.
+    """
+    appointments = Appointment.objects.filter(
+        location=location,
+        date__range=(start_date, end_date),
+    ).exclude(status='canceled')
+    if exclude is not None:
+        appointments = appointments.exclude(pk=exclude)
+
+    occupancy = {}
+    for date, time, duration in appointments.values_list('date', 'time', 'service__duration'):
+        first, last = cell_range(time, duration)
+        occupancy[date] = occupancy.get(date, 0) | _mask(first, last)
+    return occupancy
+
+
+def _free_starts(free, cells):
+    """Маска ячеек, начиная с которых подряд свободно не менее cells ячеек"""
+    starts = free
+    for shift in range(1, cells):
+        starts &= free >> shift
+    return starts
+
+
+def _now_cell(now):
+    """Первая ячейка, начало которой еще не прошло"""
+    return -(-(now.hour * 3600 + now.minute * 60 + now.second) // (STEP_MINUTES * 60))
+
+
+def _day_bounds(schedule, date, now):
+    """
+    Ячейки [первая, следующая за последней), в которые можно записаться на дату:
+    часы работы без уже прошедшего времени. В выходной день возвращает None.
+    """
+    hours = schedule.get(date.weekday())
+    if not hours or date < now.date():
+        return None
+    opens, closes = hours
+    open_first = _time_to_cell(opens, round_up=True)
+    if date == now.date():
+        open_first = max(open_first, _now_cell(now))
+    return open_first, _time_to_cell(closes)
+
+
+def get_available_slots(location, service, start_date, end_date, exclude=None):
+    """
+    Возвращает словарь {дата: [время начала, ...]} со свободным временем
+    для записи на услугу в филиале за период с start_date по end_date включительно.
+    """
+    schedule = parse_working_hours(location.working_hours)
+    occupancy = build_occupancy(location, start_date, end_date, exclude=exclude)
+    cells = max(_cells(service.duration), 1)
+    now = timezone.localtime(timezone=get_salon_timezone())
+
+    slots = {}
+    date = max(start_date, now.date())
+    while date <= end_date:
+        bounds = _day_bounds(schedule, date, now)
+        day_slots = []
+        if bounds:
+            open_first, close_cell = bounds
+            free = _mask(open_first, close_cell) & ~occupancy.get(date, 0)
+            starts = _free_starts(free, cells)
+            first = -(-open_first // INTERVAL_CELLS) * INTERVAL_CELLS
+            for cell in range(first, close_cell, INTERVAL_CELLS):
+                if starts >> cell & 1:
+                    day_slots.append(_cell_to_time(cell))
+        slots[date] = day_slots
+        date += datetime.timedelta(days=1)
+    return slots
+
+
+def fits_schedule(schedule, duration, date, time, now, own_time=False):
+    """
+    Проверяет время начала процедуры по расписанию филиала (без учета других записей):
+    начало на сетке SLOT_INTERVAL и не в прошлом, процедура целиком в часах работы.
+    own_time - это текущее время уже созданной записи: оно может быть вне сетки
+    и уже наступить, проверяются только часы работы.
+    """
+    first, last = cell_range(time, duration)
+    last = max(last, first + 1)
+    if own_time:
+        hours = schedule.get(date.weekday())
+        if not hours:
+            return False
+        open_first, close_cell = _time_to_cell(hours[0], round_up=True), _time_to_cell(hours[1])
+    else:
+        bounds = _day_bounds(schedule, date, now)
+        if not bounds:
+            return False
+        open_first, close_cell = bounds
+        on_grid = time.second == 0 and time.microsecond == 0 and (
+            (time.hour * 60 + time.minute) % int(SLOT_INTERVAL.total_seconds() // 60) == 0
+        )
+        if not on_grid:
+            return False
+    return open_first <= first and last <= close_cell
+
+
+def is_bookable_time(location, service, date, time, exclude=None):
+    """
+    Проверяет, что на дату и время можно записаться по расписанию филиала
+    (см. fits_schedule), не проверяя занятость. exclude - id изменяемой записи:
+    ее текущие дата и время в этом филиале принимаются и вне сетки.
+    """
+    own_time = exclude is not None and Appointment.objects.filter(
+        pk=exclude, location=location, date=date, time=time,
+    ).exists()
+    now = timezone.localtime(timezone=get_salon_timezone())
+    return fits_schedule(parse_working_hours(location.working_hours), service.duration, date, time, now, own_time)
+
+
+def is_slot_available(location, service, date, time, exclude=None):
+    """
+    Проверяет, можно ли записаться на услугу в филиал на указанные дату и время:
+    время подходит по расписанию (см. is_bookable_time) и не занято другими записями.
+    """
+    if not is_bookable_time(location, service, date, time, exclude=exclude):
+        return False
+    first, last = cell_range(time, service.duration)
+    occupied = build_occupancy(location, date, date, exclude=exclude).get(date, 0)
+    return not occupied & _mask(first, max(last, first + 1))
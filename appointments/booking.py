@@ -0,0 +1,254 @@
+"""
+Бронирование времени в расписании филиала.
+
+Запись занимает ячейки сетки расписания (см. availability.SLOT_STEP), на каждую
+ячейку создается строка SlotReservation. Уникальное ограничение (филиал, дата,
+время) не дает двум записям занять одно время: при одновременном бронировании
+проигравшая транзакция сразу получает ошибку уникальности. Конкурируют только
+вставки в один и тот же филиал на одно и то же время, глобальной блокировки нет.
+"""
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .availability import cell_range, fits_schedule, parse_working_hours, STEP_MINUTES
+from .models import Appointment, SlotReservation, get_appointment_period, get_salon_timezone
+from .signals import appointments_changed
+
+CELLS_PER_DAY = 24 * 60 // STEP_MINUTES
+
+
+class SlotUnavailable(Exception):
+    """Выбранное время уже занято другой записью"""
+
+
+class OutsideSchedule(Exception):
+    """Время не подходит по расписанию филиала: вне часов работы, не на сетке записи или уже прошло"""
+
+
+class DurationConflict(SlotUnavailable):
+    """После изменения длительности услуги ее записи пересекаются с другими записями"""
+    
+    def __init__(self, appointments):
+        self.appointments = appointments
+        super().__init__(
+            "Новая длительность пересекается с другими записями: "
+            + ", ".join(f"{appointment.date:%d.%m.%Y} {appointment.time:%H:%M}" for appointment in appointments)
+        )
+
+
+def reservation_times(time, duration):
+    """Время начала всех ячеек, которые занимает процедура"""
+    first, last = cell_range(time, duration)
+    return [
+        datetime.time(cell * STEP_MINUTES // 60, cell * STEP_MINUTES % 60)
+        for cell in range(first, min(last, CELLS_PER_DAY))
+    ]
+
+
+def build_reservations(appointment):
+    """Строки брони для записи (без сохранения)"""
+    return [
+        SlotReservation(appointment=appointment, location_id=appointment.location_id,
+                        date=appointment.date, time=time)
+        for time in reservation_times(appointment.time, appointment.service.duration)
+    ]
+
+
+def sync_reservations(appointment):
+    """
+    Приводит бронь записи в соответствие с ее филиалом, датой, временем и статусом.
+    Должна вызываться внутри транзакции, в которой сохраняется запись.
+    """
+    SlotReservation.objects.filter(appointment=appointment).delete()
+    if appointment.status == 'canceled':
+        return
+    
+    try:
+        with transaction.atomic():
+            SlotReservation.objects.bulk_create(build_reservations(appointment))
+    except IntegrityError as exc:
+        raise SlotUnavailable("Выбранное время уже занято.") from exc
+
+
+def release_reservations(appointments):
+    """Освобождает время, занятое записями (например, при массовой отмене)"""
+    return SlotReservation.objects.filter(appointment__in=appointments).delete()[0]
+
+
+def has_conflicts(location, date, time, duration, exclude=None):
+    """Проверяет, пересекается ли интервал с временем, уже занятым в филиале"""
+    reservations = SlotReservation.objects.filter(
+        location=location,
+        date=date,
+        time__in=reservation_times(time, duration),
+    )
+    if exclude is not None:
+        reservations = reservations.exclude(appointment_id=exclude)
+    return reservations.exists()
+
+
+def find_conflicts(appointments):
+    """
+    Возвращает записи из списка, время которых занято: уже существующей бронью
+    или одной из предыдущих записей того же списка. Выполняет один запрос.
+    Отмененные записи время не занимают и в конфликт не попадают.
+    """
+    active = [appointment for appointment in appointments if appointment.status != 'canceled']
+    if not active:
+        return []
+    
+    taken = set(SlotReservation.objects.filter(
+        location_id__in={appointment.location_id for appointment in active},
+        date__in={appointment.date for appointment in active},
+    ).exclude(
+        appointment_id__in=[appointment.pk for appointment in active if appointment.pk]
+    ).values_list('location_id', 'date', 'time'))
+    
+    conflicts = []
+    for appointment in active:
+        slots = {
+            (appointment.location_id, appointment.date, time)
+            for time in reservation_times(appointment.time, appointment.service.duration)
+        }
+        if slots & taken:
+            conflicts.append(appointment)
+        else:
+            taken |= slots
+    return conflicts
+
+
+def create_reservations(appointments):
+    """Бронирует время для сохраненных записей одной вставкой"""
+    reservations = [
+        reservation
+        for appointment in appointments if appointment.status != 'canceled'
+        for reservation in build_reservations(appointment)
+    ]
+    try:
+        with transaction.atomic():
+            SlotReservation.objects.bulk_create(reservations)
+    except IntegrityError as exc:
+        raise SlotUnavailable("Выбранное время уже занято.") from exc
+    for appointment in appointments:
+        appointment._booked_slot = appointment._slot_key()
+
+
+def bulk_book(appointments):
+    """
+    Создает записи и их бронь пакетными вставками вместо save() для каждой записи.
+    Возвращает список пар (запись, исключение) для записей, которые не созданы:
+    OutsideSchedule - время вне расписания филиала, SlotUnavailable - время занято.
+    Должна вызываться внутри транзакции.
+    """
+    now = timezone.localtime(timezone=get_salon_timezone())
+    schedules = {}
+    errors = []
+    scheduled = []
+    for appointment in appointments:
+        location = appointment.location
+        if location.pk not in schedules:
+            schedules[location.pk] = parse_working_hours(location.working_hours)
+        if fits_schedule(schedules[location.pk], appointment.service.duration,
+                         appointment.date, appointment.time, now):
+            scheduled.append(appointment)
+        else:
+            errors.append((appointment, OutsideSchedule("Выбранное время недоступно для записи.")))
+    
+    conflicts = find_conflicts(scheduled)
+    errors.extend((appointment, SlotUnavailable("Выбранное время уже занято.")) for appointment in conflicts)
+    conflicting = {id(appointment) for appointment in conflicts}
+    accepted = [appointment for appointment in scheduled if id(appointment) not in conflicting]
+    
+    for appointment in accepted:
+        appointment.starts_at, appointment.ends_at = get_appointment_period(
+            appointment.date, appointment.time, appointment.service.duration
+        )
+    Appointment.objects.bulk_create(accepted)
+    create_reservations(accepted)
+    appointments_changed.send(sender=Appointment, pks=[appointment.pk for appointment in accepted])
+    return errors
+
+
+def bulk_set_status(appointments, status):
+    """
+    Меняет статус нескольких записей одним UPDATE: при отмене освобождает время,
+    при восстановлении отмененных записей бронирует его снова.
+    Записи, время которых уже занято, не меняются и возвращаются списком.
+    Должна вызываться внутри транзакции.
+    """
+    changed = [appointment for appointment in appointments if appointment.status != status]
+    conflicts = []
+    if status == 'canceled':
+        release_reservations([appointment.pk for appointment in changed])
+    else:
+        restored = [appointment for appointment in changed if appointment.status == 'canceled']
+        for appointment in restored:
+            appointment.status = status
+        conflicts = find_conflicts(restored)
+        conflicting = {id(appointment) for appointment in conflicts}
+        for appointment in conflicts:
+            appointment.status = 'canceled'
+        changed = [appointment for appointment in changed if id(appointment) not in conflicting]
+        create_reservations([appointment for appointment in restored if id(appointment) not in conflicting])
+    
+    now = timezone.now()
+    for appointment in changed:
+        appointment.status = status
+        appointment.updated = now
+        appointment._booked_slot = appointment._slot_key()
+    Appointment.objects.bulk_update(changed, ['status', 'updated'])
+    appointments_changed.send(sender=Appointment, pks=[appointment.pk for appointment in changed])
+    return conflicts
+
+
+def upcoming_service_appointments(service):
+    """Предстоящие неотмененные записи на услугу (начиная с сегодняшнего дня в часовом поясе салона)"""
+    today = timezone.localdate(timezone=get_salon_timezone())
+    return service.appointments.filter(date__gte=today).exclude(status='canceled').order_by('date', 'time', 'pk')
+
+
+def find_duration_conflicts(service, duration):
+    """
+    Предстоящие записи на услугу, которые при новой длительности пересекутся
+    с другими записями филиала или друг с другом. Ничего не изменяет.
+    """
+    appointments = list(upcoming_service_appointments(service))
+    for appointment in appointments:
+        appointment.service = service
+    old_duration = service.duration
+    service.duration = duration
+    try:
+        return find_conflicts(appointments)
+    finally:
+        service.duration = old_duration
+
+
+def resync_service_appointments(service):
+    """
+    Пересчитывает окончание и бронь предстоящих записей на услугу после изменения
+    ее длительности. Если записи пересекутся с другими, вызывает DurationConflict
+    со списком таких записей. Должна вызываться внутри транзакции, в которой
+    сохраняется услуга: при ошибке откатывается и изменение услуги.
+    """
+    appointments = list(upcoming_service_appointments(service).select_for_update())
+    for appointment in appointments:
+        appointment.service = service
+    conflicts = find_conflicts(appointments)
+    if conflicts:
+        raise DurationConflict(conflicts)
+    
+    now = timezone.now()
+    for appointment in appointments:
+        appointment.starts_at, appointment.ends_at = get_appointment_period(
+            appointment.date, appointment.time, service.duration
+        )
+        appointment.updated = now
+        try:
+            sync_reservations(appointment)
+        except SlotUnavailable as exc:
+            # Время заняли после проверки конфликтов
+            raise DurationConflict([appointment]) from exc
+    Appointment.objects.bulk_update(appointments, ['starts_at', 'ends_at', 'updated'])
+    return appointments
@@ -0,0 +1,251 @@
+"""
+Потоковая выгрузка записей в CSV и XLSX.
+
+Строки читаются из queryset.values().iterator(chunk_size=...) и сразу
+записываются в ответ кусками, поэтому расход памяти не зависит от числа
+записей. XLSX собирается без сторонних библиотек: zip-архив пишется
+в поток (zipfile поддерживает запись в файл без seek), лист - построчно,
+строки хранятся прямо в ячейках (inlineStr), без общей таблицы строк.
+"""
+import csv
+import datetime
+import re
+import zipfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Appointment, get_salon_timezone
+
+EXPORT_CHUNK_SIZE = 2000
+# Сколько строк отдается одним куском ответа
+ROWS_PER_CHUNK = 500
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+EXPORT_FIELDS = (
+    'id', 'date', 'time', 'status', 'client__username', 'client__first_name', 'client__last_name',
+    'client__email', 'client__client__phone', 'service__name', 'service__price', 'location__name',
+    'notes', 'created',
+)
+EXPORT_HEADERS = (
+    'ID', 'Дата', 'Время', 'Статус', 'Клиент', 'Email', 'Телефон', 'Услуга', 'Цена', 'Филиал',
+    'Примечания', 'Создана',
+)
+
+
+def export_rows(queryset):
+    """Строки выгрузки (кортежи значений в порядке EXPORT_HEADERS)"""
+    statuses = dict(Appointment.STATUS_CHOICES)
+    tz = get_salon_timezone()
+    rows = queryset.prefetch_related(None).values(*EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for row in rows:
+        full_name = f"{row['client__first_name']} {row['client__last_name']}".strip()
+        yield (
+            row['id'],
+            row['date'],
+            row['time'],
+            statuses.get(row['status'], row['status']),
+            full_name or row['client__username'],
+            row['client__email'],
+            row['client__client__phone'] or '',
+            row['service__name'],
+            row['service__price'],
+            row['location__name'],
+            row['notes'],
+            # Время создания в часовом поясе салона, без указания пояса
+            row['created'].astimezone(tz).replace(tzinfo=None, microsecond=0),
+        )
+
+
+class _Buffer:
+    """Поток только для записи: накопленные данные забираются методом pop()"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class _TextBuffer:
+    """Текстовая обертка для csv.writer"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def write(self, value):
+        return self.buffer.write(value.encode())
+
+
+# Текст, начинающийся с этих символов, Excel и LibreOffice выполняют как формулу
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Номер телефона или число со знаком: в таблице это значение, а не формула
+NUMBER_RE = re.compile(r'[+-][\d\s().,-]*')
+
+
+def csv_value(value):
+    """
+    Значение ячейки CSV; текст, который табличный редактор вычислил бы как формулу,
+    экранируется апострофом. Телефоны и числа со знаком ("+7 999 123-45-67", "-5")
+    функций и ссылок не содержат и остаются как есть.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not NUMBER_RE.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def iter_csv(rows):
+    """
+    CSV в UTF-8 с BOM и разделителем ";" - в таком виде его без настройки
+    открывает Excel с русской локалью. Примечания и имена вводят клиенты,
+    поэтому текст, похожий на формулу, экранируется (см. csv_value).
+    В XLSX текст хранится как строка (inlineStr) и формулой не считается.
+    """
+    buffer = _Buffer()
+    text = _TextBuffer(buffer)
+    writer = csv.writer(text, delimiter=';')
+    buffer.write('\ufeff'.encode())
+    writer.writerow(EXPORT_HEADERS)
+    for index, row in enumerate(rows, 1):
+        writer.writerow(map(csv_value, row))
+        if index % ROWS_PER_CHUNK == 0:
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+# Символы, недопустимые в XML 1.0
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Записи" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Стили ячеек: 0 - обычный, 1 - дата, 2 - время, 3 - дата и время
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="2"><numFmt numFmtId="164" formatCode="dd.mm.yyyy"/>'
+        '<numFmt numFmtId="165" formatCode="dd.mm.yyyy hh:mm"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="4"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="20" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '</styleSheet>'
+    ),
+}
+SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_FOOTER = '</sheetData></worksheet>'
+
+
+def _xlsx_cell(value):
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, datetime.datetime):
+        serial = (value - _EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c s="3"><v>{serial}</v></c>'
+    if isinstance(value, datetime.date):
+        return f'<c s="1"><v>{(value - _EXCEL_EPOCH.date()).days}</v></c>'
+    if isinstance(value, datetime.time):
+        seconds = value.hour * 3600 + value.minute * 60 + value.second
+        return f'<c s="2"><v>{seconds / 86400}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    text = escape(_INVALID_XML_CHARS.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(map(_xlsx_cell, values)) + '</row>'
+
+
+def iter_xlsx(rows):
+    """Книга XLSX с одним листом; отдается кусками по мере записи строк"""
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_STATIC_PARTS.items():
+            archive.writestr(name, content)
+        # force_zip64: размер листа заранее неизвестен и может превысить 2 ГБ
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((SHEET_HEADER + _xlsx_row(EXPORT_HEADERS)).encode())
+            lines = []
+            for row in rows:
+                lines.append(_xlsx_row(row))
+                if len(lines) >= ROWS_PER_CHUNK:
+                    sheet.write(''.join(lines).encode())
+                    lines = []
+                    yield buffer.pop()
+            sheet.write((''.join(lines) + SHEET_FOOTER).encode())
+    yield buffer.pop()
+
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (iter_xlsx, XLSX_CONTENT_TYPE),
+}
+
+
+def export_response(queryset, file_format):
+    """Потоковый ответ с выгрузкой записей в формате csv или xlsx"""
+    writer, content_type = EXPORT_FORMATS[file_format]
+    response = StreamingHttpResponse(writer(export_rows(queryset)), content_type=content_type)
+    filename = f"appointments-{timezone.localdate():%Y%m%d}.{file_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
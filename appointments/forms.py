@@ -1,5 +1,8 @@
 from django import forms
 from .models import Appointment, Review
+from .availability import is_slot_available
+from .booking import has_conflicts
+from .transitions import InvalidTransition, allowed_statuses, check_transition
 
 class AppointmentForm(forms.ModelForm):
     """Форма для создания записи"""
@@ -11,6 +14,46 @@ class AppointmentForm(forms.ModelForm):
             'time': forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'}),
             'notes': forms.Textarea(attrs={'rows': 3, 'placeholder': 'Оставьте комментарий при необходимости'}),
         }
+    
+    def clean(self):
+        """Проверяем, что выбранное время свободно в расписании филиала"""
+        cleaned_data = super().clean()
+        service = cleaned_data.get('service')
+        location = cleaned_data.get('location')
+        date = cleaned_data.get('date')
+        time = cleaned_data.get('time')
+        
+        if service and location and date and time:
+            if not is_slot_available(location, service, date, time, exclude=self.instance.pk):
+                self.add_error('time', "Выбранное время недоступно для записи. Пожалуйста, выберите другое время.")
+        
+        return cleaned_data
+
+class AppointmentAdminForm(forms.ModelForm):
+    """Форма записи в админ-панели с проверкой пересечения с другими записями"""
+    class Meta:
+        model = Appointment
+        fields = '__all__'
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        service = cleaned_data.get('service')
+        location = cleaned_data.get('location')
+        date = cleaned_data.get('date')
+        time = cleaned_data.get('time')
+        
+        if service and location and date and time and cleaned_data.get('status') != 'canceled':
+            if has_conflicts(location, date, time, service.duration, exclude=self.instance.pk):
+                raise forms.ValidationError("Это время в филиале уже занято другой записью.")
+        
+        status = cleaned_data.get('status')
+        if self.instance.pk and status and 'status' in self.changed_data:
+            try:
+                check_transition(self.initial['status'], status)
+            except InvalidTransition as exc:
+                self.add_error('status', str(exc))
+        
+        return cleaned_data
 
 class AppointmentStatusForm(forms.ModelForm):
     """Форма для обновления статуса заявки администратором"""
@@ -20,6 +63,14 @@ class AppointmentStatusForm(forms.ModelForm):
         widgets = {
             'admin_notes': forms.Textarea(attrs={'rows': 3, 'placeholder': 'Заметки для администраторов'}),
         }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # В списке только статусы, в которые можно перейти из текущего
+        allowed = allowed_statuses(self.instance.status)
+        self.fields['status'].choices = [
+            choice for choice in self.fields['status'].choices if choice[0] in allowed
+        ]
 
 class ReviewForm(forms.ModelForm):
     """Форма для создания отзыва о процедуре"""
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from appointments.models import Appointment, get_appointment_period
+
+
+class Command(BaseCommand):
+    help = "Заполняет начало и окончание (starts_at/ends_at) у существующих записей"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help="Количество записей, обрабатываемых в одной транзакции")
+        parser.add_argument('--all', action='store_true',
+                            help="Пересчитать все записи, а не только незаполненные")
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        appointments = Appointment.objects.order_by('pk')
+        if not options['all']:
+            appointments = appointments.filter(starts_at__isnull=True)
+
+        total = 0
+        last_pk = 0
+        while True:
+            # Постраничный обход по первичному ключу, без OFFSET
+            chunk = list(
+                appointments.filter(pk__gt=last_pk)
+                .values_list('pk', 'date', 'time', 'service__duration')[:chunk_size]
+            )
+            if not chunk:
+                break
+
+            updates = []
+            for pk, date, time, duration in chunk:
+                starts_at, ends_at = get_appointment_period(date, time, duration)
+                updates.append(Appointment(pk=pk, starts_at=starts_at, ends_at=ends_at))
+
+            with transaction.atomic():
+                Appointment.objects.bulk_update(updates, ['starts_at', 'ends_at'])
+
+            total += len(updates)
+            last_pk = chunk[-1][0]
+            self.stdout.write(f"Обработано записей: {total}")
+
+        self.stdout.write(self.style.SUCCESS(f"Готово. Обновлено записей: {total}"))
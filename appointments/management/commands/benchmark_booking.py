@@ -0,0 +1,140 @@
+import datetime
+import queue
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from appointments.booking import SlotUnavailable
+from appointments.models import Appointment
+from locations.models import Location
+from services.models import Service, ServiceCategory
+
+PREFIX = 'benchmark-booking'
+# Записи создаются далеко в будущем, чтобы не пересекаться с рабочими данными
+DAYS_AHEAD = 400
+HOURS = range(9, 21)
+
+
+class Command(BaseCommand):
+    help = (
+        "Измеряет пропускную способность бронирования: параллельные записи на разное время "
+        "и гонку за одно время. Создает в базе временные филиалы, услугу и клиентов "
+        "и удаляет их после замера"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help="Количество записей на разное время")
+        parser.add_argument('--threads', type=int, default=8, help="Количество потоков")
+        parser.add_argument('--locations', type=int, default=4, help="Количество филиалов")
+        parser.add_argument('--keep', action='store_true', help="Не удалять созданные данные")
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        category = ServiceCategory.objects.create(name=PREFIX)
+        try:
+            service = Service.objects.create(
+                category=category, name=PREFIX, description='', price=0,
+                duration=datetime.timedelta(minutes=60),
+            )
+            locations = [
+                Location.objects.create(
+                    name=f'{PREFIX}-{index}', address='', phone='', email='benchmark@example.com',
+                    working_hours='Пн-Вс: 09:00-21:00', is_active=False,
+                )
+                for index in range(options['locations'])
+            ]
+            clients = [
+                get_user_model().objects.create_user(f'{PREFIX}-{index}') for index in range(threads)
+            ]
+            self.run_distinct(service, locations, clients, options['count'])
+            self.run_race(service, locations[0], clients)
+        finally:
+            if not options['keep']:
+                get_user_model().objects.filter(username__startswith=f'{PREFIX}-').delete()
+                Location.objects.filter(name__startswith=f'{PREFIX}-').delete()
+                category.delete()
+
+    def run_distinct(self, service, locations, clients, count):
+        """Записи на свободное время в разных филиалах: друг другу они не мешают"""
+        first_day = datetime.date.today() + datetime.timedelta(days=DAYS_AHEAD)
+        slots = queue.Queue()
+        for index in range(count):
+            day, hour = divmod(index // len(locations), len(HOURS))
+            slots.put((
+                locations[index % len(locations)],
+                first_day + datetime.timedelta(days=day),
+                datetime.time(HOURS[hour]),
+            ))
+
+        def book(client):
+            results = []
+            while True:
+                try:
+                    location, date, start = slots.get_nowait()
+                except queue.Empty:
+                    return results
+                results.append(self.book(client, service, location, date, start))
+
+        self.report("разное время", self.run_threads(clients, book))
+
+    def run_race(self, service, location, clients):
+        """Все потоки одновременно записываются на одно время: успешной должна быть одна запись"""
+        date = datetime.date.today() + datetime.timedelta(days=DAYS_AHEAD - 1)
+        barrier = threading.Barrier(len(clients))
+
+        def book(client):
+            barrier.wait()
+            return [self.book(client, service, location, date, datetime.time(HOURS[0]))]
+
+        self.report("одно время", self.run_threads(clients, book))
+
+    @staticmethod
+    def book(client, service, location, date, start):
+        """Создает запись; возвращает (результат, число повторов из-за блокировки базы)"""
+        retries = 0
+        while True:
+            try:
+                Appointment.objects.create(
+                    client=client, service=service, location=location, date=date, time=start,
+                )
+                return 'booked', retries
+            except SlotUnavailable:
+                return 'conflict', retries
+            except OperationalError:
+                # SQLite допускает одного пишущего: занятая база - не конфликт записи
+                retries += 1
+                time.sleep(0.005)
+
+    @staticmethod
+    def run_threads(clients, target):
+        results = []
+        lock = threading.Lock()
+
+        def run(client):
+            try:
+                result = target(client)
+                with lock:
+                    results.extend(result)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=run, args=(client,)) for client in clients]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results, time.monotonic() - started
+
+    def report(self, mode, measurement):
+        results, elapsed = measurement
+        booked = sum(1 for result, _ in results if result == 'booked')
+        conflicts = sum(1 for result, _ in results if result == 'conflict')
+        retries = sum(retries for _, retries in results)
+        self.stdout.write(
+            f"{mode:<13} записей: {booked}, конфликтов: {conflicts}, повторов: {retries}, "
+            f"время: {elapsed:.2f} с, записей в секунду: {booked / elapsed:.0f}"
+        )
@@ -0,0 +1,17 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from appointments.models import Review
+from appointments.search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Заново строит поисковый индекс клиентов и отзывов для списков администратора"
+
+    def handle(self, *args, **options):
+        if get_backend() is None:
+            raise CommandError(f"База данных {connection.vendor} не поддерживается.")
+        with transaction.atomic():
+            count = rebuild_index(get_user_model().objects.all(), Review.objects.all())
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано документов: {count}"))
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:03
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+STEP_MINUTES = 15
+
+
+def reserve_existing_appointments(apps, schema_editor):
+    """Бронирует время уже существующих неотмененных записей"""
+    Appointment = apps.get_model('appointments', 'Appointment')
+    SlotReservation = apps.get_model('appointments', 'SlotReservation')
+    
+    appointments = Appointment.objects.exclude(status='canceled').values_list(
+        'pk', 'location_id', 'date', 'time', 'service__duration'
+    )
+    batch = []
+    for pk, location_id, date, time, duration in appointments.iterator(chunk_size=2000):
+        start = time.hour * 60 + time.minute
+        end = min(start + -(-int(duration.total_seconds()) // 60), 24 * 60)
+        for minutes in range(start - start % STEP_MINUTES, end, STEP_MINUTES):
+            batch.append(SlotReservation(
+                appointment_id=pk, location_id=location_id, date=date,
+                time=datetime.time(minutes // 60, minutes % 60),
+            ))
+        if len(batch) >= 2000:
+            SlotReservation.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    SlotReservation.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0002_appointment_admin_notes_appointment_notified_and_more'),
+        ('locations', '0002_location_latitude_location_longitude'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('time', models.TimeField(verbose_name='Время')),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='appointments.appointment', verbose_name='Запись')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_reservations', to='locations.location', verbose_name='Филиал')),
+            ],
+            options={
+                'verbose_name': 'Бронь времени',
+                'verbose_name_plural': 'Брони времени',
+                'constraints': [models.UniqueConstraint(fields=('location', 'date', 'time'), name='unique_location_slot')],
+            },
+        ),
+        migrations.RunPython(reserve_existing_appointments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0003_slotreservation'),
+        ('locations', '0002_location_latitude_location_longitude'),
+        ('services', '0003_alter_service_category_servicereview'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Окончание'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='starts_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Начало'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['location', 'starts_at'], name='appt_location_starts_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'starts_at'], name='appt_client_starts_at_idx'),
+        ),
+    ]
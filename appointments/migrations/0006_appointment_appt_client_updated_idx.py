@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_hot_path_indexes'),
+        ('locations', '0003_rating_aggregates'),
+        ('services', '0006_servicereview_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'updated'], name='appt_client_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_appointment_appt_client_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='google_event_id',
+            field=models.CharField(blank=True, editable=False, max_length=1024, verbose_name='ID события Google Calendar'),
+        ),
+    ]
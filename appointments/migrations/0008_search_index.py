@@ -0,0 +1,30 @@
+from django.db import migrations
+
+from appointments.search import get_backend, rebuild_index
+
+
+def create_search_index(apps, schema_editor):
+    """Создает поисковый индекс и заполняет его по существующим клиентам и отзывам"""
+    User = apps.get_model('auth', 'User')
+    Review = apps.get_model('appointments', 'Review')
+    rebuild_index(User.objects.all(), Review.objects.all(), schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    backend = get_backend(schema_editor.connection)
+    if backend is not None:
+        with schema_editor.connection.cursor() as cursor:
+            backend.drop_tables(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_appointment_google_event_id'),
+        ('core', '0001_initial'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
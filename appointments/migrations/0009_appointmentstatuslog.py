@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentStatusLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_status', models.CharField(choices=[('pending', 'Ожидает подтверждения'), ('confirmed', 'Подтверждена'), ('completed', 'Завершена'), ('canceled', 'Отменена')], max_length=20, verbose_name='Прежний статус')),
+                ('new_status', models.CharField(choices=[('pending', 'Ожидает подтверждения'), ('confirmed', 'Подтверждена'), ('completed', 'Завершена'), ('canceled', 'Отменена')], max_length=20, verbose_name='Новый статус')),
+                ('source', models.CharField(blank=True, choices=[('admin', 'Админ-панель'), ('staff', 'Кабинет администратора'), ('client', 'Клиент'), ('api', 'API')], max_length=20, verbose_name='Источник')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Время изменения')),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_log', to='appointments.appointment', verbose_name='Запись')),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Изменил')),
+            ],
+            options={
+                'verbose_name': 'Смена статуса',
+                'verbose_name_plural': 'Журнал статусов',
+                'ordering': ['-created'],
+                'indexes': [models.Index(fields=['appointment', 'created'], name='appt_status_log_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_appointmentstatuslog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointmentstatuslog',
+            name='appointment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='status_log', to='appointments.appointment', verbose_name='Запись'),
+        ),
+    ]
@@ -1,4 +1,8 @@
-from django.db import models
+import datetime
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils.html import format_html
 from core.models import TimeStampedModel
@@ -7,6 +11,15 @@ from services.models import Service
 
 User = get_user_model()
 
+def get_salon_timezone():
+    """Часовой пояс, в котором указаны дата и время записей"""
+    return ZoneInfo(settings.SALON_TIME_ZONE)
+
+def get_appointment_period(date, time, duration):
+    """Возвращает начало и окончание процедуры с учетом часового пояса салона"""
+    starts_at = datetime.datetime.combine(date, time, tzinfo=get_salon_timezone())
+    return starts_at, starts_at + duration
+
 class Appointment(TimeStampedModel):
     """Модель записи на процедуру"""
     STATUS_CHOICES = (
@@ -26,15 +39,71 @@ class Appointment(TimeStampedModel):
     admin_notes = models.TextField(verbose_name="Заметки администратора", blank=True, 
                                 help_text="Эти заметки видны только администраторам")
     notified = models.BooleanField(verbose_name="Клиент уведомлен", default=False)
+    # Денормализованные начало и окончание процедуры для выборок по интервалам времени
+    starts_at = models.DateTimeField(verbose_name="Начало", null=True, blank=True, editable=False)
+    ends_at = models.DateTimeField(verbose_name="Окончание", null=True, blank=True, editable=False)
+    # Событие в Google Calendar клиента (см. calendar_integration.outbox)
+    google_event_id = models.CharField(max_length=1024, blank=True, editable=False,
+                                       verbose_name="ID события Google Calendar")
     
     class Meta:
         verbose_name = "Запись"
         verbose_name_plural = "Записи"
         ordering = ['-date', '-time']
+        indexes = [
+            models.Index(fields=['location', 'starts_at'], name='appt_location_starts_at_idx'),
+            models.Index(fields=['client', 'starts_at'], name='appt_client_starts_at_idx'),
+            # Списки записей: сортировка по дате и времени, фильтры по статусу, филиалу и клиенту
+            models.Index(fields=['date', 'time'], name='appt_date_time_idx'),
+            models.Index(fields=['status', 'date', 'time'], name='appt_status_date_time_idx'),
+            models.Index(fields=['location', 'date', 'time'], name='appt_location_date_time_idx'),
+            models.Index(fields=['client', 'date', 'time'], name='appt_client_date_time_idx'),
+            # Дельта-синхронизация записей клиента (см. api.sync)
+            models.Index(fields=['client', 'updated'], name='appt_client_updated_idx'),
+        ]
         
     def __str__(self):
         return f"{self.client.get_full_name() or self.client.username} - {self.service.name} ({self.date})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем забронированное время, чтобы при сохранении обновлять бронь только при его изменении
+        if all(name in field_names for name in ('service_id', 'location_id', 'date', 'time', 'status')):
+            instance._booked_slot = instance._slot_key()
+        return instance
+    
+    def _slot_key(self):
+        return (self.service_id, self.location_id, self.date, self.time, self.status == 'canceled')
+    
+    def save(self, *args, **kwargs):
+        """
+        Сохраняет запись и бронирует занимаемое ею время в расписании филиала.
+        Если время уже занято другой записью, вызывает booking.SlotUnavailable.
+        """
+        from .booking import sync_reservations, SlotUnavailable
+        
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'date', 'time', 'service', 'service_id'}.intersection(update_fields):
+            self.starts_at, self.ends_at = get_appointment_period(self.date, self.time, self.service.duration)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'starts_at', 'ends_at'}
+        
+        adding = self._state.adding
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                slot = self._slot_key()
+                if getattr(self, '_booked_slot', None) != slot:
+                    sync_reservations(self)
+                    self._booked_slot = slot
+        except SlotUnavailable:
+            # Вставка откатилась вместе с транзакцией
+            if adding:
+                self.pk = None
+                self._state.adding = True
+            raise
+    
     def get_colored_status(self):
         """Возвращает статус с цветовой индикацией для админ-панели"""
         colors = {
@@ -63,6 +132,57 @@ class Appointment(TimeStampedModel):
             return "Не указан"
     client_phone.short_description = 'Телефон клиента'
 
+class SlotReservation(models.Model):
+    """Ячейка расписания филиала, занятая записью"""
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE,
+                                    related_name='reservations', verbose_name="Запись")
+    location = models.ForeignKey(Location, on_delete=models.CASCADE,
+                                 related_name='slot_reservations', verbose_name="Филиал")
+    date = models.DateField(verbose_name="Дата")
+    time = models.TimeField(verbose_name="Время")
+    
+    class Meta:
+        verbose_name = "Бронь времени"
+        verbose_name_plural = "Брони времени"
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'date', 'time'], name='unique_location_slot'),
+        ]
+    
+    def __str__(self):
+        return f"{self.location} {self.date} {self.time:%H:%M}"
+
+class AppointmentStatusLog(models.Model):
+    """
+    Журнал смены статусов записей (строки только добавляются, см. transitions).
+    При удалении записи строки журнала остаются, ссылка на запись обнуляется.
+    """
+    SOURCE_CHOICES = (
+        ('admin', 'Админ-панель'),
+        ('staff', 'Кабинет администратора'),
+        ('client', 'Клиент'),
+        ('api', 'API'),
+    )
+    
+    appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='status_log', verbose_name="Запись")
+    old_status = models.CharField(max_length=20, choices=Appointment.STATUS_CHOICES, verbose_name="Прежний статус")
+    new_status = models.CharField(max_length=20, choices=Appointment.STATUS_CHOICES, verbose_name="Новый статус")
+    changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='+', verbose_name="Изменил")
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, blank=True, verbose_name="Источник")
+    created = models.DateTimeField(auto_now_add=True, verbose_name="Время изменения")
+    
+    class Meta:
+        verbose_name = "Смена статуса"
+        verbose_name_plural = "Журнал статусов"
+        ordering = ['-created']
+        indexes = [
+            models.Index(fields=['appointment', 'created'], name='appt_status_log_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.appointment_id}: {self.old_status} -> {self.new_status}"
+
 class Review(TimeStampedModel):
     """Модель отзыва о процедуре"""
     appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE, 
@@ -74,6 +194,9 @@ class Review(TimeStampedModel):
     class Meta:
         verbose_name = "Отзыв"
         verbose_name_plural = "Отзывы"
+        indexes = [
+            models.Index(fields=['created'], name='review_created_idx'),
+        ]
         
     def __str__(self):
         return f"Отзыв от {self.appointment.client.get_full_name() or self.appointment.client.username}"
@@ -88,6 +211,8 @@ class Review(TimeStampedModel):
     
     def get_stars_display(self):
         """Возвращает звездный рейтинг для админ-панели"""
+        if self.rating is None:
+            return "-"
         stars = '★' * self.rating + '☆' * (5 - self.rating)
         return format_html('<span style="color: #FFD700;">{}</span>', stars)
     get_stars_display.short_description = 'Рейтинг'
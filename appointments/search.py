@@ -0,0 +1,238 @@
+"""
+Полнотекстовый поиск по клиентам и отзывам для списков администратора.
+
+Поиск через icontains по нескольким полям связанных таблиц не может
+использовать индексы и просматривает таблицы целиком. Вместо этого для
+каждого клиента (имя, фамилия, логин, email, телефон) и каждого отзыва
+(текст) хранится документ в поисковом индексе: в SQLite - таблица FTS5,
+в PostgreSQL - tsvector с GIN-индексом. Документы обновляются сигналами при
+изменении пользователя, клиента или отзыва; rebuild_index() (команда
+rebuild_search_index) строит индекс заново.
+
+Текст документов и запросов нормализуется одинаково для обеих баз:
+нижний регистр, ё -> е, разбиение на слова. Каждое слово запроса ищется
+как префикс ("иван" находит "Иванова"), слова объединяются через И.
+Для телефона дополнительно индексируются только цифры, с кодом страны и без.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+CLIENT_TABLE = 'appointments_client_search'
+REVIEW_TABLE = 'appointments_review_search'
+CLIENT_FIELDS = ('pk', 'first_name', 'last_name', 'username', 'email', 'client__phone')
+# Максимальное количество слов в запросе
+MAX_TERMS = 8
+BATCH_SIZE = 2000
+
+WORD_RE = re.compile(r'\w+')
+PHONE_QUERY_RE = re.compile(r'[\d\s()+-]+')
+
+
+def normalize(text):
+    """Нормализованный текст документа: слова в нижнем регистре через пробел, ё заменена на е"""
+    return ' '.join(WORD_RE.findall((text or '').lower().replace('ё', 'е')))
+
+
+def phone_variants(phone):
+    """Номер телефона только цифрами, а для российских номеров - еще и без кода страны"""
+    digits = re.sub(r'\D', '', phone or '')
+    variants = [digits] if digits else []
+    if len(digits) == 11 and digits[0] in '78':
+        variants.append(digits[1:])
+    return variants
+
+
+def parse_query(query):
+    """
+    Слова запроса в виде групп вариантов: документ подходит, если в нем для каждой
+    группы есть слово, начинающееся с одного из ее вариантов.
+    """
+    query = (query or '').strip()
+    if PHONE_QUERY_RE.fullmatch(query):
+        digits = re.sub(r'\D', '', query)
+        # Номер, набранный через 8 или +7, ищется и без кода страны
+        if len(digits) > 1 and digits[0] in '78':
+            return [[digits, digits[1:]]]
+        return [[digits]] if digits else []
+    return [[term] for term in normalize(query).split()[:MAX_TERMS]]
+
+
+def client_document(row):
+    """Документ клиента по строке values(*CLIENT_FIELDS)"""
+    parts = [row['first_name'], row['last_name'], row['username'], row['email'], row['client__phone']]
+    return ' '.join([normalize(' '.join(filter(None, parts))), *phone_variants(row['client__phone'])])
+
+
+class SQLiteSearchBackend:
+    """Таблицы FTS5; rowid строки индекса - id пользователя или отзыва"""
+
+    def create_tables(self, cursor):
+        for table in (CLIENT_TABLE, REVIEW_TABLE):
+            # Префиксные индексы ускоряют поиск по началу слова из 2-3 символов
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {table} USING fts5(body, tokenize='unicode61', prefix='2 3')"
+            )
+
+    def drop_tables(self, cursor):
+        for table in (CLIENT_TABLE, REVIEW_TABLE):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def replace(self, cursor, table, documents):
+        self.delete(cursor, table, [pk for pk, _ in documents])
+        cursor.executemany(f"INSERT INTO {table} (rowid, body) VALUES (%s, %s)", documents)
+
+    def delete(self, cursor, table, pks):
+        cursor.executemany(f"DELETE FROM {table} WHERE rowid = %s", [(pk,) for pk in pks])
+
+    def match_sql(self, table):
+        return f"SELECT rowid FROM {table} WHERE {table} MATCH %s"
+
+    def build_query(self, groups):
+        def prefix(term):
+            return '"%s"*' % term.replace('"', '""')
+        return ' AND '.join('(%s)' % ' OR '.join(map(prefix, group)) for group in groups)
+
+
+class PostgreSQLSearchBackend:
+    """Таблицы с tsvector (конфигурация simple: текст уже нормализован) и GIN-индексом"""
+
+    def create_tables(self, cursor):
+        for table in (CLIENT_TABLE, REVIEW_TABLE):
+            cursor.execute(f"CREATE TABLE {table} (id bigint PRIMARY KEY, document tsvector NOT NULL)")
+            cursor.execute(f"CREATE INDEX {table}_document_idx ON {table} USING GIN (document)")
+
+    def drop_tables(self, cursor):
+        for table in (CLIENT_TABLE, REVIEW_TABLE):
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def replace(self, cursor, table, documents):
+        cursor.executemany(
+            f"INSERT INTO {table} (id, document) VALUES (%s, to_tsvector('simple', %s)) "
+            f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+            documents,
+        )
+
+    def delete(self, cursor, table, pks):
+        cursor.execute(f"DELETE FROM {table} WHERE id = ANY(%s)", [list(pks)])
+
+    def match_sql(self, table):
+        return f"SELECT id FROM {table} WHERE document @@ to_tsquery('simple', %s)"
+
+    def build_query(self, groups):
+        def prefix(term):
+            return "'%s':*" % term.replace('\\', '\\\\').replace("'", "''")
+        return ' & '.join('(%s)' % ' | '.join(map(prefix, group)) for group in groups)
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend(),
+    'postgresql': PostgreSQLSearchBackend(),
+}
+
+
+def get_backend(conn=None):
+    """Поисковый индекс для базы данных или None, если база его не поддерживает"""
+    return BACKENDS.get((conn or connection).vendor)
+
+
+def index_clients(user_ids):
+    """Обновляет документы клиентов; удаленные пользователи убираются из индекса"""
+    backend = get_backend()
+    if backend is None or not user_ids:
+        return
+    rows = get_user_model().objects.filter(pk__in=user_ids).values(*CLIENT_FIELDS)
+    documents = [(row['pk'], client_document(row)) for row in rows]
+    with connection.cursor() as cursor:
+        backend.delete(cursor, CLIENT_TABLE, set(user_ids) - {pk for pk, _ in documents})
+        backend.replace(cursor, CLIENT_TABLE, documents)
+
+
+def index_reviews(reviews):
+    """Обновляет документы отзывов"""
+    backend = get_backend()
+    if backend is None or not reviews:
+        return
+    documents = [(review.pk, normalize(review.comment)) for review in reviews]
+    with connection.cursor() as cursor:
+        backend.replace(cursor, REVIEW_TABLE, documents)
+
+
+def remove_reviews(review_ids):
+    backend = get_backend()
+    if backend is None or not review_ids:
+        return
+    with connection.cursor() as cursor:
+        backend.delete(cursor, REVIEW_TABLE, review_ids)
+
+
+def rebuild_index(users, reviews, conn=None):
+    """
+    Заполняет индекс заново по querysets пользователей и отзывов
+    (используется и в миграции с историческими моделями). Возвращает количество документов.
+    """
+    conn = conn or connection
+    backend = get_backend(conn)
+    if backend is None:
+        return 0
+    count = 0
+    with conn.cursor() as cursor:
+        backend.drop_tables(cursor)
+        backend.create_tables(cursor)
+        sources = (
+            (CLIENT_TABLE, users.values(*CLIENT_FIELDS), client_document),
+            (REVIEW_TABLE, reviews.values('pk', 'comment'), lambda row: normalize(row['comment'])),
+        )
+        for table, rows, build in sources:
+            batch = []
+            for row in rows.order_by('pk').iterator(chunk_size=BATCH_SIZE):
+                batch.append((row['pk'], build(row)))
+                if len(batch) >= BATCH_SIZE:
+                    backend.replace(cursor, table, batch)
+                    count += len(batch)
+                    batch = []
+            backend.replace(cursor, table, batch)
+            count += len(batch)
+    return count
+
+
+def _match(backend, table, groups):
+    return RawSQL(backend.match_sql(table), [backend.build_query(groups)])
+
+
+def search_appointments(queryset, query):
+    """Записи, клиент которых подходит под запрос (имя, фамилия, логин, email, телефон)"""
+    backend = get_backend()
+    if backend is None:
+        return queryset.filter(
+            Q(client__username__icontains=query) | Q(client__first_name__icontains=query)
+            | Q(client__last_name__icontains=query) | Q(client__email__icontains=query)
+            | Q(client__client__phone__icontains=query)
+        )
+    groups = parse_query(query)
+    if not groups:
+        return queryset.none()
+    return queryset.filter(client_id__in=_match(backend, CLIENT_TABLE, groups))
+
+
+def search_reviews(queryset, query):
+    """Отзывы, текст или клиент которых подходит под запрос"""
+    backend = get_backend()
+    if backend is None:
+        return queryset.filter(
+            Q(comment__icontains=query) | Q(appointment__client__username__icontains=query)
+            | Q(appointment__client__first_name__icontains=query)
+            | Q(appointment__client__last_name__icontains=query)
+            | Q(appointment__client__email__icontains=query)
+            | Q(appointment__client__client__phone__icontains=query)
+        )
+    groups = parse_query(query)
+    if not groups:
+        return queryset.none()
+    return queryset.filter(
+        Q(pk__in=_match(backend, REVIEW_TABLE, groups))
+        | Q(appointment__client_id__in=_match(backend, CLIENT_TABLE, groups))
+    )
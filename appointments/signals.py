@@ -0,0 +1,43 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from core.models import Client
+from .models import Review
+from .search import CLIENT_FIELDS, index_clients, index_reviews, remove_reviews
+
+# Отправляется после изменения нескольких записей в обход save() (queryset.update, bulk_create, bulk_update).
+# sender - модель Appointment, pks - список id измененных записей
+appointments_changed = Signal()
+
+# Отправляется один раз после фиксации транзакции, в которой сменились статусы записей (см. transitions).
+# sender - модель Appointment, changes - список transitions.StatusChange, user - кто изменил, source - источник
+appointment_statuses_changed = Signal()
+
+# Поля пользователя, входящие в поисковый документ клиента
+USER_SEARCH_FIELDS = {field for field in CLIENT_FIELDS if field != 'pk' and '__' not in field}
+
+
+@receiver(post_save, sender=get_user_model())
+def index_saved_user(sender, instance, update_fields=None, **kwargs):
+    # Сохранение с update_fields (например, last_login при входе) индекс обычно не затрагивает
+    if update_fields is None or USER_SEARCH_FIELDS & set(update_fields):
+        index_clients([instance.pk])
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=get_user_model())
+def index_client(sender, instance, **kwargs):
+    index_clients([instance.user_id if sender is Client else instance.pk])
+
+
+@receiver(post_save, sender=Review)
+def index_saved_review(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'comment' in update_fields:
+        index_reviews([instance])
+
+
+@receiver(post_delete, sender=Review)
+def remove_deleted_review(sender, instance, **kwargs):
+    remove_reviews([instance.pk])
@@ -1,3 +1,401 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import threading
+import time
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from core.models import Client
+from locations.models import Location
+from services.models import Service, ServiceCategory
+from .availability import DEFAULT_SCHEDULE, get_available_slots, is_slot_available, parse_working_hours
+from .booking import SlotUnavailable
+from .export import csv_value, export_rows, iter_csv, iter_xlsx
+from .forms import AppointmentForm
+from .models import Appointment, AppointmentStatusLog, Review, SlotReservation
+from .transitions import InvalidTransition, transition
+
+User = get_user_model()
+
+
+def create_catalog(duration=datetime.timedelta(minutes=60)):
+    """Услуга и филиал для записей в тестах"""
+    category = ServiceCategory.objects.create(name="LPG")
+    service = Service.objects.create(
+        category=category, name="LPG массаж", description="", price=2000, duration=duration,
+    )
+    location = Location.objects.create(
+        name="Центр", address="ул. Московская, 1", phone="+7 900 000-00-00",
+        email="center@example.com", working_hours="Пн-Вс: 09:00-21:00",
+    )
+    return service, location
+
+
+class BookingRaceTest(TransactionTestCase):
+    """Одновременные записи на одно время: выигрывает ровно одна"""
+    THREADS = 30
+
+    def setUp(self):
+        self.service, self.location = create_catalog()
+        self.clients = [User.objects.create_user(f'client{i}') for i in range(self.THREADS)]
+        self.date = datetime.date.today() + datetime.timedelta(days=7)
+
+    def test_one_winner(self):
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def book(client):
+            try:
+                barrier.wait()
+                for attempt in range(200):
+                    try:
+                        Appointment.objects.create(
+                            client=client, service=self.service, location=self.location,
+                            date=self.date, time=datetime.time(12, 0),
+                        )
+                        results.append('booked')
+                        return
+                    except SlotUnavailable:
+                        results.append('conflict')
+                        return
+                    except OperationalError:
+                        # SQLite допускает одного пишущего; занятая база - не конфликт записи
+                        time.sleep(0.01)
+                results.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book, args=(client,)) for client in self.clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('booked'), 1, results)
+        self.assertEqual(results.count('conflict'), self.THREADS - 1)
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(SlotReservation.objects.count(), 4)
+
+
+class BookingConflictTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.client_user = User.objects.create_user('client')
+        cls.date = datetime.date.today() + datetime.timedelta(days=7)
+        Appointment.objects.create(
+            client=cls.client_user, service=cls.service, location=cls.location,
+            date=cls.date, time=datetime.time(12, 0),
+        )
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_user('other'))
+
+    def book(self, start):
+        return self.api.post('/api/v1/appointments/', {
+            'service_id': self.service.pk, 'location_id': self.location.pk,
+            'date': self.date.isoformat(), 'time': start,
+        }, format='json')
+
+    def test_overlap_returns_409(self):
+        response = self.book('12:30')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['detail'].code, 'slot_unavailable')
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_adjacent_slot_is_booked(self):
+        response = self.book('13:00')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(SlotReservation.objects.filter(location=self.location).count(), 8)
+
+    def test_other_location_does_not_conflict(self):
+        other = Location.objects.create(
+            name="Север", address="ул. Северная, 2", phone="+7 900 000-00-01",
+            email="north@example.com", working_hours="Пн-Вс: 09:00-21:00",
+        )
+        Appointment.objects.create(
+            client=self.client_user, service=self.service, location=other,
+            date=self.date, time=datetime.time(12, 0),
+        )
+        self.assertEqual(SlotReservation.objects.count(), 8)
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        client = User.objects.create_user('client', first_name="@SUM(A1:A9)", last_name="")
+        Client.objects.create(user=client, phone="+7 999 123-45-67")
+        Appointment.objects.create(
+            client=client, service=cls.service, location=cls.location,
+            date=datetime.date.today() + datetime.timedelta(days=1), time=datetime.time(12, 0),
+            notes='=HYPERLINK("http://example.com","Подробнее")',
+        )
+
+    def test_csv_escapes_formulas(self):
+        body = b''.join(iter_csv(export_rows(Appointment.objects.all()))).decode('utf-8-sig')
+        header, row = csv.reader(io.StringIO(body), delimiter=';')
+        values = dict(zip(header, row))
+        self.assertEqual(values['Клиент'], "'@SUM(A1:A9)")
+        self.assertEqual(values['Примечания'], "'" + '=HYPERLINK("http://example.com","Подробнее")')
+        self.assertEqual(values['Статус'], "Ожидает подтверждения")
+        self.assertEqual(values['Телефон'], "+7 999 123-45-67")
+
+    def test_csv_value(self):
+        for value in ("+7 (900) 123-45-67", "-5", "-2,5", "Иванова", 42):
+            with self.subTest(value=value):
+                self.assertEqual(csv_value(value), value)
+        for value in ("-SUM(A1)", "+A1", "-1+cmd|' /C calc'!A0", "=1", "\tтекст"):
+            with self.subTest(value=value):
+                self.assertEqual(csv_value(value), "'" + value)
+
+    def test_xlsx_keeps_text(self):
+        body = b''.join(iter_xlsx(export_rows(Appointment.objects.all())))
+        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+            sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        # Строковые ячейки XLSX не вычисляются, текст сохраняется как есть
+        self.assertIn('<t xml:space="preserve">@SUM(A1:A9)</t>', sheet)
+
+
+@override_settings(COMPRESS_ENABLED=False)
+class StaffListSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        client = User.objects.create_user('ivanova', first_name="Анна", last_name="Иванова")
+        appointment = Appointment.objects.create(
+            client=client, service=cls.service, location=cls.location,
+            date=datetime.date.today() + datetime.timedelta(days=1), time=datetime.time(12, 0),
+        )
+        Review.objects.create(appointment=appointment, rating=5, comment="Отличный массаж")
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_search_without_words(self):
+        # Запрос без букв и цифр не дает условий поиска: пустой список, а не ошибка
+        for url in ('/appointments/admin/list/', '/appointments/admin/reviews/'):
+            for query in ('"', '-', '!'):
+                with self.subTest(url=url, query=query):
+                    response = self.client.get(url, {'search': query})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.context['page_obj'].count, 0)
+
+    def test_search_by_name(self):
+        response = self.client.get('/appointments/admin/list/', {'search': 'иван'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_obj'].count, 1)
+
+    def search(self, query, url='/appointments/admin/list/'):
+        # Число строк списка кэшируется, поэтому считаются строки страницы
+        return len(self.client.get(url, {'search': query}).context['page_obj'].object_list)
+
+    def test_search_after_client_edit(self):
+        user = User.objects.get(username='ivanova')
+        user.last_name = "Королёва"
+        user.save()
+        client = Client.objects.create(user=user, phone="+7 (999) 123-45-67")
+        for query in ("королёва", "Королева", "анна кор", "+7 999 123", "8999123", "9991234567"):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), 1)
+                self.assertEqual(self.search(query, '/appointments/admin/reviews/'), 1)
+        self.assertEqual(self.search("иванова"), 0)
+
+        client.phone = "+7 (912) 000-00-00"
+        client.save()
+        self.assertEqual(self.search("999123"), 0)
+        self.assertEqual(self.search("912000"), 1)
+
+        client.delete()
+        self.assertEqual(self.search("912000"), 0)
+        self.assertEqual(self.search("королева"), 1)
+
+
+class AppointmentStatusLogTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.client_user = User.objects.create_user('client')
+        cls.date = datetime.date.today() + datetime.timedelta(days=7)
+
+    def book(self, client=None, status='pending'):
+        return Appointment.objects.create(
+            client=client or self.client_user, service=self.service, location=self.location,
+            date=self.date, time=datetime.time(12, 0), status=status,
+        )
+
+    def test_log_survives_delete(self):
+        appointment = self.book()
+        transition(appointment, 'canceled', source='staff')
+        appointment.delete()
+        log = AppointmentStatusLog.objects.get()
+        self.assertIsNone(log.appointment_id)
+        self.assertEqual((log.old_status, log.new_status), ('pending', 'canceled'))
+
+    def test_same_status_is_invalid(self):
+        appointment = self.book(status='canceled')
+        with self.assertRaisesMessage(InvalidTransition, "Запись уже в статусе «Отменена»."):
+            transition(appointment, 'canceled', source='staff')
+        self.assertFalse(AppointmentStatusLog.objects.exists())
+
+    def test_cancel_view_reports_canceled(self):
+        appointment = self.book(status='canceled')
+        self.client.force_login(self.client_user)
+        response = self.client.post(f'/appointments/{appointment.pk}/cancel/')
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertEqual(messages, ["Невозможно отменить завершенную или уже отмененную запись."])
+
+
+class AppointmentAdminTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.date = datetime.date.today() + datetime.timedelta(days=7)
+        cls.canceled = Appointment.objects.create(
+            client=User.objects.create_user('first'), service=cls.service, location=cls.location,
+            date=cls.date, time=datetime.time(12, 0), status='canceled',
+        )
+        # Время отмененной записи заняла другая запись
+        Appointment.objects.create(
+            client=User.objects.create_user('second'), service=cls.service, location=cls.location,
+            date=cls.date, time=datetime.time(12, 0),
+        )
+        cls.admin = User.objects.create_superuser('admin')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.url = f'/admin/appointments/appointment/{self.canceled.pk}/change/'
+
+    def restore(self):
+        response = self.client.get(self.url)
+        data = {
+            'client': self.canceled.client_id, 'service': self.service.pk, 'location': self.location.pk,
+            'date': self.date.isoformat(), 'time': '12:00', 'status': 'pending',
+            'notes': '', 'admin_notes': '',
+        }
+        for inline in response.context['inline_admin_formsets']:
+            management = inline.formset.management_form
+            for name, field in management.fields.items():
+                data[management.add_prefix(name)] = management.initial.get(name, field.initial)
+        return self.client.post(self.url, data)
+
+    def test_taken_slot_is_form_error(self):
+        response = self.restore()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "уже занято другой записью")
+        self.canceled.refresh_from_db()
+        self.assertEqual(self.canceled.status, 'canceled')
+
+    def test_slot_taken_after_validation(self):
+        # Проверка формы прошла, но время заняли до сохранения
+        with mock.patch('appointments.forms.has_conflicts', return_value=False):
+            response = self.restore()
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertEqual(len(messages), 1)
+        self.assertIn("Запись не сохранена", messages[0])
+        self.canceled.refresh_from_db()
+        self.assertEqual(self.canceled.status, 'canceled')
+        self.assertFalse(AppointmentStatusLog.objects.exists())
+
+    def test_cancel_action_reports_canceled(self):
+        pending = Appointment.objects.create(
+            client=self.canceled.client, service=self.service, location=self.location,
+            date=self.date, time=datetime.time(15, 0),
+        )
+        response = self.client.post('/admin/appointments/appointment/', {
+            'action': 'mark_as_canceled', '_selected_action': [self.canceled.pk, pending.pk],
+        })
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertEqual(messages, ["1 записей уже в этом статусе.", "1 записей отмечены как отмененные."])
+        self.assertEqual(
+            list(AppointmentStatusLog.objects.values_list('appointment_id', 'new_status')),
+            [(pending.pk, 'canceled')],
+        )
+
+
+def next_weekday(weekday, weeks=1):
+    """Дата с указанным днем недели (0 - понедельник) не раньше чем через неделю"""
+    date = datetime.date.today() + datetime.timedelta(days=7 * weeks)
+    return date + datetime.timedelta(days=(weekday - date.weekday()) % 7)
+
+
+class WorkingHoursTest(SimpleTestCase):
+    def test_ranges_and_single_days(self):
+        schedule = parse_working_hours("Пн-Пт: 9:00-21:00, Сб: 10:00-19:00")
+        self.assertEqual(schedule[0], (datetime.time(9, 0), datetime.time(21, 0)))
+        self.assertEqual(schedule[4], (datetime.time(9, 0), datetime.time(21, 0)))
+        self.assertEqual(schedule[5], (datetime.time(10, 0), datetime.time(19, 0)))
+        self.assertNotIn(6, schedule)
+
+    def test_range_across_week_end(self):
+        schedule = parse_working_hours("ПТ-ВТ 11:30 - 20:00")
+        self.assertEqual(sorted(schedule), [0, 1, 4, 5, 6])
+        self.assertEqual(schedule[6], (datetime.time(11, 30), datetime.time(20, 0)))
+
+    def test_unparsed_uses_default(self):
+        self.assertEqual(parse_working_hours("Ежедневно"), DEFAULT_SCHEDULE)
+        self.assertEqual(parse_working_hours("Пн: 25:00-26:00"), DEFAULT_SCHEDULE)
+
+
+class AvailableSlotsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.location.working_hours = "Пн-Пт: 10:00-14:00"
+        cls.location.save()
+        cls.monday = next_weekday(0)
+        cls.client_user = User.objects.create_user('client')
+
+    def book(self, time):
+        return Appointment.objects.create(
+            client=self.client_user, service=self.service, location=self.location,
+            date=self.monday, time=time,
+        )
+
+    def times(self, *values):
+        return [datetime.time(*value) for value in values]
+
+    def test_grid_within_working_hours(self):
+        sunday = self.monday + datetime.timedelta(days=6)
+        slots = get_available_slots(self.location, self.service, self.monday, sunday)
+        # Процедура на час должна закончиться до закрытия
+        self.assertEqual(slots[self.monday], self.times((10, 0), (10, 30), (11, 0), (11, 30), (12, 0), (12, 30), (13, 0)))
+        self.assertEqual(slots[sunday], [])
+
+    def test_booked_time_is_skipped(self):
+        self.book(datetime.time(11, 0))
+        slots = get_available_slots(self.location, self.service, self.monday, self.monday)[self.monday]
+        self.assertEqual(slots, self.times((10, 0), (12, 0), (12, 30), (13, 0)))
+
+    def test_slot_checks(self):
+        self.assertTrue(is_slot_available(self.location, self.service, self.monday, datetime.time(13, 0)))
+        for time in (datetime.time(3, 0), datetime.time(13, 30), datetime.time(10, 15)):
+            with self.subTest(time=time):
+                self.assertFalse(is_slot_available(self.location, self.service, self.monday, time))
+        sunday = self.monday + datetime.timedelta(days=6)
+        self.assertFalse(is_slot_available(self.location, self.service, sunday, datetime.time(11, 0)))
+
+    def test_own_time_off_grid(self):
+        appointment = self.book(datetime.time(10, 15))
+        self.assertTrue(is_slot_available(
+            self.location, self.service, self.monday, datetime.time(10, 15), exclude=appointment.pk,
+        ))
+        # Вне сетки принимается только текущее время записи
+        self.assertFalse(is_slot_available(
+            self.location, self.service, self.monday, datetime.time(10, 45), exclude=appointment.pk,
+        ))
+        form = AppointmentForm({
+            'service': self.service.pk, 'location': self.location.pk,
+            'date': self.monday.isoformat(), 'time': '10:15', 'notes': "Перенесли комментарий",
+        }, instance=appointment)
+        self.assertTrue(form.is_valid(), form.errors)
@@ -0,0 +1,112 @@
+"""
+Смена статусов записей.
+
+Все изменения статуса (кабинет и админ-панель администратора, отмена
+клиентом, API) проходят через apply_transitions: он проверяет, что переход
+допустим (ALLOWED_TRANSITIONS), применяет всю пачку изменений в одной
+транзакции пакетными запросами (booking.bulk_set_status), добавляет
+по строке в журнал AppointmentStatusLog на каждое изменение одним
+bulk_create и после фиксации транзакции отправляет одно событие
+appointment_statuses_changed со всеми изменениями.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+
+from .booking import SlotUnavailable, bulk_set_status
+from .models import Appointment, AppointmentStatusLog
+from .signals import appointment_statuses_changed
+
+# Допустимые переходы: из статуса -> в статусы. Завершенная запись не меняется
+ALLOWED_TRANSITIONS = {
+    'pending': {'confirmed', 'completed', 'canceled'},
+    'confirmed': {'pending', 'completed', 'canceled'},
+    'canceled': {'pending', 'confirmed'},
+    'completed': set(),
+}
+
+StatusChange = namedtuple('StatusChange', 'appointment_id old_status new_status')
+
+
+class InvalidTransition(Exception):
+    """Запись нельзя перевести в указанный статус"""
+
+
+def check_transition(old_status, new_status):
+    """
+    Вызывает InvalidTransition, если переход из old_status в new_status недопустим.
+    Переход в тот же статус тоже недопустим: повторная отмена отмененной записи - ошибка, а не успех.
+    """
+    statuses = dict(Appointment.STATUS_CHOICES)
+    if old_status == new_status:
+        raise InvalidTransition(f"Запись уже в статусе «{statuses.get(new_status, new_status)}».")
+    if new_status not in ALLOWED_TRANSITIONS.get(old_status, ()):
+        raise InvalidTransition(
+            f"Нельзя изменить статус «{statuses.get(old_status, old_status)}» "
+            f"на «{statuses.get(new_status, new_status)}»."
+        )
+
+
+def allowed_statuses(status):
+    """Статусы, которые можно выбрать для записи с текущим статусом (включая его самого)"""
+    return {status, *ALLOWED_TRANSITIONS.get(status, ())}
+
+
+def apply_transitions(changes, user=None, source=''):
+    """
+    Меняет статусы записей {запись: новый статус}; записи должны быть загружены
+    с select_related('service'). Текущие статусы перечитываются с блокировкой строк.
+    Возвращает {запись: исключение} для записей, которые не изменены:
+    InvalidTransition - недопустимый переход (в том числе в текущий статус записи),
+    SlotUnavailable - время уже занято.
+    """
+    errors = {}
+    if not changes:
+        return errors
+
+    with transaction.atomic():
+        current = dict(
+            Appointment.objects.select_for_update()
+            .filter(pk__in=[appointment.pk for appointment in changes])
+            .values_list('pk', 'status')
+        )
+        by_status = {}
+        old_statuses = {}
+        for appointment, new_status in changes.items():
+            appointment.status = current.get(appointment.pk, appointment.status)
+            try:
+                check_transition(appointment.status, new_status)
+            except InvalidTransition as exc:
+                errors[appointment] = exc
+                continue
+            old_statuses[appointment] = appointment.status
+            by_status.setdefault(new_status, []).append(appointment)
+
+        applied = []
+        for new_status, appointments in by_status.items():
+            conflicts = {id(appointment) for appointment in bulk_set_status(appointments, new_status)}
+            for appointment in appointments:
+                if id(appointment) in conflicts:
+                    errors[appointment] = SlotUnavailable("Время этой записи уже занято другой записью.")
+                else:
+                    applied.append(StatusChange(appointment.pk, old_statuses[appointment], new_status))
+
+        if applied:
+            AppointmentStatusLog.objects.bulk_create([
+                AppointmentStatusLog(
+                    appointment_id=change.appointment_id, old_status=change.old_status,
+                    new_status=change.new_status, changed_by=user, source=source,
+                )
+                for change in applied
+            ])
+            transaction.on_commit(lambda: appointment_statuses_changed.send(
+                sender=Appointment, changes=applied, user=user, source=source,
+            ))
+    return errors
+
+
+def transition(appointment, new_status, user=None, source=''):
+    """Меняет статус одной записи; при ошибке вызывает InvalidTransition или SlotUnavailable"""
+    error = apply_transitions({appointment: new_status}, user, source).get(appointment)
+    if error is not None:
+        raise error
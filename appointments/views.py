@@ -3,10 +3,16 @@ from django.views.generic import ListView, DetailView, CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy, reverse
 from django.contrib import messages
+from django.db import transaction
 from .models import Appointment, Review
 from .forms import AppointmentForm, AppointmentStatusForm, ReviewForm
+from .booking import SlotUnavailable
+from .transitions import InvalidTransition, transition
+from .search import search_appointments, search_reviews
 from services.models import Service
 from locations.models import Location
+from locations.cache import get_active_locations
+from core.pagination import KeysetPaginationMixin
 from django.utils import timezone
 
 class AppointmentCreateView(LoginRequiredMixin, CreateView):
@@ -52,8 +58,16 @@ class AppointmentCreateView(LoginRequiredMixin, CreateView):
     def form_valid(self, form):
         """Устанавливаем текущего пользователя как клиента"""
         form.instance.client = self.request.user
+        try:
+            response = super().form_valid(form)
+        except SlotUnavailable:
+            # Время успели занять между проверкой формы и сохранением
+            form.add_error('time', "Это время только что заняли. Пожалуйста, выберите другое время.")
+            response = self.form_invalid(form)
+            response.status_code = 409
+            return response
         messages.success(self.request, "Ваша запись успешно создана и ожидает подтверждения.")
-        return super().form_valid(form)
+        return response
 
 class AppointmentListView(LoginRequiredMixin, ListView):
     """Представление для просмотра списка записей пользователя"""
@@ -96,9 +110,11 @@ class AppointmentCancelView(LoginRequiredMixin, UpdateView):
     
     def form_valid(self, form):
         # Изменяем статус на "отменена"
-        self.object = form.save(commit=False)
-        self.object.status = 'canceled'
-        self.object.save()
+        try:
+            transition(self.object, 'canceled', user=self.request.user, source='client')
+        except InvalidTransition:
+            messages.error(self.request, "Невозможно отменить завершенную или уже отмененную запись.")
+            return redirect(self.get_success_url())
         messages.success(self.request, "Запись успешно отменена.")
         return redirect(self.get_success_url())
 
@@ -143,15 +159,16 @@ class StaffRequiredMixin(UserPassesTestMixin):
         messages.error(self.request, "У вас нет доступа к этой странице. Необходимы права администратора.")
         return redirect('home')
 
-class AdminAppointmentListView(LoginRequiredMixin, StaffRequiredMixin, ListView):
+class AdminAppointmentListView(LoginRequiredMixin, StaffRequiredMixin, KeysetPaginationMixin, ListView):
     """Представление для просмотра всех заявок администратором"""
     model = Appointment
     template_name = 'appointments/admin_appointment_list.html'
     context_object_name = 'appointments'
     paginate_by = 10
+    cursor_ordering = ('-date', '-time', '-id')
     
     def get_queryset(self):
-        queryset = super().get_queryset().order_by('-date', '-time')
+        queryset = super().get_queryset().select_related('client', 'service', 'location').order_by('-date', '-time')
         
         # Фильтрация по статусу
         status = self.request.GET.get('status')
@@ -171,18 +188,13 @@ class AdminAppointmentListView(LoginRequiredMixin, StaffRequiredMixin, ListView)
         # Поиск по клиенту
         search_query = self.request.GET.get('search')
         if search_query:
-            queryset = queryset.filter(
-                client__username__icontains=search_query) | queryset.filter(
-                client__first_name__icontains=search_query) | queryset.filter(
-                client__last_name__icontains=search_query) | queryset.filter(
-                client__email__icontains=search_query
-            )
+            queryset = search_appointments(queryset, search_query)
         
         return queryset
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['locations'] = Location.objects.filter(is_active=True)
+        context['locations'] = get_active_locations()
         context['status_choices'] = Appointment.STATUS_CHOICES
         
         # Текущие фильтры
@@ -220,7 +232,25 @@ class AdminAppointmentUpdateView(LoginRequiredMixin, StaffRequiredMixin, UpdateV
         return reverse('admin_appointment_detail', kwargs={'pk': self.object.pk})
     
     def form_valid(self, form):
-        response = super().form_valid(form)
+        self.object = form.save(commit=False)
+        # Статус меняется через transitions, остальные поля формы сохраняются как обычно
+        new_status = self.object.status
+        self.object.status = form.initial['status']
+        try:
+            with transaction.atomic():
+                self.object.save(update_fields=['admin_notes', 'notified', 'updated'])
+                # Форма позволяет оставить текущий статус и изменить только заметки
+                if new_status != form.initial['status']:
+                    transition(self.object, new_status, user=self.request.user, source='staff')
+        except SlotUnavailable:
+            form.add_error('status', "Время этой записи уже занято другой записью, восстановить ее нельзя.")
+            response = self.form_invalid(form)
+            response.status_code = 409
+            return response
+        except InvalidTransition as exc:
+            form.add_error('status', str(exc))
+            return self.form_invalid(form)
+        response = redirect(self.get_success_url())
         messages.success(self.request, f"Статус заявки успешно обновлен на '{self.object.get_status_display()}'.")
         
         # Если отметили как уведомленный
@@ -230,15 +260,18 @@ class AdminAppointmentUpdateView(LoginRequiredMixin, StaffRequiredMixin, UpdateV
         
         return response
 
-class AdminReviewListView(LoginRequiredMixin, StaffRequiredMixin, ListView):
+class AdminReviewListView(LoginRequiredMixin, StaffRequiredMixin, KeysetPaginationMixin, ListView):
     """Представление для просмотра всех отзывов администратором"""
     model = Review
     template_name = 'appointments/admin_review_list.html'
     context_object_name = 'reviews'
     paginate_by = 10
+    cursor_ordering = ('-created', '-id')
     
     def get_queryset(self):
-        queryset = super().get_queryset().order_by('-created')
+        queryset = super().get_queryset().select_related(
+            'appointment__client', 'appointment__service', 'appointment__location'
+        ).order_by('-created')
         
         # Фильтрация по публикации
         is_published = self.request.GET.get('is_published')
@@ -258,11 +291,7 @@ class AdminReviewListView(LoginRequiredMixin, StaffRequiredMixin, ListView):
         # Поиск
         search_query = self.request.GET.get('search')
         if search_query:
-            queryset = queryset.filter(comment__icontains=search_query) | queryset.filter(
-                appointment__client__username__icontains=search_query) | queryset.filter(
-                appointment__client__first_name__icontains=search_query) | queryset.filter(
-                appointment__client__last_name__icontains=search_query
-            )
+            queryset = search_reviews(queryset, search_query)
         
         return queryset
     
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CalendarIntegrationConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "calendar_integration"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,101 @@
+"""
+Пакетные запросы к Google Calendar API.
+
+Вместо отдельного HTTP-запроса на каждое событие операции собираются в пакеты
+(batch request): до BATCH_LIMIT операций уходят одним запросом, а ответ
+разбирается по каждой операции отдельно, так что ошибка одной операции
+не мешает остальным. Операции разных пользователей можно объединять в один
+пакет: у каждой операции свои учетные данные.
+
+Квота Google считает каждую операцию пакета отдельным запросом, поэтому
+перед отправкой пакета из TokenBucket берется столько токенов, сколько в нем
+операций.
+"""
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from .services import build_event, get_events_resource
+
+# Google Calendar принимает не больше 50 операций в одном пакете
+BATCH_LIMIT = 50
+# Ограничение частоты запросов к API на процесс (операций в секунду и запас на всплеск)
+RATE_LIMIT = 10
+RATE_BURST = BATCH_LIMIT
+# Ответы на удаление уже удаленного события
+GONE_STATUSES = (404, 410)
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate=RATE_LIMIT, capacity=RATE_BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def take(self, count=1):
+        """Ждет, пока в запасе не наберется count токенов, и забирает их"""
+        count = min(count, self.capacity)
+        with self.lock:
+            while True:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                self.sleep((count - self.tokens) / self.rate)
+
+
+bucket = TokenBucket()
+
+
+def build_request(service, action, user, appointment=None, event_id=''):
+    """Запрос к API для операции insert, update или delete (без отправки)"""
+    events = get_events_resource(service)
+    if action == 'insert':
+        return events.insert(calendarId='primary', body=build_event(user, appointment))
+    if action == 'update':
+        return events.patch(calendarId='primary', eventId=event_id, body=build_event(user, appointment))
+    if action == 'delete':
+        return events.delete(calendarId='primary', eventId=event_id)
+    raise ValueError(action)
+
+
+def execute_batch(calls, limiter=None):
+    """
+    Отправляет запросы пакетами по BATCH_LIMIT.
+    calls - список пар (сервис, запрос); возвращает список пар (ответ, исключение) в том же порядке.
+    """
+    limiter = limiter or bucket
+    results = [None] * len(calls)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    for start in range(0, len(calls), BATCH_LIMIT):
+        chunk = range(start, min(start + BATCH_LIMIT, len(calls)))
+        # Адрес пакета берется из сервиса; учетные данные у каждого запроса свои
+        batch = calls[start][0].new_batch_http_request(callback=callback)
+        for index in chunk:
+            batch.add(calls[index][1], request_id=str(index))
+        limiter.take(len(chunk))
+        try:
+            batch.execute()
+        except Exception as exc:
+            # Пакет не дошел до API: ошибка относится ко всем операциям, на которые нет ответа
+            for index in chunk:
+                if results[index] is None:
+                    results[index] = (None, exc)
+    return results
+
+
+def is_gone(exception):
+    """Событие уже удалено из календаря"""
+    return isinstance(exception, HttpError) and exception.resp.status in GONE_STATUSES
@@ -0,0 +1,125 @@
+"""
+Подписка на календарь (webcal) по токену.
+
+Клиенты календарей (Apple, Outlook, Google) опрашивают подписку каждые
+несколько минут, поэтому ответ на опрос без изменений должен быть почти
+бесплатным. Состояние подписки описывается одним агрегирующим запросом
+(число записей и последние изменения записей, услуг и филиалов) и, для
+подписок филиалов, версией пользователей из кэша: у модели пользователя нет
+времени изменения, а имена клиентов видны в событиях. По ним строится ETag, и при совпадении с If-None-Match отдается 304. Готовый файл
+хранится в кэше под тем же ETag.
+
+Если что-то изменилось, файл собирается заново из событий, закэшированных
+по отдельности: заново строятся только события измененных записей.
+"""
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment, get_salon_timezone
+from core.cache import get_versions
+from locations.models import Location
+from .ical_service import build_ical_event
+from .ical_stream import CALENDAR_FOOTER, calendar_header
+from .models import CalendarFeed
+
+FEED_TIMEOUT = 24 * 60 * 60
+EVENT_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def get_user_feeds(user):
+    """Личная подписка пользователя и (для персонала) подписки активных филиалов; недостающие создаются"""
+    feeds = {feed.location_id: feed for feed in user.calendar_feeds.select_related('location')}
+    location_ids = [None]
+    if user.is_staff:
+        location_ids += Location.objects.filter(is_active=True).values_list('pk', flat=True)
+    missing = [CalendarFeed(user=user, location_id=pk) for pk in location_ids if pk not in feeds]
+    if missing:
+        CalendarFeed.objects.bulk_create(missing, ignore_conflicts=True)
+        feeds = {feed.location_id: feed for feed in user.calendar_feeds.select_related('location')}
+    return feeds[None], [feeds[pk] for pk in location_ids[1:] if pk in feeds]
+
+
+def get_webcal_url(request, feed):
+    url = request.build_absolute_uri(reverse('calendar_feed', kwargs={'token': feed.token}))
+    return 'webcal://' + url.split('://', 1)[1]
+
+
+def is_feed_available(feed):
+    """Подписка филиала работает, только пока ее владелец остается сотрудником"""
+    return feed.user.is_active and (feed.location_id is None or feed.user.is_staff)
+
+
+def get_feed_queryset(feed, today):
+    queryset = Appointment.objects.filter(date__gte=today).exclude(status='canceled')
+    if feed.location_id is not None:
+        return queryset.filter(location_id=feed.location_id)
+    return queryset.filter(client_id=feed.user_id)
+
+
+def get_feed_state(feed, site_url):
+    """Возвращает (queryset записей подписки, ETag) одним запросом к базе"""
+    today = timezone.now().astimezone(get_salon_timezone()).date()
+    queryset = get_feed_queryset(feed, today)
+    aggregates = {
+        'count': Count('pk'),
+        'updated': Max('updated'),
+        'service': Max('service__updated'),
+        'location': Max('location__updated'),
+    }
+    if feed.location_id is not None:
+        aggregates['client'] = Max('client__client__updated')
+    data = queryset.order_by().aggregate(**aggregates)
+    parts = [feed.token, site_url, today.isoformat(), *(str(data[name]) for name in aggregates)]
+    if feed.location_id is not None:
+        # Версия меняется при изменении имени пользователя (см. signals)
+        parts += map(str, get_versions(get_user_model()))
+    return queryset, '"%s"' % hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+
+def get_feed_body(feed, queryset, etag, site_url):
+    """Файл подписки из кэша или собранный из закэшированных событий"""
+    key = 'ical:feed:%s:%s' % (feed.pk, etag.strip('"'))
+    body = cache.get(key)
+    if body is None:
+        body = build_feed(feed, queryset, site_url)
+        cache.set(key, body, FEED_TIMEOUT)
+    return body
+
+
+def build_feed(feed, queryset, site_url):
+    for_staff = feed.location_id is not None
+    related = ['service', 'location', 'client__client'] if for_staff else ['service', 'location']
+    appointments = list(queryset.select_related(*related).order_by('date', 'time', 'pk'))
+
+    keys = [_event_key(appointment, site_url, for_staff) for appointment in appointments]
+    cached = cache.get_many(keys)
+    missing = {}
+    events = []
+    for key, appointment in zip(keys, appointments):
+        event = cached.get(key)
+        if event is None:
+            # DTSTAMP - время изменения записи, чтобы событие не менялось при каждой сборке
+            event = missing[key] = build_ical_event(
+                appointment, site_url, dtstamp=appointment.updated, for_staff=for_staff
+            ).to_ical()
+        events.append(event)
+    if missing:
+        cache.set_many(missing, EVENT_TIMEOUT)
+
+    name = f"ЮАнна: {feed.location.name}" if for_staff else "ЮАнна: мои записи"
+    return b''.join([calendar_header(name), *events, CALENDAR_FOOTER])
+
+
+def _event_key(appointment, site_url, for_staff):
+    parts = [
+        site_url, str(appointment.pk), appointment.updated.isoformat(),
+        appointment.service.updated.isoformat(), appointment.location.updated.isoformat(),
+    ]
+    if for_staff:
+        parts += [appointment.client_full_name(), appointment.client_phone()]
+    return 'ical:event:%s' % hashlib.md5(':'.join(parts).encode()).hexdigest()
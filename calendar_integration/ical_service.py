@@ -5,60 +5,98 @@ from django.conf import settings
 from django.urls import reverse
 from django.utils.encoding import force_bytes
 
-def generate_ical_for_appointment(appointment, site_url):
+PRODID = '-//LPG Massage Salon//yuanna.ru//'
+ORGANIZER_EMAIL = 'MAILTO:info@yuanna.ru'
+ORGANIZER_NAME = 'ЮАнна студия массажа'
+
+def event_uid(appointment_id):
+    return f"appointment-{appointment_id}@yuanna.ru"
+
+def format_summary(service_name, client_name=None):
+    summary = f"LPG Массаж: {service_name}"
+    if client_name is not None:
+        summary = f"{summary} - {client_name}"
+    return summary
+
+def format_description(service_name, location_name, address, phone, notes, status, client_name=None, client_phone=None):
     """
-    Генерация iCalendar файла для записи
+    Описание события; client_name и client_phone указываются в календаре филиала
     """
-    # Создание календаря
-    cal = Calendar()
-    cal.add('prodid', '-//LPG Massage Salon//yuanna.ru//')
-    cal.add('version', '2.0')
+    description = f"""
+    Услуга: {service_name}
+    Салон: {location_name}
+    Адрес: {address}
+    Телефон: {phone}
+    
+    Дополнительная информация:
+    {notes}
     
+    Статус: {status}
+    """
+    if client_name is not None:
+        description = f"""
+    Клиент: {client_name}
+    Телефон клиента: {client_phone}
+    {description}"""
+    return description
+
+def build_ical_event(appointment, site_url, dtstamp=None, for_staff=False):
+    """
+    Событие iCalendar для записи.
+    for_staff - событие для календаря филиала: в нем указаны клиент и его телефон.
+    """
     # Создание события
     event = Event()
     
     # Базовая информация о событии
-    start_time = datetime.datetime.combine(appointment.date, appointment.time)
-    tz = pytz.timezone('Europe/Moscow')  # Используйте соответствующий часовой пояс
-    start_time = tz.localize(start_time)
-    
-    # Длительность процедуры
-    end_time = start_time + appointment.service.duration
+    tz = pytz.timezone(settings.SALON_TIME_ZONE)
+    if appointment.starts_at and appointment.ends_at:
+        start_time = appointment.starts_at.astimezone(tz)
+        end_time = appointment.ends_at.astimezone(tz)
+    else:
+        # Записи, для которых еще не заполнены starts_at/ends_at
+        start_time = tz.localize(datetime.datetime.combine(appointment.date, appointment.time))
+        end_time = start_time + appointment.service.duration
     
     # Добавляем информацию о событии
-    event.add('summary', f"LPG Массаж: {appointment.service.name}")
+    client_name = appointment.client_full_name() if for_staff else None
+    event.add('summary', format_summary(appointment.service.name, client_name))
     event.add('dtstart', start_time)
     event.add('dtend', end_time)
-    event.add('dtstamp', datetime.datetime.now(tz=tz))
+    event.add('dtstamp', dtstamp or datetime.datetime.now(tz=tz))
     event.add('location', appointment.location.address)
     
     # Описание события
-    description = f"""
-    Услуга: {appointment.service.name}
-    Салон: {appointment.location.name}
-    Адрес: {appointment.location.address}
-    Телефон: {appointment.location.phone}
-    
-    Дополнительная информация:
-    {appointment.notes}
-    
-    Статус: {appointment.get_status_display()}
-    """
-    event.add('description', description)
+    event.add('description', format_description(
+        appointment.service.name, appointment.location.name, appointment.location.address,
+        appointment.location.phone, appointment.notes, appointment.get_status_display(),
+        client_name, appointment.client_phone() if for_staff else None,
+    ))
     
     # Уникальный идентификатор события
-    event['uid'] = f"appointment-{appointment.id}@yuanna.ru"
+    event['uid'] = event_uid(appointment.id)
     
     # Добавляем организатора
-    organizer = vCalAddress('MAILTO:info@yuanna.ru')
-    organizer.params['cn'] = vText('ЮАнна студия массажа')
+    organizer = vCalAddress(ORGANIZER_EMAIL)
+    organizer.params['cn'] = vText(ORGANIZER_NAME)
     event['organizer'] = organizer
     
     # URL для просмотра детальной информации о записи
-    event.add('url', f"{site_url}{reverse('appointment_detail', kwargs={'pk': appointment.id})}")
+    url_name = 'admin_appointment_detail' if for_staff else 'appointment_detail'
+    event.add('url', f"{site_url}{reverse(url_name, kwargs={'pk': appointment.id})}")
+    return event
+
+def generate_ical_for_appointment(appointment, site_url):
+    """
+    Генерация iCalendar файла для записи
+    """
+    # Создание календаря
+    cal = Calendar()
+    cal.add('prodid', PRODID)
+    cal.add('version', '2.0')
     
     # Добавляем событие в календарь
-    cal.add_component(event)
+    cal.add_component(build_ical_event(appointment, site_url))
     
     # Возвращаем содержимое календаря в формате iCalendar
     return cal.to_ical()
\ No newline at end of file
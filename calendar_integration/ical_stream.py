@@ -0,0 +1,156 @@
+"""
+Потоковая запись iCalendar (RFC 5545) для больших выгрузок.
+
+build_ical_event строит для каждого события граф объектов icalendar, что
+приемлемо для одной записи, но слишком медленно и требует слишком много памяти
+для выгрузки десятков тысяч событий. Здесь строки событий формируются
+напрямую из словарей queryset.values() и отдаются кусками, так что
+расход памяти не зависит от числа событий. Экранирование текста и перенос
+строк длиннее 75 октетов выполняются по RFC 5545; результат совпадает
+с выводом icalendar байт в байт.
+"""
+import datetime
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from icalendar import Calendar, Timezone
+
+from appointments.models import Appointment, get_salon_timezone
+from .ical_service import (
+    ORGANIZER_EMAIL, ORGANIZER_NAME, PRODID, event_uid, format_description, format_summary,
+)
+
+# Поля записи, нужные для события
+EVENT_FIELDS = (
+    'id', 'date', 'time', 'starts_at', 'ends_at', 'status', 'notes', 'updated',
+    'service__name', 'service__duration', 'location__name', 'location__address', 'location__phone',
+)
+STAFF_EVENT_FIELDS = EVENT_FIELDS + (
+    'client__username', 'client__first_name', 'client__last_name', 'client__client__phone',
+)
+# Размер куска ответа
+CHUNK_SIZE = 64 * 1024
+LINE_LIMIT = 75
+CALENDAR_FOOTER = b'END:VCALENDAR\r\n'
+
+
+def escape_text(value):
+    """Экранирование значения типа TEXT (RFC 5545, 3.3.11)"""
+    return (
+        value.replace('\\N', '\n')
+        .replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+    )
+
+
+def fold_line(line):
+    """
+    Строка содержимого с переносом по RFC 5545 (3.1): части не длиннее 74 октетов
+    (с пробелом в начале продолжения - 75), многобайтовые символы UTF-8 не разрываются.
+    """
+    data = line.encode()
+    limit = LINE_LIMIT - 1
+    if len(data) <= limit:
+        return data + b'\r\n'
+    parts = []
+    start = 0
+    while len(data) - start > limit:
+        end = start + limit
+        # Байты вида 10xxxxxx - продолжение символа UTF-8
+        while data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end])
+        start = end
+    parts.append(data[start:])
+    return b'\r\n '.join(parts) + b'\r\n'
+
+
+def format_datetime(moment):
+    return f'{moment.year:04}{moment.month:02}{moment.day:02}T{moment.hour:02}{moment.minute:02}{moment.second:02}'
+
+
+def calendar_header(name):
+    """Начало календаря (до первого события) с описанием часового пояса салона"""
+    cal = Calendar()
+    cal.add('prodid', PRODID)
+    cal.add('version', '2.0')
+    cal.add('x-wr-calname', name)
+    # Рекомендуемый клиентам интервал опроса подписки
+    cal.add('x-published-ttl', 'PT15M')
+    # Описание часового пояса, на который ссылаются TZID событий
+    today = timezone.now().date()
+    cal.add_component(Timezone.from_tzinfo(
+        get_salon_timezone(), first_date=today - datetime.timedelta(days=366),
+        last_date=today + datetime.timedelta(days=3 * 366),
+    ))
+    return cal.to_ical()[:-len(CALENDAR_FOOTER)]
+
+
+class EventWriter:
+    """Пишет событие записи по словарю из values(EVENT_FIELDS или STAFF_EVENT_FIELDS)"""
+
+    def __init__(self, site_url, for_staff=False):
+        self.for_staff = for_staff
+        self.tz = get_salon_timezone()
+        self.tzid = settings.SALON_TIME_ZONE
+        self.statuses = dict(Appointment.STATUS_CHOICES)
+        # reverse() вызывается один раз: адрес записи собирается подстановкой id
+        url_name = 'admin_appointment_detail' if for_staff else 'appointment_detail'
+        self.url_prefix, self.url_suffix = reverse(url_name, kwargs={'pk': 0}).rsplit('0', 1)
+        self.url_prefix = site_url + self.url_prefix
+        self.organizer = fold_line(f'ORGANIZER;CN="{ORGANIZER_NAME}":{ORGANIZER_EMAIL}')
+
+    def write(self, row):
+        if row['starts_at'] and row['ends_at']:
+            start = row['starts_at'].astimezone(self.tz)
+            end = row['ends_at'].astimezone(self.tz)
+        else:
+            start = datetime.datetime.combine(row['date'], row['time'], tzinfo=self.tz)
+            end = start + row['service__duration']
+
+        client_name = client_phone = None
+        if self.for_staff:
+            full_name = f"{row['client__first_name']} {row['client__last_name']}".strip()
+            client_name = full_name or row['client__username']
+            client_phone = row['client__client__phone'] or "Не указан"
+
+        description = format_description(
+            row['service__name'], row['location__name'], row['location__address'],
+            row['location__phone'], row['notes'], self.statuses.get(row['status'], row['status']),
+            client_name, client_phone,
+        )
+        stamp = row['updated'].astimezone(datetime.timezone.utc)
+        return b''.join((
+            b'BEGIN:VEVENT\r\n',
+            fold_line('SUMMARY:' + escape_text(format_summary(row['service__name'], client_name))),
+            fold_line(f'DTSTART;TZID={self.tzid}:{format_datetime(start)}'),
+            fold_line(f'DTEND;TZID={self.tzid}:{format_datetime(end)}'),
+            fold_line(f'DTSTAMP:{format_datetime(stamp)}Z'),
+            fold_line('UID:' + escape_text(event_uid(row['id']))),
+            fold_line('DESCRIPTION:' + escape_text(description)),
+            fold_line('LOCATION:' + escape_text(row['location__address'])),
+            self.organizer,
+            fold_line(f"URL:{self.url_prefix}{row['id']}{self.url_suffix}"),
+            b'END:VEVENT\r\n',
+        ))
+
+
+def iter_calendar(rows, site_url, name, for_staff=False, chunk_size=CHUNK_SIZE):
+    """Календарь по строкам values() кусками примерно по chunk_size байт"""
+    writer = EventWriter(site_url, for_staff)
+    chunk = [calendar_header(name)]
+    size = 0
+    for row in rows:
+        event = writer.write(row)
+        chunk.append(event)
+        size += len(event)
+        if size >= chunk_size:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    chunk.append(CALENDAR_FOOTER)
+    yield b''.join(chunk)
@@ -0,0 +1,188 @@
+import datetime
+import json
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httplib2
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+from appointments.models import Appointment
+from calendar_integration.batch import TokenBucket, build_request
+from calendar_integration.models import CalendarSettings
+from calendar_integration.outbox import GoogleCalendarGateway, Operation
+from calendar_integration.services import API_SERVICE_NAME, API_VERSION
+from locations.models import Location
+from services.models import Service
+
+BATCH_PATH = f'/batch/{API_SERVICE_NAME}/{API_VERSION}'
+
+
+class StubCalendarHandler(BaseHTTPRequestHandler):
+    """Локальная заглушка Calendar API: события insert/patch/delete и пакетные запросы"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.handle_api()
+
+    def do_PATCH(self):
+        self.handle_api()
+
+    def do_DELETE(self):
+        self.handle_api()
+
+    def handle_api(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.count()
+        time.sleep(self.server.latency)
+        if self.path == BATCH_PATH:
+            status, content_type, content = self.batch_response(body)
+        else:
+            status, content = self.server.event_response(self.command, self.path)
+            content_type = 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def batch_response(self, body):
+        message = BytesParser().parsebytes(
+            f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode() + body
+        )
+        boundary = 'stub_batch'
+        parts = []
+        for part in message.get_payload():
+            request_line = part.get_payload().split('\n', 1)[0].split()
+            status, content = self.server.event_response(request_line[0], request_line[1])
+            parts.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{part["Content-ID"][1:-1]}>\r\n\r\n'
+                f'HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n'
+                f'{content.decode()}\r\n'
+            )
+        content = (''.join(parts) + f'--{boundary}--\r\n').encode()
+        return 200, f'multipart/mixed; boundary={boundary}', content
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubCalendarServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), StubCalendarHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.round_trips = self.last_id = 0
+
+    def count(self):
+        with self.lock:
+            self.round_trips += 1
+
+    def reset(self):
+        self.round_trips = 0
+
+    def event_response(self, method, path):
+        if method == 'DELETE':
+            return 204, b''
+        if method == 'POST':
+            with self.lock:
+                self.last_id += 1
+                event_id = f'stub{self.last_id}'
+        else:
+            event_id = path.split('?')[0].rsplit('/', 1)[-1]
+        return 200, json.dumps({'id': event_id}).encode()
+
+
+class StubGateway(GoogleCalendarGateway):
+    def __init__(self, service, limiter):
+        super().__init__(limiter)
+        self.service = service
+
+    def get_service(self, user):
+        return self.service
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает число HTTP-запросов к Google Calendar API при синхронизации записей "
+        "по одной и пакетами (на локальной заглушке API, без обращения к базе)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help="Количество записей")
+        parser.add_argument('--latency', type=float, default=20, help="Задержка ответа заглушки (мс)")
+        parser.add_argument('--rate', type=float, default=1000, help="Ограничение частоты операций в секунду")
+
+    def handle(self, *args, **options):
+        server = StubCalendarServer(options['latency'] / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            service = self.build_service(f'http://127.0.0.1:{server.server_address[1]}/')
+            limiter = TokenBucket(rate=options['rate'])
+            gateway = StubGateway(service, limiter)
+            appointments = self.make_appointments(options['count'])
+
+            for action in ('insert', 'update', 'delete'):
+                operations = [
+                    Operation(action, appointment.client, appointment, f'stub{appointment.pk}')
+                    for appointment in appointments
+                ]
+                self.report(server, action, 'по одной', lambda: self.run_single(service, operations, limiter))
+                self.report(server, action, 'пакетами', lambda: gateway.execute(operations))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def report(self, server, action, mode, run):
+        server.reset()
+        started = time.monotonic()
+        results = run()
+        elapsed = time.monotonic() - started
+        errors = sum(1 for _, error in results if error is not None)
+        self.stdout.write(
+            f"{action:<7} {mode:<9} операций: {len(results)}, HTTP-запросов: {server.round_trips}, "
+            f"ошибок: {errors}, время: {elapsed:.2f} с"
+        )
+
+    @staticmethod
+    def run_single(service, operations, limiter):
+        results = []
+        for operation in operations:
+            limiter.take()
+            request = build_request(
+                service, operation.action, operation.user, operation.appointment, operation.event_id
+            )
+            try:
+                results.append(((request.execute() or {}).get('id'), None))
+            except Exception as exc:
+                results.append((None, exc))
+        return results
+
+    @staticmethod
+    def build_service(root_url):
+        document = json.loads(get_static_doc(API_SERVICE_NAME, API_VERSION))
+        document['rootUrl'] = root_url
+        return build_from_document(document, http=httplib2.Http())
+
+    @staticmethod
+    def make_appointments(count):
+        """Несохраненные записи разных клиентов: для построения событий база не нужна"""
+        service = Service(name="LPG массаж тела", duration=datetime.timedelta(minutes=45))
+        location = Location(name="Салон", address="ул. Ленина, 1", phone="+7 900 000-00-00")
+        day = datetime.date.today()
+        appointments = []
+        for index in range(1, count + 1):
+            client = get_user_model()(pk=index, username=f'client{index}')
+            client.calendar_settings = CalendarSettings(calendar_type='google', reminder_time=60)
+            appointments.append(Appointment(
+                pk=index, client=client, service=service, location=location,
+                date=day + datetime.timedelta(days=index // 10), time=datetime.time(10 + index % 10),
+            ))
+        return appointments
@@ -0,0 +1,116 @@
+import datetime
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from icalendar import Calendar
+
+from appointments.models import Appointment, get_appointment_period
+from calendar_integration.ical_service import build_ical_event
+from calendar_integration.ical_stream import iter_calendar
+from core.models import Client
+from locations.models import Location
+from services.models import Service
+
+SITE_URL = 'https://example.com'
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время и пиковую память выгрузки iCalendar через объекты icalendar "
+        "и потоковой записью (на сгенерированных записях, без обращения к базе)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000, help="Количество событий")
+        parser.add_argument('--graph-count', type=int, default=5000,
+                            help="Количество событий для замера icalendar; время пересчитывается на --count")
+        parser.add_argument('--staff', action='store_true', help="События для календаря филиала (с клиентом)")
+        parser.add_argument('--memory', action='store_true',
+                            help="Измерить пиковую память (tracemalloc заметно замедляет выгрузку)")
+
+    def handle(self, *args, **options):
+        count = options['count']
+        graph_count = min(options['graph_count'], count)
+        for_staff = options['staff']
+        self.trace_memory = options['memory']
+        appointments = self.make_appointments(count)
+
+        def build_graph():
+            cal = Calendar()
+            for appointment in appointments[:graph_count]:
+                cal.add_component(build_ical_event(appointment, SITE_URL, appointment.updated, for_staff))
+            return [cal.to_ical()]
+
+        elapsed, memory, size, chunks = self.measure(build_graph)
+        self.stdout.write(
+            f"icalendar          событий: {graph_count}, время: {elapsed:.2f} с "
+            f"(на {count}: ~{elapsed * count / graph_count:.0f} с), {memory}объем: {size / 2**20:.1f} МБ"
+        )
+
+        rows = (self.values_row(appointment) for appointment in appointments)
+        elapsed, memory, size, chunks = self.measure(
+            lambda: iter_calendar(rows, SITE_URL, "Выгрузка", for_staff=for_staff)
+        )
+        self.stdout.write(
+            f"потоковая запись   событий: {count}, время: {elapsed:.2f} с, {memory}"
+            f"объем: {size / 2**20:.1f} МБ, кусков: {chunks}"
+        )
+
+    def measure(self, run):
+        """
+        Время, пиковая память (текстом для отчета, только с --memory), объем
+        и число кусков вывода. Куски не накапливаются.
+        """
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.monotonic()
+        size = chunks = 0
+        for chunk in run():
+            size += len(chunk)
+            chunks += 1
+        elapsed = time.monotonic() - started
+        memory = ''
+        if self.trace_memory:
+            memory = f"пик памяти: {tracemalloc.get_traced_memory()[1] / 2**20:.1f} МБ, "
+            tracemalloc.stop()
+        return elapsed, memory, size, chunks
+
+    @staticmethod
+    def make_appointments(count):
+        """Несохраненные записи разных клиентов с заполненными связями"""
+        service = Service(name="LPG массаж тела", duration=datetime.timedelta(minutes=45))
+        location = Location(name="Салон", address="ул. Ленина, д. 1; вход со двора", phone="+7 900 000-00-00")
+        day = datetime.date.today()
+        updated = timezone.now()
+        appointments = []
+        for index in range(1, count + 1):
+            client = get_user_model()(pk=index, username=f'client{index}',
+                                      first_name="Анна", last_name=f"Иванова {index}")
+            client.client = Client(user=client, phone="+7 (900) 123-45-67")
+            date = day + datetime.timedelta(days=index // 10)
+            start = datetime.time(10 + index % 10)
+            starts_at, ends_at = get_appointment_period(date, start, service.duration)
+            appointments.append(Appointment(
+                pk=index, client=client, service=service, location=location, date=date, time=start,
+                starts_at=starts_at, ends_at=ends_at, updated=updated,
+                notes="Примечание к записи, с запятой; и точкой с запятой" if index % 3 else "",
+            ))
+        return appointments
+
+    @staticmethod
+    def values_row(appointment):
+        """Строка в виде queryset.values(STAFF_EVENT_FIELDS)"""
+        client = appointment.client
+        return {
+            'id': appointment.pk, 'date': appointment.date, 'time': appointment.time,
+            'starts_at': appointment.starts_at, 'ends_at': appointment.ends_at,
+            'status': appointment.status, 'notes': appointment.notes, 'updated': appointment.updated,
+            'service__name': appointment.service.name, 'service__duration': appointment.service.duration,
+            'location__name': appointment.location.name, 'location__address': appointment.location.address,
+            'location__phone': appointment.location.phone,
+            'client__username': client.username, 'client__first_name': client.first_name,
+            'client__last_name': client.last_name, 'client__client__phone': client.client.phone,
+        }
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from calendar_integration.outbox import BATCH_SIZE, process_outbox
+
+
+class Command(BaseCommand):
+    help = "Синхронизирует изменения записей с Google Calendar из очереди (работает постоянно или один проход)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Обработать очередь один раз и выйти")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Строк очереди за один проход")
+        parser.add_argument('--interval', type=float, default=5, help="Пауза между проходами, когда очередь пуста (секунды)")
+
+    def handle(self, *args, **options):
+        while True:
+            synced, failed = process_outbox(limit=options['batch_size'])
+            if synced or failed:
+                self.stdout.write(f"Синхронизировано записей: {synced}, ошибок: {failed}.")
+            if options['once']:
+                break
+            if not synced and not failed:
+                time.sleep(options['interval'])
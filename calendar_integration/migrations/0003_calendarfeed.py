@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:31
+
+import calendar_integration.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar_integration', '0002_calendaroutbox'),
+        ('locations', '0003_rating_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(default=calendar_integration.models.generate_feed_token, max_length=64, unique=True, verbose_name='Токен')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('location', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feeds', to='locations.location', verbose_name='Филиал')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calendar_feeds', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Подписка на календарь',
+                'verbose_name_plural': 'Подписки на календарь',
+                'constraints': [models.UniqueConstraint(fields=('user', 'location'), name='unique_calendar_feed'), models.UniqueConstraint(condition=models.Q(('location__isnull', True)), fields=('user',), name='unique_personal_calendar_feed')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calendar_integration', '0003_calendarfeed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendaroutbox',
+            name='leased_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Обрабатывается до'),
+        ),
+    ]
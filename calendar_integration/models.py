@@ -1,4 +1,7 @@
+import secrets
+
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -41,3 +44,60 @@ class CalendarSettings(models.Model):
         return f"Настройки календаря - {self.user.username}"
 
 
+
+class CalendarOutbox(models.Model):
+    """
+    Изменение записи, ожидающее синхронизации с Google Calendar (см. outbox).
+    Создается в той же транзакции, что и изменение записи; несколько строк
+    по одной записи обрабатываются одним обращением к API.
+    """
+    # Без ограничения внешнего ключа: строка нужна и после удаления записи
+    appointment = models.ForeignKey('appointments.Appointment', on_delete=models.DO_NOTHING, db_constraint=False,
+                                    related_name='+', verbose_name="Запись")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', verbose_name="Пользователь")
+    # Событие удаленной записи, которое нужно убрать из календаря
+    event_id = models.CharField(max_length=1024, blank=True, verbose_name="ID события")
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    next_attempt = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    # До этого времени строки записи обрабатывает один обработчик (см. outbox.claim_batch)
+    leased_until = models.DateTimeField(null=True, blank=True, verbose_name="Обрабатывается до")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    
+    class Meta:
+        verbose_name = "Изменение для синхронизации"
+        verbose_name_plural = "Очередь синхронизации с Google Calendar"
+        indexes = [
+            models.Index(fields=['next_attempt'], name='calendar_outbox_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Запись #{self.appointment_id} - {self.user}"
+
+
+def generate_feed_token():
+    return secrets.token_urlsafe(32)
+
+
+class CalendarFeed(models.Model):
+    """
+    Ссылка на подписку iCalendar (webcal): предстоящие записи пользователя,
+    а для персонала - все предстоящие записи филиала. Доступ только по токену.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calendar_feeds', verbose_name="Пользователь")
+    location = models.ForeignKey('locations.Location', on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='calendar_feeds', verbose_name="Филиал")
+    token = models.CharField(max_length=64, unique=True, default=generate_feed_token, verbose_name="Токен")
+    created = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Подписка на календарь"
+        verbose_name_plural = "Подписки на календарь"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'location'], name='unique_calendar_feed'),
+            models.UniqueConstraint(fields=['user'], condition=models.Q(location__isnull=True),
+                                    name='unique_personal_calendar_feed'),
+        ]
+    
+    def __str__(self):
+        return f"Подписка {self.user.username} - {self.location or 'личные записи'}"
@@ -0,0 +1,242 @@
+"""
+Синхронизация записей с Google Calendar через очередь (transactional outbox).
+
+Изменения записей не отправляются в Google во время запроса: в той же
+транзакции, что и изменение, в CalendarOutbox добавляется строка, если клиент
+включил синхронизацию с Google Calendar. Обработчик очереди (команда
+process_calendar_outbox) объединяет все ожидающие строки по одной записи,
+сравнивает текущее состояние записи с ее событием в календаре и планирует
+не больше одной операции: создание, изменение или удаление события.
+Операции всей порции отправляются пакетными запросами (см. batch), поэтому
+массовые изменения (включение синхронизации, перенос записей за целый день)
+не превращаются в сотни отдельных запросов. Строки одной записи
+обрабатывает только один обработчик за раз, иначе два процесса могли бы
+одновременно создать для записи два события. При ошибке строки записи
+откладываются с экспоненциально растущей паузой, остальные записи пакета
+считаются синхронизированными.
+"""
+import datetime
+import logging
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from appointments.models import Appointment, get_salon_timezone
+from . import batch, services
+from .models import CalendarOutbox, CalendarSettings
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+RETRY_DELAY = datetime.timedelta(seconds=30)
+MAX_RETRY_DELAY = datetime.timedelta(hours=1)
+# На это время строки записи закрепляются за обработчиком, чтобы их не взял другой процесс
+LEASE_TIME = datetime.timedelta(minutes=5)
+# Поля записи, которые видны в событии календаря
+SYNCED_FIELDS = {'service', 'service_id', 'location', 'location_id', 'date', 'time', 'status', 'notes'}
+
+
+class CalendarSyncError(Exception):
+    """Google Calendar API не выполнил операцию"""
+
+
+# Операция с событием календаря: action - insert, update или delete
+Operation = namedtuple('Operation', 'action user appointment event_id')
+
+
+class GoogleCalendarGateway:
+    """Обращения к Google Calendar API; в тестах заменяется локальной заглушкой с тем же методом execute"""
+
+    def __init__(self, limiter=None):
+        self.limiter = limiter
+
+    def get_service(self, user):
+        return services.get_google_calendar_service(user)
+
+    def execute(self, operations):
+        """
+        Выполняет операции пакетными запросами.
+        Возвращает список пар (id события или None, исключение или None) в порядке операций.
+        """
+        results = [None] * len(operations)
+        user_services = {}
+        calls, indexes = [], []
+        for index, operation in enumerate(operations):
+            user = operation.user
+            if user.pk not in user_services:
+                try:
+                    user_services[user.pk] = self.get_service(user) or CalendarSyncError(
+                        "Нет учетных данных Google Calendar."
+                    )
+                except Exception as exc:
+                    user_services[user.pk] = exc
+            service = user_services[user.pk]
+            if isinstance(service, Exception):
+                results[index] = (None, service)
+                continue
+            calls.append((service, batch.build_request(
+                service, operation.action, user, operation.appointment, operation.event_id
+            )))
+            indexes.append(index)
+
+        for index, (response, exception) in zip(indexes, batch.execute_batch(calls, self.limiter)):
+            if operations[index].action == 'delete' and batch.is_gone(exception):
+                exception = None
+            results[index] = ((response or {}).get('id'), exception)
+        return results
+
+
+def enqueue_appointments(pks):
+    """Ставит записи в очередь синхронизации (только клиентов, включивших Google Calendar)"""
+    rows = Appointment.objects.filter(
+        pk__in=pks,
+        client__calendar_settings__calendar_type='google',
+    ).values_list('pk', 'client_id')
+    CalendarOutbox.objects.bulk_create([
+        CalendarOutbox(appointment_id=pk, user_id=client_id) for pk, client_id in rows
+    ])
+
+
+def enqueue_deleted(appointment):
+    """Ставит в очередь удаление события удаленной записи"""
+    if appointment.google_event_id and CalendarSettings.objects.filter(
+        user_id=appointment.client_id, calendar_type='google'
+    ).exists():
+        CalendarOutbox.objects.create(
+            appointment_id=appointment.pk, user_id=appointment.client_id, event_id=appointment.google_event_id
+        )
+
+
+def enqueue_upcoming(user):
+    """Ставит в очередь предстоящие записи пользователя, например после включения синхронизации"""
+    enqueue_appointments(list(
+        Appointment.objects.filter(client=user, date__gte=timezone.localdate(timezone=get_salon_timezone()))
+        .exclude(status='canceled').values_list('pk', flat=True)
+    ))
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """
+    Выбирает готовые к обработке строки и закрепляет за текущим обработчиком
+    все строки их записей. Записи, строки которых уже обрабатывает другой
+    обработчик, пропускаются до окончания его аренды.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # of=('self',): без него PostgreSQL не может заблокировать строки с LEFT JOIN
+        # к настройкам календаря пользователя
+        leased = CalendarOutbox.objects.filter(appointment_id=OuterRef('appointment_id'), leased_until__gt=now)
+        due = list(
+            CalendarOutbox.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(next_attempt__lte=now, attempts__lt=MAX_ATTEMPTS)
+            .filter(~Exists(leased))
+            .order_by('next_attempt', 'pk')
+            .values_list('appointment_id', flat=True)[:limit]
+        )
+        appointment_ids = set(due)
+        if not appointment_ids:
+            return []
+        
+        rows = list(
+            CalendarOutbox.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('user__calendar_settings')
+            .filter(appointment_id__in=appointment_ids)
+            .order_by('pk')
+        )
+        # Часть строк записи заблокирована другим обработчиком, который сейчас ее закрепляет
+        totals = dict(
+            CalendarOutbox.objects.filter(appointment_id__in=appointment_ids)
+            .values_list('appointment_id').annotate(count=Count('pk')).order_by()
+        )
+        locked = {}
+        for row in rows:
+            locked[row.appointment_id] = locked.get(row.appointment_id, 0) + 1
+        rows = [row for row in rows if locked[row.appointment_id] == totals.get(row.appointment_id)]
+        
+        CalendarOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(leased_until=now + LEASE_TIME)
+    return rows
+
+
+def plan_operation(appointment, rows):
+    """Операция, которая приводит событие в календаре к текущему состоянию записи, или None"""
+    user = appointment.client if appointment is not None else rows[-1].user
+    settings = getattr(user, 'calendar_settings', None)
+    if settings is None or settings.calendar_type != 'google':
+        return None
+
+    if appointment is not None:
+        event_id = appointment.google_event_id
+    else:
+        event_id = next((row.event_id for row in reversed(rows) if row.event_id), '')
+
+    if appointment is None or appointment.status == 'canceled':
+        if event_id and settings.remove_canceled:
+            return Operation('delete', user, appointment, event_id)
+    elif not event_id:
+        if settings.add_appointments:
+            return Operation('insert', user, appointment, '')
+    elif settings.update_appointments:
+        return Operation('update', user, appointment, event_id)
+    return None
+
+
+def _retry(rows, error):
+    attempts = max(row.attempts for row in rows) + 1
+    delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    CalendarOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+        attempts=attempts, next_attempt=timezone.now() + delay, leased_until=None, last_error=str(error)[:1000]
+    )
+
+
+def process_outbox(gateway=None, limit=BATCH_SIZE):
+    """
+    Обрабатывает одну порцию очереди.
+    Возвращает количество синхронизированных записей и количество ошибок.
+    """
+    gateway = gateway or GoogleCalendarGateway()
+    groups = {}
+    for row in claim_batch(limit):
+        groups.setdefault(row.appointment_id, []).append(row)
+    if not groups:
+        return 0, 0
+
+    appointments = Appointment.objects.select_related(
+        'service', 'location', 'client__calendar_settings'
+    ).in_bulk(list(groups))
+
+    done, planned = [], []
+    for appointment_id, rows in groups.items():
+        operation = plan_operation(appointments.get(appointment_id), rows)
+        if operation is None:
+            done.append(rows)
+        else:
+            planned.append((appointment_id, rows, operation))
+
+    operations = [operation for _, _, operation in planned]
+    try:
+        results = gateway.execute(operations) if operations else []
+    except Exception as exc:
+        results = [(None, exc)] * len(operations)
+
+    changed = []
+    failed = 0
+    for (appointment_id, rows, operation), (event_id, error) in zip(planned, results):
+        if error is None and operation.action == 'insert' and not event_id:
+            error = CalendarSyncError("Не удалось создать событие.")
+        if error is not None:
+            logger.warning("Ошибка синхронизации записи #%s с Google Calendar: %s", appointment_id, error)
+            _retry(rows, error)
+            failed += 1
+            continue
+        if operation.appointment is not None and operation.action in ('insert', 'delete'):
+            operation.appointment.google_event_id = event_id if operation.action == 'insert' else ''
+            changed.append(operation.appointment)
+        done.append(rows)
+
+    # bulk_update вместо save(): сохранение события не должно снова ставить запись в очередь
+    Appointment.objects.bulk_update(changed, ['google_event_id'])
+    CalendarOutbox.objects.filter(pk__in=[row.pk for rows in done for row in rows]).delete()
+    return len(done), failed
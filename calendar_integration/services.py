@@ -1,75 +1,168 @@
 import os
 import datetime
+import json
 import pickle
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+from google.auth.exceptions import RefreshError
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from .models import GoogleCalendarCredentials
 
 # Настройки Google Calendar API
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 API_SERVICE_NAME = 'calendar'
 API_VERSION = 'v3'
+# Сколько сервисов (пользователей) хранится в кэше каждого потока
+SERVICE_CACHE_SIZE = 128
 
-def get_google_calendar_service(user):
+# Кэш сервисов свой у каждого потока: httplib2.Http внутри сервиса не потокобезопасен
+_local = threading.local()
+# Поколение учетных данных пользователя; меняется при их сохранении или удалении
+_generations = defaultdict(int)
+_refresh_locks = defaultdict(threading.Lock)
+_locks_guard = threading.Lock()
+_events_resources = weakref.WeakKeyDictionary()
+
+@lru_cache(maxsize=None)
+def get_discovery_document():
     """
-    Получение сервиса Google Calendar для пользователя
+    Документ обнаружения Calendar API из пакета google-api-python-client.
+    Разбирается один раз на процесс, к сети не обращается.
     """
-    # Проверка наличия учетных данных пользователя
-    try:
-        credentials_obj = GoogleCalendarCredentials.objects.get(user=user)
-        credentials_json = credentials_obj.token
-        
-        # Создание объекта учетных данных
-        credentials = Credentials(
-            token=credentials_json.get('token'),
-            refresh_token=credentials_json.get('refresh_token'),
-            token_uri=credentials_json.get('token_uri'),
+    return json.loads(get_static_doc(API_SERVICE_NAME, API_VERSION))
+
+class StoredCredentials(Credentials):
+    """
+    Учетные данные из GoogleCalendarCredentials.
+    Обновление токена выполняет только один обработчик: остальные ждут блокировку
+    строки и берут уже обновленный токен из базы, а не обновляют его повторно.
+    Если в базе другой refresh_token (пользователь авторизовался заново),
+    объект целиком переходит на сохраненные учетные данные.
+    """
+
+    def __init__(self, *args, user_id=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_id = user_id
+
+    @classmethod
+    def from_record(cls, record):
+        data = record.token
+        expiry = parse_datetime(data['expiry']) if data.get('expiry') else None
+        return cls(
+            token=data.get('token'),
+            refresh_token=data.get('refresh_token'),
+            token_uri=data.get('token_uri'),
             client_id=settings.GOOGLE_OAUTH_CLIENT_ID,
             client_secret=settings.GOOGLE_OAUTH_CLIENT_SECRET,
-            scopes=SCOPES
+            scopes=SCOPES,
+            # google-auth хранит срок действия как наивное время в UTC
+            expiry=expiry.replace(tzinfo=None) if expiry else None,
+            user_id=record.user_id,
         )
-        
-        # Проверка действительности учетных данных
-        if credentials.expired and credentials.refresh_token:
-            credentials.refresh(Request())
-            
-            # Обновляем токен в базе данных
-            credentials_obj.token = {
-                'token': credentials.token,
-                'refresh_token': credentials.refresh_token,
-                'token_uri': credentials.token_uri,
-                'client_id': credentials.client_id,
-                'client_secret': credentials.client_secret,
-                'scopes': credentials.scopes
-            }
-            credentials_obj.save()
-        
-        # Создание сервиса
-        service = build(API_SERVICE_NAME, API_VERSION, credentials=credentials)
-        return service
+
+    def to_record(self):
+        return {
+            'token': self.token,
+            'refresh_token': self.refresh_token,
+            'token_uri': self.token_uri,
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'scopes': self.scopes,
+            'expiry': self.expiry.isoformat() if self.expiry else None,
+        }
+
+    def refresh(self, request):
+        if self.user_id is None:
+            return super().refresh(request)
+        with _locks_guard:
+            lock = _refresh_locks[self.user_id]
+        with lock, transaction.atomic():
+            record = GoogleCalendarCredentials.objects.select_for_update().filter(user_id=self.user_id).first()
+            if record is None:
+                raise RefreshError("Учетные данные Google Calendar удалены.")
+            stored = StoredCredentials.from_record(record)
+            if stored.refresh_token != self.refresh_token or stored.token != self.token:
+                # Токен уже обновил другой обработчик или пользователь авторизовался заново:
+                # сохраненные учетные данные новее тех, что хранит этот объект
+                self.token, self.expiry = stored.token, stored.expiry
+                self._refresh_token, self._token_uri = stored.refresh_token, stored.token_uri
+                if self.valid:
+                    return
+            super().refresh(request)
+            # update() вместо save(): собственное обновление токена не должно сбрасывать кэш сервисов
+            GoogleCalendarCredentials.objects.filter(pk=record.pk).update(
+                token=self.to_record(), updated=timezone.now()
+            )
+
+def _get_service_cache():
+    if not hasattr(_local, 'services'):
+        _local.services = OrderedDict()
+    return _local.services
+
+def forget_google_calendar_service(user_id):
+    """Сбрасывает закэшированные сервисы пользователя во всех потоках процесса"""
+    with _locks_guard:
+        _generations[user_id] += 1
+
+def get_google_calendar_service(user):
+    """
+    Получение сервиса Google Calendar для пользователя.
+    Сервис строится один раз и хранится в LRU-кэше потока; токен обновляется
+    при необходимости во время запроса к API (см. StoredCredentials).
+    """
+    services = _get_service_cache()
+    generation = _generations[user.pk]
+    cached = services.get(user.pk)
+    if cached is not None and cached[0] == generation:
+        services.move_to_end(user.pk)
+        return cached[1]
     
+    # Проверка наличия учетных данных пользователя
+    try:
+        credentials_obj = GoogleCalendarCredentials.objects.get(user=user)
     except GoogleCalendarCredentials.DoesNotExist:
         return None
+    
+    # Создание сервиса по разобранному документу обнаружения
+    service = build_from_document(
+        get_discovery_document(), credentials=StoredCredentials.from_record(credentials_obj)
+    )
+    services[user.pk] = (generation, service)
+    services.move_to_end(user.pk)
+    while len(services) > SERVICE_CACHE_SIZE:
+        services.popitem(last=False)
+    return service
 
-def add_appointment_to_google_calendar(user, appointment):
+def get_events_resource(service):
     """
-    Добавление записи в Google Calendar
+    Ресурс events() сервиса. Его построение занимает несколько миллисекунд,
+    поэтому для каждого сервиса он создается один раз.
+    """
+    events = _events_resources.get(service)
+    if events is None:
+        events = _events_resources[service] = service.events()
+    return events
+
+def build_event(user, appointment):
+    """
+    Событие Google Calendar для записи
     """
-    service = get_google_calendar_service(user)
-    if not service:
-        return None
-    
     # Создание начальной и конечной даты/времени события
     start_time = datetime.datetime.combine(appointment.date, appointment.time)
     # Предполагаем, что у нас есть длительность процедуры в объекте appointment.service.duration
     # duration может быть timedelta, поэтому можно просто прибавить его к start_time
     end_time = start_time + appointment.service.duration
     
-    # Создание события в формате Google Calendar
-    event = {
+    return {
         'summary': f"LPG Массаж: {appointment.service.name}",
         'location': appointment.location.address,
         'description': f"""
@@ -97,9 +190,17 @@ def add_appointment_to_google_calendar(user, appointment):
             ],
         },
     }
+
+def add_appointment_to_google_calendar(user, appointment):
+    """
+    Добавление записи в Google Calendar
+    """
+    service = get_google_calendar_service(user)
+    if not service:
+        return None
     
     # Добавление события в календарь
-    event = service.events().insert(calendarId='primary', body=event).execute()
+    event = get_events_resource(service).insert(calendarId='primary', body=build_event(user, appointment)).execute()
     
     # Возвращаем ID события для сохранения в базе данных
     return event.get('id')
@@ -112,37 +213,9 @@ def update_appointment_in_google_calendar(user, appointment, event_id):
     if not service:
         return False
     
-    # Аналогично add_appointment_to_google_calendar
-    start_time = datetime.datetime.combine(appointment.date, appointment.time)
-    end_time = start_time + appointment.service.duration
-    
-    # Получение текущего события
-    event = service.events().get(calendarId='primary', eventId=event_id).execute()
-    
-    # Обновление данных события
-    event['summary'] = f"LPG Массаж: {appointment.service.name}"
-    event['location'] = appointment.location.address
-    event['description'] = f"""
-    Услуга: {appointment.service.name}
-    Салон: {appointment.location.name}
-    Адрес: {appointment.location.address}
-    Телефон: {appointment.location.phone}
-    
-    Дополнительная информация:
-    {appointment.notes}
-    """
-    event['start'] = {
-        'dateTime': start_time.isoformat(),
-        'timeZone': 'Europe/Moscow',
-    }
-    event['end'] = {
-        'dateTime': end_time.isoformat(),
-        'timeZone': 'Europe/Moscow',
-    }
-    
-    # Обновление события в календаре
-    updated_event = service.events().update(
-        calendarId='primary', eventId=event_id, body=event
+    # patch меняет только переданные поля, поэтому событие не нужно предварительно загружать
+    updated_event = get_events_resource(service).patch(
+        calendarId='primary', eventId=event_id, body=build_event(user, appointment)
     ).execute()
     
     return updated_event.get('id') == event_id
@@ -156,7 +229,7 @@ def remove_appointment_from_google_calendar(user, event_id):
         return False
     
     try:
-        service.events().delete(calendarId='primary', eventId=event_id).execute()
+        get_events_resource(service).delete(calendarId='primary', eventId=event_id).execute()
         return True
     except Exception as e:
         print(f"Ошибка при удалении события из календаря: {e}")
@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from appointments.models import Appointment
+from appointments.signals import appointments_changed
+from core.cache import bump_version
+from .models import GoogleCalendarCredentials
+from .outbox import SYNCED_FIELDS, enqueue_appointments, enqueue_deleted
+from .services import forget_google_calendar_service
+
+# Поля пользователя, которые видны в событиях подписок филиалов
+FEED_USER_FIELDS = {'first_name', 'last_name', 'username'}
+
+
+@receiver(post_save, sender=Appointment)
+def enqueue_saved_appointment(sender, instance, update_fields=None, **kwargs):
+    """Ставит измененную запись в очередь синхронизации с Google Calendar"""
+    if update_fields is not None and not SYNCED_FIELDS.intersection(update_fields):
+        return
+    enqueue_appointments([instance.pk])
+
+
+@receiver(post_delete, sender=Appointment)
+def enqueue_deleted_appointment(sender, instance, **kwargs):
+    enqueue_deleted(instance)
+
+
+@receiver(appointments_changed)
+def enqueue_changed_appointments(sender, pks, **kwargs):
+    enqueue_appointments(pks)
+
+
+@receiver(post_save, sender=get_user_model())
+def bump_feed_user_version(sender, instance, update_fields=None, **kwargs):
+    """Имя клиента изменилось: подписки филиалов должны получить новый ETag"""
+    # Сохранение только last_login при входе имена не меняет
+    if update_fields is None or FEED_USER_FIELDS.intersection(update_fields):
+        transaction.on_commit(lambda: bump_version(sender))
+
+
+@receiver(post_save, sender=GoogleCalendarCredentials)
+@receiver(post_delete, sender=GoogleCalendarCredentials)
+def forget_calendar_service(sender, instance, **kwargs):
+    """Новые или удаленные учетные данные: закэшированный сервис больше не годится"""
+    forget_google_calendar_service(instance.user_id)
@@ -1,3 +1,512 @@
-from django.test import TestCase
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from unittest import mock
 
-# Create your tests here.
+import httplib2
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+from icalendar import Calendar, Event
+
+from appointments.models import Appointment
+from appointments.tests import create_catalog
+from core.models import Client
+from . import services
+from .batch import BATCH_LIMIT, TokenBucket, execute_batch
+from .ical_service import build_ical_event
+from .ical_stream import EVENT_FIELDS, STAFF_EVENT_FIELDS, iter_calendar
+from .models import CalendarFeed, CalendarOutbox, CalendarSettings, GoogleCalendarCredentials
+from .outbox import (
+    RETRY_DELAY, CalendarSyncError, GoogleCalendarGateway, Operation, claim_batch, enqueue_upcoming,
+    process_outbox,
+)
+from .services import StoredCredentials
+
+User = get_user_model()
+
+
+class RecordingGateway:
+    """Заглушка Google Calendar API: запоминает операции и создает события с новыми id"""
+
+    def __init__(self):
+        self.operations = []
+
+    def execute(self, operations):
+        self.operations.extend(operations)
+        return [
+            (f'event{len(self.operations)}-{index}' if operation.action == 'insert' else operation.event_id, None)
+            for index, operation in enumerate(operations)
+        ]
+
+
+class CalendarOutboxTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.user = User.objects.create_user('client')
+        CalendarSettings.objects.create(user=cls.user, calendar_type='google')
+        cls.date = datetime.date.today() + datetime.timedelta(days=3)
+
+    def book(self, time=datetime.time(12, 0)):
+        return Appointment.objects.create(
+            client=self.user, service=self.service, location=self.location, date=self.date, time=time,
+        )
+
+    def test_changes_are_merged_into_one_insert(self):
+        appointment = self.book()
+        appointment.notes = "Первый визит"
+        appointment.save()
+        self.assertEqual(CalendarOutbox.objects.count(), 2)
+
+        gateway = RecordingGateway()
+        self.assertEqual(process_outbox(gateway), (1, 0))
+        self.assertEqual([operation.action for operation in gateway.operations], ['insert'])
+        appointment.refresh_from_db()
+        self.assertTrue(appointment.google_event_id)
+        self.assertFalse(CalendarOutbox.objects.exists())
+
+    def test_appointment_is_claimed_by_one_worker(self):
+        appointment = self.book()
+        other = self.book(datetime.time(15, 0))
+        claimed = claim_batch()
+        self.assertEqual({row.appointment_id for row in claimed}, {appointment.pk, other.pk})
+
+        # Пока первый обработчик создает событие, запись снова изменилась
+        appointment.notes = "Изменение во время синхронизации"
+        appointment.save()
+        self.assertEqual(claim_batch(), [])
+
+        CalendarOutbox.objects.filter(pk__in=[row.pk for row in claimed]).update(
+            leased_until=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+        )
+        self.assertEqual(len(claim_batch()), 3)
+
+    @override_settings(SALON_TIME_ZONE='Europe/Moscow')
+    def test_upcoming_uses_salon_date(self):
+        today = datetime.date.today()
+        past = Appointment.objects.create(
+            client=self.user, service=self.service, location=self.location, date=today, time=datetime.time(12, 0),
+        )
+        upcoming = Appointment.objects.create(
+            client=self.user, service=self.service, location=self.location,
+            date=today + datetime.timedelta(days=1), time=datetime.time(12, 0),
+        )
+        CalendarOutbox.objects.all().delete()
+        # 22:30 UTC - в салоне уже следующий день
+        now = datetime.datetime.combine(today, datetime.time(22, 30), tzinfo=datetime.timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            enqueue_upcoming(self.user)
+        appointment_ids = set(CalendarOutbox.objects.values_list('appointment_id', flat=True))
+        self.assertIn(upcoming.pk, appointment_ids)
+        self.assertNotIn(past.pk, appointment_ids)
+
+    def test_whole_appointment_is_claimed_together(self):
+        appointment = self.book()
+        for index in range(3):
+            appointment.notes = f"Изменение {index}"
+            appointment.save()
+        self.book(datetime.time(15, 0))
+
+        claimed = claim_batch(limit=1)
+        self.assertEqual([row.appointment_id for row in claimed], [appointment.pk] * 4)
+
+    def test_only_failed_appointments_are_retried(self):
+        appointments = [self.book(datetime.time(hour)) for hour in (10, 12, 15)]
+        failed = appointments[1]
+
+        class FailingGateway(RecordingGateway):
+            def execute(self, operations):
+                results = super().execute(operations)
+                return [
+                    (None, CalendarSyncError("Ошибка API")) if operation.appointment == failed else result
+                    for operation, result in zip(operations, results)
+                ]
+
+        started = timezone.now()
+        self.assertEqual(process_outbox(FailingGateway()), (2, 1))
+        row = CalendarOutbox.objects.get()
+        self.assertEqual((row.appointment_id, row.attempts, row.leased_until), (failed.pk, 1, None))
+        self.assertEqual(row.last_error, "Ошибка API")
+        self.assertGreaterEqual(row.next_attempt, started + RETRY_DELAY)
+        failed.refresh_from_db()
+        self.assertEqual(failed.google_event_id, '')
+        self.assertTrue(all(
+            appointment.google_event_id
+            for appointment in Appointment.objects.filter(pk__in=[appointments[0].pk, appointments[2].pk])
+        ))
+
+        # Повторная ошибка удваивает паузу
+        CalendarOutbox.objects.update(next_attempt=started)
+        started = timezone.now()
+        self.assertEqual(process_outbox(FailingGateway()), (0, 1))
+        row = CalendarOutbox.objects.get()
+        self.assertEqual(row.attempts, 2)
+        self.assertGreaterEqual(row.next_attempt, started + RETRY_DELAY * 2)
+
+        CalendarOutbox.objects.update(next_attempt=started)
+        self.assertEqual(process_outbox(RecordingGateway()), (1, 0))
+        self.assertFalse(CalendarOutbox.objects.exists())
+
+
+class CalendarFeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+        cls.client_user = User.objects.create_user('client', first_name="Анна", last_name="Иванова")
+        Appointment.objects.create(
+            client=cls.client_user, service=cls.service, location=cls.location,
+            date=datetime.date.today() + datetime.timedelta(days=3), time=datetime.time(12, 0),
+        )
+        cls.feed = CalendarFeed.objects.create(user=cls.staff, location=cls.location)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_feed(self, **headers):
+        return self.client.get(f'/calendar/ical/feed/{self.feed.token}.ics', headers=headers)
+
+    def test_client_rename_changes_staff_feed(self):
+        response = self.get_feed()
+        self.assertContains(response, "Анна Иванова")
+        etag = response.headers['ETag']
+        self.assertEqual(self.get_feed(if_none_match=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_user.last_name = "Петрова"
+            self.client_user.save()
+        response = self.get_feed(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Анна Петрова")
+
+    def test_login_keeps_feed_etag(self):
+        etag = self.get_feed().headers['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client_user.save(update_fields=['last_login'])
+        self.assertEqual(self.get_feed(if_none_match=etag).status_code, 304)
+
+    def test_valid_token_serves_calendar(self):
+        response = self.get_feed()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(len(Calendar.from_ical(response.content).walk('VEVENT')), 1)
+
+    def test_unknown_token(self):
+        self.assertEqual(self.client.get('/calendar/ical/feed/unknown.ics').status_code, 404)
+
+    def test_reset_revokes_token(self):
+        old_token = self.feed.token
+        self.client.force_login(self.staff)
+        self.client.post('/calendar/ical/feed/reset/')
+        self.feed.refresh_from_db()
+        self.assertNotEqual(self.feed.token, old_token)
+        self.assertEqual(self.client.get(f'/calendar/ical/feed/{old_token}.ics').status_code, 404)
+        self.assertEqual(self.get_feed().status_code, 200)
+
+    def test_location_feed_requires_staff(self):
+        self.staff.is_staff = False
+        self.staff.save()
+        self.assertEqual(self.get_feed().status_code, 404)
+
+
+class StreamingICalTest(TestCase):
+    """Потоковая запись iCalendar совпадает с событиями, построенными библиотекой icalendar"""
+    SITE_URL = 'https://yuanna.ru'
+    NOTES = (
+        "",
+        "Кириллица, эмодзи 💆 и знаки ; , \\ \\N\r\nвторая строка\nтретья",
+        "Очень длинное примечание " * 20,
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.location.address = "ул. Московская, д. 1; вход со двора"
+        cls.location.save()
+        date = datetime.date.today() + datetime.timedelta(days=2)
+        for index, notes in enumerate(cls.NOTES):
+            user = User.objects.create_user(
+                f'client{index}', first_name="Анна" if index else "", last_name="Иванова-Петрова" * index,
+            )
+            if index:
+                Client.objects.create(user=user, phone="+7 (900) 123-45-67")
+            Appointment.objects.create(
+                client=user, service=cls.service, location=cls.location, notes=notes,
+                date=date, time=datetime.time(10 + 2 * index, 0), status=('pending', 'confirmed', 'canceled')[index],
+            )
+
+    def stream(self, for_staff):
+        fields = STAFF_EVENT_FIELDS if for_staff else EVENT_FIELDS
+        rows = Appointment.objects.order_by('pk').values(*fields)
+        return b''.join(iter_calendar(rows, self.SITE_URL, "Тест", for_staff=for_staff, chunk_size=512))
+
+    def expected_events(self, for_staff):
+        appointments = Appointment.objects.select_related('service', 'location', 'client__client').order_by('pk')
+        return [
+            build_ical_event(appointment, self.SITE_URL, dtstamp=appointment.updated, for_staff=for_staff)
+            for appointment in appointments
+        ]
+
+    def test_events_round_trip(self):
+        for for_staff in (False, True):
+            with self.subTest(for_staff=for_staff):
+                body = self.stream(for_staff)
+                calendar = Calendar.from_ical(body)
+                events = calendar.walk('VEVENT')
+                expected = self.expected_events(for_staff)
+                self.assertEqual(len(events), len(expected))
+                for event, reference, notes in zip(events, expected, self.NOTES):
+                    self.assertEqual(event.to_ical(), reference.to_ical())
+                    # "\\N" и CRLF при записи превращаются в перевод строки и в icalendar
+                    lossless = '\\N' not in notes and '\r' not in notes
+                    parsed_reference = Event.from_ical(reference.to_ical())
+                    for name in ('SUMMARY', 'DESCRIPTION', 'LOCATION', 'UID', 'URL'):
+                        self.assertEqual(str(event[name]), str(parsed_reference[name]))
+                        if lossless:
+                            self.assertEqual(str(event[name]), str(reference[name]))
+                    self.assertEqual(event.decoded('DTSTART'), reference.decoded('DTSTART'))
+                    self.assertEqual(event.decoded('DTEND'), reference.decoded('DTEND'))
+                self.assertEqual(len(calendar.walk('VTIMEZONE')), 1)
+
+    def test_lines_are_folded(self):
+        body = self.stream(for_staff=True)
+        self.assertTrue(body.endswith(b'END:VCALENDAR\r\n'))
+        for line in body.split(b'\r\n'):
+            self.assertLessEqual(len(line), 75)
+            line.decode()
+
+
+def token_record(token, refresh_token, expires_in):
+    expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=expires_in)
+    return {
+        'token': token, 'refresh_token': refresh_token,
+        'token_uri': 'https://oauth2.googleapis.com/token', 'expiry': expiry.isoformat(),
+    }
+
+
+class FakeRefresh:
+    """Обновление токена без обращения к Google: считает вызовы и выдает новый токен"""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, credentials, request):
+        with self.lock:
+            self.calls.append(credentials.refresh_token)
+            number = len(self.calls)
+        time.sleep(self.delay)
+        credentials.token = f'refreshed{number}'
+        credentials.expiry = (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)).replace(tzinfo=None)
+
+
+@override_settings(GOOGLE_OAUTH_CLIENT_ID='client-id', GOOGLE_OAUTH_CLIENT_SECRET='secret')
+class StoredCredentialsRefreshTest(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        self.user = User.objects.create_user('client')
+        self.record = GoogleCalendarCredentials.objects.create(
+            user=self.user, token=token_record('expired', 'refresh1', -60),
+        )
+
+    def patch_refresh(self, fake):
+        return mock.patch(
+            'google.oauth2.credentials.Credentials.refresh',
+            lambda credentials, request: fake(credentials, request),
+        )
+
+    def refresh(self, credentials, fake):
+        with self.patch_refresh(fake):
+            credentials.refresh(None)
+
+    def test_single_refresh_across_threads(self):
+        fake = FakeRefresh(delay=0.05)
+        clients = [StoredCredentials.from_record(self.record) for _ in range(self.THREADS)]
+        barrier = threading.Barrier(self.THREADS)
+
+        def run(credentials):
+            try:
+                barrier.wait()
+                credentials.refresh(None)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(credentials,)) for credentials in clients]
+        with self.patch_refresh(fake):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(fake.calls, ['refresh1'])
+        self.assertEqual({credentials.token for credentials in clients}, {'refreshed1'})
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.token['token'], 'refreshed1')
+
+    def test_reauthorized_credentials_are_adopted(self):
+        cached = StoredCredentials.from_record(self.record)
+        # Пользователь заново авторизовался, пока сервис с прежними данными был в кэше
+        GoogleCalendarCredentials.objects.filter(pk=self.record.pk).update(
+            token=token_record('fresh', 'refresh2', 3600),
+        )
+        fake = FakeRefresh()
+        self.refresh(cached, fake)
+        self.assertEqual(fake.calls, [])
+        self.assertEqual((cached.token, cached.refresh_token), ('fresh', 'refresh2'))
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.token['refresh_token'], 'refresh2')
+
+    def test_expired_reauthorized_credentials_refresh_with_stored_token(self):
+        cached = StoredCredentials.from_record(self.record)
+        GoogleCalendarCredentials.objects.filter(pk=self.record.pk).update(
+            token=token_record('stale', 'refresh2', -60),
+        )
+        fake = FakeRefresh()
+        self.refresh(cached, fake)
+        self.assertEqual(fake.calls, ['refresh2'])
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.token['refresh_token'], 'refresh2')
+        self.assertEqual(self.record.token['token'], 'refreshed1')
+
+
+@override_settings(GOOGLE_OAUTH_CLIENT_ID='client-id', GOOGLE_OAUTH_CLIENT_SECRET='secret')
+class ServiceCacheTest(TestCase):
+    def setUp(self):
+        services._local.services = OrderedDict()
+        self.users = [User.objects.create_user(f'client{index}') for index in range(3)]
+        for user in self.users:
+            GoogleCalendarCredentials.objects.create(user=user, token=token_record('token', 'refresh', 3600))
+
+    @mock.patch('calendar_integration.services.SERVICE_CACHE_SIZE', 2)
+    def test_least_recently_used_is_evicted(self):
+        first, second, third = self.users
+        service = services.get_google_calendar_service(first)
+        services.get_google_calendar_service(second)
+        # Повторный запрос берет сервис из кэша и делает его последним использованным
+        with self.assertNumQueries(0):
+            self.assertIs(services.get_google_calendar_service(first), service)
+        services.get_google_calendar_service(third)
+        self.assertEqual(list(services._get_service_cache()), [first.pk, third.pk])
+
+    def test_saved_credentials_reset_cache(self):
+        service = services.get_google_calendar_service(self.users[0])
+        services.forget_google_calendar_service(self.users[0].pk)
+        self.assertIsNot(services.get_google_calendar_service(self.users[0]), service)
+
+
+class FakeBatch:
+    """Пакет запросов без HTTP: ответ на каждый запрос строит respond(request)"""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.batches.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, self.service.respond(request), None)
+            except HttpError as exc:
+                self.callback(request_id, None, exc)
+
+
+class FakeService:
+    def __init__(self, respond):
+        self.respond = respond
+        self.batches = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'{}')
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.taken = []
+
+    def take(self, count=1):
+        self.taken.append(count)
+
+
+class CalendarBatchTest(SimpleTestCase):
+    def test_requests_are_split_into_batches(self):
+        service = FakeService(lambda request: {'id': f'event{request}'})
+        limiter = RecordingLimiter()
+        results = execute_batch([(service, index) for index in range(BATCH_LIMIT * 2 + 20)], limiter)
+        self.assertEqual(service.batches, [BATCH_LIMIT, BATCH_LIMIT, 20])
+        self.assertEqual(limiter.taken, service.batches)
+        self.assertEqual(results, [({'id': f'event{index}'}, None) for index in range(BATCH_LIMIT * 2 + 20)])
+
+    def test_failed_batch_fails_unanswered_requests(self):
+        class BrokenBatch(FakeBatch):
+            def execute(self):
+                self.callback(self.requests[0][0], {'id': 'event0'}, None)
+                raise ConnectionError("Соединение разорвано")
+
+        service = FakeService(None)
+        service.new_batch_http_request = lambda callback: BrokenBatch(service, callback)
+        results = execute_batch([(service, index) for index in range(3)], RecordingLimiter())
+        self.assertEqual(results[0], ({'id': 'event0'}, None))
+        self.assertEqual([type(error) for _, error in results[1:]], [ConnectionError] * 2)
+
+    def test_gateway_results(self):
+        users = [User(pk=1, username='client1'), User(pk=2, username='client2')]
+        statuses = {'gone': 404, 'removed': 410, 'broken': 500}
+
+        def respond(request):
+            action, event_id = request
+            if event_id in statuses:
+                raise http_error(statuses[event_id])
+            return {'id': event_id or 'created'}
+
+        service = FakeService(respond)
+        gateway = GoogleCalendarGateway(RecordingLimiter())
+        operations = [
+            Operation('insert', users[0], None, ''),
+            Operation('delete', users[0], None, 'gone'),
+            Operation('delete', users[1], None, 'removed'),
+            Operation('update', users[1], None, 'broken'),
+            Operation('delete', users[1], None, 'broken'),
+        ]
+        with mock.patch.object(gateway, 'get_service', return_value=service) as get_service, \
+                mock.patch('calendar_integration.batch.build_request',
+                           lambda service, action, user, appointment, event_id: (action, event_id)):
+            results = gateway.execute(operations)
+        # Сервис строится один раз на пользователя, все операции уходят одним пакетом
+        self.assertEqual(get_service.call_count, 2)
+        self.assertEqual(service.batches, [5])
+        self.assertEqual(results[:3], [('created', None), (None, None), (None, None)])
+        # Удаление считается выполненным только при 404 и 410
+        self.assertEqual([error.resp.status for _, error in results[3:]], [500, 500])
+
+    def test_token_bucket(self):
+        clock = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+
+        limiter = TokenBucket(rate=10, capacity=50, clock=lambda: clock[0], sleep=sleep)
+        limiter.take(50)
+        self.assertEqual(sleeps, [])
+        limiter.take(20)
+        self.assertEqual(sleeps, [2.0])
+        clock[0] += 10
+        limiter.take(50)
+        self.assertEqual(sleeps, [2.0])
@@ -7,4 +7,7 @@ urlpatterns = [
     path('google/callback/', views.google_auth_callback, name='google_auth_callback'),
     path('google/remove/', views.remove_google_auth, name='remove_google_auth'),
     path('ical/download/<int:appointment_id>/', views.download_ical, name='download_ical'),
+    path('ical/feed/<str:token>.ics', views.calendar_feed, name='calendar_feed'),
+    path('ical/feed/reset/', views.reset_calendar_feeds, name='reset_calendar_feeds'),
+    path('ical/export/location/<int:location_id>/', views.export_location_calendar, name='export_location_calendar'),
 ]
\ No newline at end of file
@@ -1,14 +1,23 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpResponse, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
 from django.conf import settings
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_POST, require_safe
 from google_auth_oauthlib.flow import Flow
-from .models import GoogleCalendarCredentials, CalendarSettings
+from .models import GoogleCalendarCredentials, CalendarSettings, CalendarFeed, generate_feed_token
+from . import feeds
 from .services import add_appointment_to_google_calendar, update_appointment_in_google_calendar, remove_appointment_from_google_calendar
 from .ical_service import generate_ical_for_appointment
-from appointments.models import Appointment
+from .ical_stream import STAFF_EVENT_FIELDS, iter_calendar
+from .outbox import enqueue_upcoming
+from appointments.models import Appointment, get_salon_timezone
+from locations.models import Location
 
 @login_required
 def calendar_settings_view(request):
@@ -30,6 +39,7 @@ def calendar_settings_view(request):
         reminder_time = int(request.POST.get('reminder_time', 60))
         
         # Обновляем настройки
+        google_enabled = calendar_type == 'google' and settings.calendar_type != 'google'
         settings.calendar_type = calendar_type
         settings.add_appointments = add_appointments
         settings.update_appointments = update_appointments
@@ -37,12 +47,23 @@ def calendar_settings_view(request):
         settings.reminder_time = reminder_time
         settings.save()
         
+        # Предстоящие записи добавляются в календарь пакетными запросами через очередь синхронизации
+        if google_enabled:
+            enqueue_upcoming(request.user)
+        
         messages.success(request, "Настройки календаря успешно сохранены.")
         return redirect('calendar_settings')
     
+    # Ссылки на подписку iCalendar
+    personal_feed, location_feeds = feeds.get_user_feeds(request.user)
+    
     return render(request, 'calendar_integration/settings.html', {
         'settings': settings,
         'has_google_auth': has_google_auth,
+        'feed_url': feeds.get_webcal_url(request, personal_feed),
+        'location_feeds': [
+            (feed.location, feeds.get_webcal_url(request, feed)) for feed in location_feeds
+        ],
     })
 
 @login_required
@@ -124,6 +145,7 @@ def google_auth_callback(request):
         'client_id': credentials.client_id,
         'client_secret': credentials.client_secret,
         'scopes': credentials.scopes,
+        'expiry': credentials.expiry.isoformat() if credentials.expiry else None,
     }
     
     # Обновляем или создаем запись в базе данных
@@ -170,4 +192,70 @@ def download_ical(request, appointment_id):
     response = HttpResponse(ical_data, content_type='text/calendar')
     response['Content-Disposition'] = f'attachment; filename="appointment-{appointment.id}.ics"'
     
-    return response
\ No newline at end of file
+    return response
+
+@login_required
+@require_POST
+def reset_calendar_feeds(request):
+    """
+    Замена токенов подписок: старые ссылки перестают работать
+    """
+    for feed in CalendarFeed.objects.filter(user=request.user):
+        feed.token = generate_feed_token()
+        feed.save(update_fields=['token'])
+    
+    messages.success(request, "Ссылки на подписку обновлены. Добавьте подписку в календарь заново.")
+    return redirect('calendar_settings')
+
+@require_safe
+def calendar_feed(request, token):
+    """
+    Подписка на календарь по токену (без входа на сайт).
+    Неизмененная подписка отдается ответом 304 или готовым файлом из кэша.
+    """
+    feed = get_object_or_404(CalendarFeed.objects.select_related('user', 'location'), token=token)
+    if not feeds.is_feed_available(feed):
+        raise Http404
+    
+    site_url = request.build_absolute_uri('/').rstrip('/')
+    queryset, etag = feeds.get_feed_state(feed, site_url)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(
+            feeds.get_feed_body(feed, queryset, etag, site_url), content_type='text/calendar; charset=utf-8'
+        )
+        response['Content-Disposition'] = 'inline; filename="appointments.ics"'
+    response['ETag'] = etag
+    # В ссылке токен, поэтому общие кэши не должны хранить ответ
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def _get_date_param(request, name):
+    try:
+        return parse_date(request.GET.get(name) or '')
+    except ValueError:
+        return None
+
+@staff_member_required
+@require_safe
+def export_location_calendar(request, location_id):
+    """
+    Выгрузка записей филиала в iCalendar потоком: память не зависит от числа записей.
+    Период задается параметрами date_from и date_to (ГГГГ-ММ-ДД), по умолчанию - с сегодняшнего дня.
+    """
+    location = get_object_or_404(Location, pk=location_id)
+    date_from = _get_date_param(request, 'date_from') or timezone.now().astimezone(get_salon_timezone()).date()
+    date_to = _get_date_param(request, 'date_to')
+    
+    appointments = Appointment.objects.filter(location=location, date__gte=date_from).exclude(status='canceled')
+    if date_to:
+        appointments = appointments.filter(date__lte=date_to)
+    rows = appointments.order_by('date', 'time', 'pk').values(*STAFF_EVENT_FIELDS).iterator(chunk_size=2000)
+    
+    site_url = request.build_absolute_uri('/').rstrip('/')
+    response = StreamingHttpResponse(
+        iter_calendar(rows, site_url, f"ЮАнна: {location.name}", for_staff=True),
+        content_type='text/calendar; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="location-{location.id}-{date_from}.ics"'
+    return response
@@ -0,0 +1,60 @@
+"""
+Версии моделей для инвалидации кэша.
+
+Для каждой отслеживаемой модели в кэше хранится номер версии, который
+увеличивается после сохранения или удаления любого ее объекта. Ключи кэшированных
+данных включают номера версий, поэтому после изменения старые значения просто
+перестают читаться и со временем вытесняются из кэша.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+VERSION_KEY = 'model-version:{}'
+
+
+def _version_key(model):
+    return VERSION_KEY.format(model._meta.label_lower)
+
+
+def _initial_version():
+    # Версия зависит от времени, чтобы после очистки кэша не совпасть с прежней
+    return time.time_ns()
+
+
+def get_versions(*models):
+    """Текущие версии моделей (одним обращением к кэшу)"""
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(model):
+    """Делает недействительными все кэшированные данные, зависящие от модели"""
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), timeout=None)
+
+
+def versioned_key(name, *models):
+    """Ключ кэша, который меняется при изменении любой из моделей"""
+    return ':'.join([name, *map(str, get_versions(*models))])
+
+
+def _bump_on_commit(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version(sender))
+
+
+def track_model_versions(*models):
+    """Увеличивает версию модели после сохранения или удаления ее объектов"""
+    for model in models:
+        post_save.connect(_bump_on_commit, sender=model, dispatch_uid=f'version:save:{model._meta.label_lower}')
+        post_delete.connect(_bump_on_commit, sender=model, dispatch_uid=f'version:delete:{model._meta.label_lower}')
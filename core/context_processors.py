@@ -1,7 +1,7 @@
-from locations.models import Location
+from locations.cache import get_active_locations
 
 def locations_processor(request):
     """Добавляет список активных филиалов во все шаблоны"""
     return {
-        'locations': Location.objects.filter(is_active=True)
+        'locations': get_active_locations()
     }
\ No newline at end of file
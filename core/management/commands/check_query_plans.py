@@ -0,0 +1,34 @@
+"""
+Проверка планов выполнения самых частых запросов на рабочей базе (см. core.query_plans).
+Команда завершается ошибкой, если хотя бы один запрос читает таблицу целиком.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.query_plans import find_full_scans, get_hot_querysets
+
+
+class Command(BaseCommand):
+    help = "Проверяет, что частые запросы используют индексы, а не полный просмотр таблиц"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help="Выводить планы запросов целиком")
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(f"База данных {connection.vendor} не поддерживается.")
+
+        failures = []
+        for name, queryset in get_hot_querysets().items():
+            if options['verbose_plans']:
+                self.stdout.write(f"{name}:\n{queryset.explain()}\n")
+
+            tables = find_full_scans(queryset)
+            if tables:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"{name}: полный просмотр {', '.join(tables)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{name}: OK"))
+
+        if failures:
+            raise CommandError(f"Запросов без индекса: {len(failures)}")
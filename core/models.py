@@ -9,6 +9,44 @@ class TimeStampedModel(models.Model):
     class Meta:
         abstract = True
 
+class RatingAggregateModel(models.Model):
+    """Абстрактная модель с хранимой статистикой опубликованных оценок (см. services.ratings)"""
+    rating_avg = models.FloatField(default=0, editable=False, verbose_name="Средний рейтинг")
+    rating_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Количество оценок")
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Оценок «1»")
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Оценок «2»")
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Оценок «3»")
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Оценок «4»")
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Оценок «5»")
+
+    RATING_FIELDS = frozenset([
+        'rating_avg', 'rating_count',
+        'rating_1_count', 'rating_2_count', 'rating_3_count', 'rating_4_count', 'rating_5_count',
+    ])
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        """
+        Статистику оценок меняет только services.ratings запросами с F(). Обычное
+        сохранение существующей строки ее не записывает: иначе объект, загруженный
+        до нового отзыва, вернул бы прежние значения.
+        """
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+                and field.name not in self.RATING_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def rating_histogram(self):
+        """Количество оценок по звездам: {1: ..., 5: ...}"""
+        return {star: getattr(self, f'rating_{star}_count') for star in range(1, 6)}
+
 class Client(TimeStampedModel):
     """Модель клиента салона"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='client')
@@ -0,0 +1,132 @@
+"""
+Кэширование страниц каталога целиком.
+
+Страница рендерится один раз с "дырами" на месте фрагментов, зависящих от
+посетителя (меню пользователя, сообщения, форма отзыва), и сохраняется в кэше
+под ключом из пути, значимых параметров запроса и версий моделей, от которых зависит ее содержимое (см.
+core.cache). При каждом запросе дыры заполняются отдельно отрендеренными
+фрагментами, поэтому закэшированная страница подходит любому посетителю,
+а после изменения моделей автоматически перестраивается.
+
+Тот же ключ вместе с пользователем и его секретом CSRF служит ETag
+страницы: если он совпал с If-None-Match, браузер получает 304 без
+обращения к базе. Секрет CSRF входит в ETag, потому что формы в дырах
+содержат токен: после смены секрета (например, при повторном входе)
+браузер не должен показывать страницу со старым токеном.
+"""
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import CSRF_SESSION_KEY
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+from core.cache import versioned_key
+from locations.models import Location
+
+HOLE_MARKER = '<!--page-cache-hole:{}-->'
+
+# Шаблоны фрагментов, которые рендерятся для каждого посетителя отдельно
+HOLE_TEMPLATES = {
+    'user_nav': 'includes/user_nav.html',
+    'messages': 'includes/messages.html',
+}
+
+
+class PageCacheMixin:
+    """Миксин для представлений, страницы которых можно кэшировать целиком"""
+    # Модели, от которых зависит содержимое страницы (филиалы есть в меню каждой страницы)
+    page_cache_models = ()
+    page_cache_timeout = 60 * 60
+    # Дополнительные дыры страницы: {имя: шаблон}
+    page_cache_holes = {}
+    # Параметры запроса, от которых зависит содержимое страницы. Остальные параметры
+    # (utm-метки, случайные значения против кэша) в ключ не входят: иначе каждая
+    # ссылка из рассылки создавала бы отдельную копию страницы в кэше
+    page_cache_query_params = ()
+
+    def get_page_cache_query_params(self):
+        params = set(self.page_cache_query_params)
+        if getattr(self, 'paginate_by', None):
+            params.add(self.page_kwarg)
+        return params
+
+    def get_page_cache_key(self):
+        models = {Location, *self.page_cache_models}
+        models = sorted(models, key=lambda model: model._meta.label_lower)
+        query = urlencode(sorted(
+            (name, value)
+            for name in self.get_page_cache_query_params()
+            for value in self.request.GET.getlist(name)
+        ))
+        path = hashlib.md5(f'{self.request.path}?{query}'.encode()).hexdigest()
+        return versioned_key(f'page:{path}', *models)
+
+    def get_page_etag(self, key):
+        """
+        ETag страницы: версии данных плюс текущий пользователь и секрет CSRF,
+        от которых зависят дыры. Пока есть непоказанные сообщения, ETag не используется.
+        """
+        if len(get_messages(self.request)):
+            return None
+        user = self.request.user.pk if self.request.user.is_authenticated else ''
+        if settings.CSRF_USE_SESSIONS:
+            csrf_secret = self.request.session.get(CSRF_SESSION_KEY, '')
+        else:
+            csrf_secret = self.request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+        return quote_etag(hashlib.md5(f'{key}:{user}:{csrf_secret}'.encode()).hexdigest())
+
+    def get_hole_context(self, name):
+        """Дополнительный контекст для рендеринга дыры"""
+        return {}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['page_cache_holes'] = True
+        return context
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_page_cache_key()
+        etag = self.get_page_etag(key)
+        if etag is not None:
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return self.patch_validators(response, etag)
+
+        page = cache.get(key)
+        if page is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200 or not hasattr(response, 'render'):
+                return response
+            page = response.render().content.decode(response.charset)
+            cache.set(key, page, self.page_cache_timeout)
+        else:
+            response = HttpResponse(content_type='text/html; charset=utf-8')
+
+        response.content = self.fill_holes(page)
+        return self.patch_validators(response, etag)
+
+    def patch_validators(self, response, etag):
+        if etag is not None:
+            response.headers['ETag'] = etag
+            # Страница содержит данные пользователя, поэтому кэшировать ее могут только браузеры
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def fill_holes(self, page):
+        """Подставляет в страницу фрагменты, отрендеренные для текущего посетителя"""
+        for name, template_name in {**HOLE_TEMPLATES, **self.page_cache_holes}.items():
+            marker = HOLE_MARKER.format(name)
+            if marker in page:
+                page = page.replace(
+                    marker, render_to_string(template_name, self.get_hole_context(name), request=self.request)
+                )
+        return page
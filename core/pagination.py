@@ -0,0 +1,188 @@
+"""
+Постраничный вывод по курсору (keyset pagination) для HTML-списков.
+
+Следующая страница выбирается условием "строго после последней строки"
+по упорядоченному набору полей, например (date, time, id), а не через
+OFFSET, поэтому глубокие страницы открываются так же быстро, как первая.
+Курсор - значения полей крайней строки страницы в base64; тот же формат
+использует API (api.pagination.KeysetPagination).
+
+Общее количество строк не считается точным COUNT(*) по всей выборке:
+считается не больше EXACT_COUNT_LIMIT строк, а для больших выборок
+показывается оценка планировщика PostgreSQL (в SQLite - нижняя граница).
+Результат кэшируется на COUNT_TIMEOUT секунд отдельно для каждого набора фильтров.
+"""
+import base64
+import datetime
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+
+EXACT_COUNT_LIMIT = 10000
+COUNT_TIMEOUT = 60
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Время в курсоре хранится с микросекундами (DjangoJSONEncoder отбрасывает их часть)"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def flip_ordering(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+def keyset_condition(ordering, values):
+    """Условие "строка идет строго после values" для заданного порядка"""
+    condition = None
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = equal & Q(**{f'{name}__{lookup}': value})
+        condition = step if condition is None else condition | step
+        equal &= Q(**{name: value})
+    # Избыточное условие на первое поле: без него условие из OR не ограничивает
+    # диапазон индекса, и каждая следующая страница читает индекс с самого начала
+    first = ordering[0]
+    lookup = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & condition
+
+
+def encode_cursor(obj, ordering, reverse=False):
+    values = [getattr(obj, field.lstrip('-')) for field in ordering]
+    payload = json.dumps({'v': values, 'r': int(reverse)}, cls=CursorEncoder)
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(encoded, model, ordering):
+    """
+    Возвращает (значения полей крайней строки, направление) или (None, False) без курсора.
+    При неверном курсоре вызывает ValueError.
+    """
+    if not encoded:
+        return None, False
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        raw_values = payload['v']
+        if len(raw_values) != len(ordering):
+            raise ValueError
+        values = [
+            model._meta.get_field(field.lstrip('-')).to_python(value)
+            for field, value in zip(ordering, raw_values)
+        ]
+        return values, bool(payload.get('r'))
+    except (TypeError, ValueError, KeyError, ValidationError):
+        raise ValueError('Неверный курсор.')
+
+
+def estimate_count(queryset):
+    """Оценка количества строк по плану запроса (только PostgreSQL), иначе None"""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_count(queryset):
+    """
+    Количество строк выборки и его точность: 'exact', 'estimate' (оценка планировщика)
+    или 'lower_bound' (строк больше указанного числа).
+    """
+    queryset = queryset.order_by()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        # queryset.none() или условие, которому заведомо не подходит ни одна строка
+        return 0, 'exact'
+    key = 'list-count:%s' % hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    result = cache.get(key)
+    if result is None:
+        # COUNT по подзапросу с LIMIT прекращает чтение после EXACT_COUNT_LIMIT + 1 строк
+        count = queryset.values('pk')[:EXACT_COUNT_LIMIT + 1].count()
+        if count <= EXACT_COUNT_LIMIT:
+            result = (count, 'exact')
+        else:
+            estimate = estimate_count(queryset)
+            if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+                result = (estimate, 'estimate')
+            else:
+                result = (EXACT_COUNT_LIMIT, 'lower_bound')
+        cache.set(key, result, COUNT_TIMEOUT)
+    return result
+
+
+class KeysetPage:
+    """Страница списка; ссылки на соседние страницы - строки запроса с курсором"""
+
+    def __init__(self, queryset, ordering, page_size, params, cursor_query_param):
+        self.params = params
+        self.cursor_query_param = cursor_query_param
+        self.ordering = ordering
+        try:
+            values, reverse = decode_cursor(params.get(cursor_query_param), queryset.model, ordering)
+        except ValueError:
+            raise Http404("Неверный курсор.")
+
+        page_ordering = flip_ordering(ordering) if reverse else ordering
+        rows = queryset.order_by(*page_ordering)
+        if values is not None:
+            rows = rows.filter(keyset_condition(page_ordering, values))
+        rows = list(rows[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        self.object_list = rows
+        self.has_next = True if reverse else has_more
+        self.has_previous = has_more if reverse else values is not None
+        self.count, self.count_accuracy = get_count(queryset)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _query(self, obj=None, reverse=False):
+        params = self.params.copy()
+        params.pop(self.cursor_query_param, None)
+        params.pop('page', None)
+        if obj is not None:
+            params[self.cursor_query_param] = encode_cursor(obj, self.ordering, reverse)
+        return params.urlencode()
+
+    def first_query(self):
+        return self._query()
+
+    def next_query(self):
+        return self._query(self.object_list[-1]) if self.has_next and self.object_list else None
+
+    def previous_query(self):
+        if not self.has_previous:
+            return None
+        if not self.object_list:
+            return self._query()
+        return self._query(self.object_list[0], reverse=True)
+
+
+class KeysetPaginationMixin:
+    """
+    Пагинация ListView по курсору вместо номеров страниц. Порядок задается атрибутом
+    cursor_ordering; последнее поле должно быть уникальным (обычно id).
+    """
+    cursor_ordering = ('-id',)
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        page = KeysetPage(
+            queryset, tuple(self.cursor_ordering), page_size, self.request.GET, self.cursor_query_param
+        )
+        return None, page, page.object_list, page.has_other_pages()
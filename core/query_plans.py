@@ -0,0 +1,66 @@
+"""
+Планы выполнения самых частых запросов сайта.
+
+Для каждого запроса выполняется EXPLAIN и ищутся таблицы, которые он читает
+целиком вместо использования индекса. Проверку запускают тесты core
+(QueryPlanTest) и команда check_query_plans. Поддерживаются SQLite и PostgreSQL.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import RequestFactory
+
+from appointments.views import AdminAppointmentListView, AdminReviewListView, AppointmentListView
+from services.models import ServiceReview
+
+User = get_user_model()
+
+# "SCAN таблица" без "USING INDEX" означает полный просмотр таблицы
+SQLITE_FULL_SCAN_RE = re.compile(r'\bSCAN (\w+)\s*$')
+POSTGRES_FULL_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+
+
+def view_queryset(view_class, params=None, user=None):
+    """Queryset, который строит представление для GET-запроса с указанными параметрами"""
+    request = RequestFactory().get('/', params or {})
+    request.user = user
+    view = view_class()
+    view.setup(request)
+    return view.get_queryset()
+
+
+def get_hot_querysets():
+    """Запросы, соответствующие основным спискам сайта"""
+    user = User(pk=1)
+    return {
+        "Заявки (администратор)": view_queryset(AdminAppointmentListView)[:10],
+        "Заявки по статусу (администратор)": view_queryset(AdminAppointmentListView, {'status': 'pending'})[:10],
+        "Заявки по филиалу (администратор)": view_queryset(AdminAppointmentListView, {'location': 1})[:10],
+        "Заявки за дату (администратор)": view_queryset(AdminAppointmentListView, {'date': '2025-01-01'})[:10],
+        "Поиск заявок по клиенту (администратор)": view_queryset(AdminAppointmentListView, {'search': 'иван'})[:10],
+        "Записи клиента": view_queryset(AppointmentListView, user=user),
+        "Отзывы об услуге": ServiceReview.objects.filter(
+            service_id=1, is_published=True
+        ).order_by('-created')[:5],
+        "Отзывы (администратор)": view_queryset(AdminReviewListView)[:10],
+        "Поиск отзывов (администратор)": view_queryset(AdminReviewListView, {'search': 'иван'})[:10],
+    }
+
+
+def find_full_scans(queryset):
+    """Возвращает список таблиц, которые запрос просматривает целиком"""
+    if connection.vendor == 'postgresql':
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # На маленьких таблицах PostgreSQL предпочитает Seq Scan даже при наличии индекса
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        return POSTGRES_FULL_SCAN_RE.findall(plan)
+
+    plan = queryset.explain()
+    return [
+        match.group(1)
+        for match in map(SQLITE_FULL_SCAN_RE.search, plan.splitlines())
+        if match
+    ]
@@ -1,3 +1,135 @@
-from django.test import TestCase
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from appointments.tests import create_catalog
+from locations.models import Location
+from .query_plans import find_full_scans, get_hot_querysets
+
+User = get_user_model()
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "EXPLAIN разбирается только для SQLite и PostgreSQL")
+class QueryPlanTest(TestCase):
+    """Частые списки сайта читают таблицы по индексам, а не целиком"""
+
+    def test_hot_querysets_use_indexes(self):
+        for name, queryset in get_hot_querysets().items():
+            with self.subTest(name):
+                self.assertEqual(find_full_scans(queryset), [], queryset.explain())
+
+
+@override_settings(COMPRESS_ENABLED=False)
+class ActiveLocationsCacheTest(TestCase):
+    """Список филиалов читается из кэша и перестраивается после изменений в админ-панели"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+
+    def location_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        table = Location._meta.db_table
+        return [query['sql'] for query in context.captured_queries if table in query['sql']]
+
+    def test_location_queries(self):
+        for url in ('/', '/contact/'):
+            with self.subTest(url):
+                cache.clear()
+                # Первый запрос строит список филиалов одним запросом, дальше он берется из кэша
+                self.assertEqual(len(self.location_queries(url)), 1)
+                self.assertEqual(self.location_queries(url), [])
+
+    def test_warm_pages_do_not_query(self):
+        for url in ('/', '/contact/'):
+            self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get('/')
+        with self.assertNumQueries(0):
+            self.client.get('/contact/')
+
+    def post_to_admin(self, obj, data):
+        self.client.force_login(self.admin)
+        opts = obj._meta
+        # Версия модели в кэше меняется после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/admin/{opts.app_label}/{opts.model_name}/{obj.pk}/change/', data)
+        self.assertEqual(response.status_code, 302)
+        self.client.logout()
+
+    def location_data(self, **changes):
+        location = self.location
+        return {
+            'name': location.name, 'address': location.address, 'phone': location.phone,
+            'email': location.email, 'working_hours': location.working_hours,
+            'description': location.description, 'latitude': location.latitude,
+            'longitude': location.longitude, 'is_active': 'on', **changes,
+        }
+
+    def service_data(self, **changes):
+        service = self.service
+        return {
+            'name': service.name, 'category': service.category_id, 'description': 'LPG',
+            'price': '2000', 'duration': '01:00:00', 'is_active': 'on',
+            'reviews-TOTAL_FORMS': 0, 'reviews-INITIAL_FORMS': 0, **changes,
+        }
+
+    def test_admin_edit_is_visible(self):
+        self.client.get('/')
+        self.client.get('/contact/')
+
+        self.post_to_admin(self.location, self.location_data(name="Филиал на Набережной"))
+        self.assertContains(self.client.get('/contact/'), "Филиал на Набережной")
+        self.assertContains(self.client.get('/'), "Филиал на Набережной")
+
+        self.post_to_admin(self.service, self.service_data(name="LPG лица"))
+        self.assertContains(self.client.get('/'), "LPG лица")
+
+    def test_deactivated_location_disappears(self):
+        self.assertContains(self.client.get('/contact/'), self.location.name)
+        data = self.location_data()
+        del data['is_active']
+        self.post_to_admin(self.location, data)
+        self.assertNotContains(self.client.get('/contact/'), self.location.address)
+
+
+@override_settings(COMPRESS_ENABLED=False)
+class PageCacheTest(TestCase):
+    """Закэшированные страницы каталога"""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalog()
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tracking_params_share_cached_page(self):
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/?utm_source=newsletter&utm_campaign=spring')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            self.client.get('/?_=1718000000')
+
+    def test_etag_changes_with_csrf_secret(self):
+        self.client.force_login(User.objects.create_user('client'))
+        self.client.cookies['csrftoken'] = 'a' * 32
+        etag = self.client.get('/').headers['ETag']
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # После повторного входа секрет CSRF другой: страница с формами рендерится заново
+        self.client.cookies['csrftoken'] = 'b' * 32
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
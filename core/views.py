@@ -4,20 +4,22 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 from django.contrib import messages
 from services.models import ServiceCategory, Service
-from locations.models import Location
+from locations.cache import get_active_locations
 from appointments.models import Appointment
 from .models import Client
 from .forms import UserProfileForm, ClientProfileForm
+from .page_cache import PageCacheMixin
 
-class HomeView(TemplateView):
+class HomeView(PageCacheMixin, TemplateView):
     """Главная страница сайта"""
     template_name = 'core/home.html'
+    page_cache_models = (ServiceCategory, Service)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['categories'] = ServiceCategory.objects.all()[:4]  # Первые 4 категории для главной
         context['services'] = Service.objects.filter(is_active=True)[:6]  # Первые 6 активных услуг
-        context['locations'] = Location.objects.filter(is_active=True)  # Все активные филиалы
+        context['locations'] = get_active_locations()  # Все активные филиалы
         return context
     
 class AboutView(TemplateView):
@@ -36,7 +38,7 @@ class ContactView(TemplateView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['locations'] = Location.objects.filter(is_active=True)
+        context['locations'] = get_active_locations()
         return context
 
 class ProfileView(LoginRequiredMixin, TemplateView):
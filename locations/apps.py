@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class LocationsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "locations"
+
+    def ready(self):
+        from core.cache import track_model_versions
+        from .models import Location
+
+        track_model_versions(Location)
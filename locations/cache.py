@@ -0,0 +1,17 @@
+from django.core.cache import cache
+
+from core.cache import versioned_key
+from .models import Location
+
+# Список перестраивается при изменении филиалов, срок хранения лишь страхует от рассинхронизации
+ACTIVE_LOCATIONS_TIMEOUT = 60 * 60
+
+
+def get_active_locations():
+    """Список активных филиалов, общий для всех страниц и контекстного процессора"""
+    key = versioned_key('locations:active', Location)
+    locations = cache.get(key)
+    if locations is None:
+        locations = list(Location.objects.filter(is_active=True))
+        cache.set(key, locations, ACTIVE_LOCATIONS_TIMEOUT)
+    return locations
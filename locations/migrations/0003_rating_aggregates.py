@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0002_location_latitude_location_longitude'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «1»'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «2»'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «3»'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «4»'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «5»'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False, verbose_name='Средний рейтинг'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+    ]
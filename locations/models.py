@@ -1,7 +1,7 @@
 from django.db import models
-from core.models import TimeStampedModel
+from core.models import TimeStampedModel, RatingAggregateModel
 
-class Location(TimeStampedModel):
+class Location(TimeStampedModel, RatingAggregateModel):
     """Модель филиала салона"""
     name = models.CharField(max_length=100, verbose_name="Название")
     address = models.CharField(max_length=255, verbose_name="Адрес")
@@ -1,15 +1,19 @@
 from django.shortcuts import render
 from django.views.generic import ListView, DetailView
 from .models import Location
+from .cache import get_active_locations
+from core.page_cache import PageCacheMixin
 
-class LocationListView(ListView):
+class LocationListView(PageCacheMixin, ListView):
     """Список филиалов"""
     model = Location
     template_name = 'locations/location_list.html'
     context_object_name = 'locations'
-    queryset = Location.objects.filter(is_active=True)
+    
+    def get_queryset(self):
+        return get_active_locations()
 
-class LocationDetailView(DetailView):
+class LocationDetailView(PageCacheMixin, DetailView):
     """Детальная информация о филиале"""
     model = Location
     template_name = 'locations/location_detail.html'
@@ -145,6 +145,13 @@ DATABASES = {
 }
 
 
+# Кэш. Версии моделей для инвалидации хранятся в кэше, поэтому при нескольких
+# процессах нужен общий кэш (например, CACHE_URL=redis://127.0.0.1:6379/1)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+
 # Email settings
 EMAIL_BACKEND = env('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
 DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='info@yuanna.ru')
@@ -192,6 +199,9 @@ USE_L10N = True
 
 USE_TZ = True
 
+# Часовой пояс салона: в нем указаны дата и время записей на процедуры
+SALON_TIME_ZONE = env('SALON_TIME_ZONE', default='Europe/Moscow')
+
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ResultsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "results"
+
+    def ready(self):
+        from core.cache import track_model_versions
+        from .models import BeforeAfterResult
+
+        track_model_versions(BeforeAfterResult)
@@ -1,10 +1,12 @@
 from django.shortcuts import render
 from django.views.generic import ListView
 from .models import BeforeAfterResult
-from services.models import ServiceCategory
+from services.models import ServiceCategory, Service
+from core.page_cache import PageCacheMixin
 
-class ResultsListView(ListView):
+class ResultsListView(PageCacheMixin, ListView):
     model = BeforeAfterResult
+    page_cache_models = (BeforeAfterResult, ServiceCategory, Service)
     template_name = 'results/results_list.html'
     context_object_name = 'results'
     
@@ -1,6 +1,8 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from .forms import ServiceAdminForm
 from .models import ServiceCategory, Service, ServiceReview
+from .ratings import set_reviews_published
 
 @admin.register(ServiceCategory)
 class ServiceCategoryAdmin(admin.ModelAdmin):
@@ -17,7 +19,9 @@ class ServiceReviewInline(admin.TabularInline):
     
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'duration', 'is_active', 'average_rating_display')
+    form = ServiceAdminForm
+    list_display = ('name', 'category', 'price', 'duration', 'is_active', 'average_rating_display', 'review_count')
+    list_select_related = ('category',)
     list_filter = ('category', 'is_active')
     search_fields = ('name', 'description')
     readonly_fields = ('average_rating_display', 'review_count')
@@ -32,22 +36,23 @@ class ServiceAdmin(admin.ModelAdmin):
     inlines = [ServiceReviewInline]
     
     def average_rating_display(self, obj):
-        """Отображение среднего рейтинга услуги с звездочками"""
-        avg_rating = ServiceReview.objects.filter(service=obj, is_published=True).values_list('rating', flat=True)
-        if not avg_rating:
+        """Отображение среднего рейтинга услуги с звездочками (по сохраненной статистике оценок)"""
+        if not obj.rating_count:
             return "Нет отзывов"
             
-        avg = sum(avg_rating) / len(avg_rating)
+        avg = obj.rating_avg
         stars = '★' * int(avg) + '☆' * (5 - int(avg))
         
         # Исправленная строка - используем правильный формат format_html
         return format_html('<span style="color: #FFD700;">{}</span> ({} из 5)', stars, round(avg, 1))
     average_rating_display.short_description = "Средний рейтинг"
+    average_rating_display.admin_order_field = 'rating_avg'
     
     def review_count(self, obj):
-        """Возвращает количество отзывов для услуги"""
-        return obj.reviews.filter(is_published=True).count()
+        """Возвращает количество опубликованных отзывов для услуги"""
+        return obj.rating_count
     review_count.short_description = "Количество отзывов"
+    review_count.admin_order_field = 'rating_count'
 
 @admin.register(ServiceReview)
 class ServiceReviewAdmin(admin.ModelAdmin):
@@ -59,14 +64,14 @@ class ServiceReviewAdmin(admin.ModelAdmin):
     
     def publish_reviews(self, request, queryset):
         """Публикует выбранные отзывы"""
-        updated = queryset.update(is_published=True)
+        updated = set_reviews_published(queryset, True)
         # Исправляем и здесь формат сообщения
         self.message_user(request, "{} отзывов опубликовано.".format(updated))
     publish_reviews.short_description = "Опубликовать выбранные отзывы"
     
     def unpublish_reviews(self, request, queryset):
         """Скрывает выбранные отзывы"""
-        updated = queryset.update(is_published=False)
+        updated = set_reviews_published(queryset, False)
         # Исправляем и здесь формат сообщения
         self.message_user(request, "{} отзывов скрыто.".format(updated))
     unpublish_reviews.short_description = "Скрыть выбранные отзывы"
\ No newline at end of file
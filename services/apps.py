@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ServicesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "services"
+
+    def ready(self):
+        from core.cache import track_model_versions
+        from . import signals  # noqa: F401
+        from .models import ServiceCategory, Service, ServiceReview
+
+        track_model_versions(ServiceCategory, Service, ServiceReview)
@@ -1,5 +1,21 @@
 from django import forms
-from .models import ServiceReview
+from .models import Service, ServiceReview
+
+class ServiceAdminForm(forms.ModelForm):
+    """Форма услуги в админ-панели с проверкой, что новая длительность не пересекает записи"""
+    class Meta:
+        model = Service
+        fields = '__all__'
+    
+    def clean_duration(self):
+        from appointments.booking import DurationConflict, find_duration_conflicts
+        
+        duration = self.cleaned_data['duration']
+        if self.instance.pk and 'duration' in self.changed_data:
+            conflicts = find_duration_conflicts(self.instance, duration)
+            if conflicts:
+                raise forms.ValidationError(str(DurationConflict(conflicts)))
+        return duration
 
 class ServiceReviewForm(forms.ModelForm):
     """Форма для создания отзыва об услуге"""
@@ -9,4 +25,4 @@ class ServiceReviewForm(forms.ModelForm):
         widgets = {
             'rating': forms.RadioSelect(attrs={'class': 'star-rating'}),
             'comment': forms.Textarea(attrs={'rows': 4, 'placeholder': 'Поделитесь своим мнением об услуге'}),
-        }
\ No newline at end of file
+        }
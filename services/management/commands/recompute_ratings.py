@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from services.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает хранимую статистику оценок услуг и филиалов по опубликованным отзывам"
+
+    def handle(self, *args, **options):
+        updated = recompute_ratings()
+        self.stdout.write(self.style.SUCCESS(f"Статистика оценок пересчитана для {updated} объектов."))
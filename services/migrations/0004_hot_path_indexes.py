@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0002_location_latitude_location_longitude'),
+        ('services', '0003_alter_service_category_servicereview'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicereview',
+            index=models.Index(fields=['service', 'is_published', 'created'], name='servicereview_published_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:06
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    """Заполняет статистику оценок по уже опубликованным отзывам"""
+    ServiceReview = apps.get_model('services', 'ServiceReview')
+    for model, key in ((apps.get_model('services', 'Service'), 'service_id'),
+                       (apps.get_model('locations', 'Location'), 'location_id')):
+        histograms = {}
+        counts = (ServiceReview.objects.filter(is_published=True)
+                  .values_list(key, 'rating').annotate(count=Count('id')).order_by())
+        for pk, rating, count in counts:
+            histograms.setdefault(pk, Counter())[rating] = count
+
+        for pk, histogram in histograms.items():
+            total = sum(histogram.values())
+            model.objects.filter(pk=pk).update(
+                rating_count=total,
+                rating_avg=sum(star * count for star, count in histogram.items()) / total,
+                **{f'rating_{star}_count': histogram[star] for star in range(1, 6)},
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0003_rating_aggregates'),
+        ('services', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «1»'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «2»'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «3»'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «4»'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок «5»'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False, verbose_name='Средний рейтинг'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:12
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0003_rating_aggregates'),
+        ('services', '0005_rating_aggregates'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicereview',
+            index=models.Index(fields=['is_published', 'created'], name='servicereview_pub_created_idx'),
+        ),
+    ]
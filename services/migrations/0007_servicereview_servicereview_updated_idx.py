@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0003_rating_aggregates'),
+        ('services', '0006_servicereview_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicereview',
+            index=models.Index(fields=['updated'], name='servicereview_updated_idx'),
+        ),
+    ]
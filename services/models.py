@@ -1,7 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.db.models.functions import Now
 from django.contrib.auth import get_user_model
 from django.utils.html import format_html
-from core.models import TimeStampedModel
+from core.models import TimeStampedModel, RatingAggregateModel
 from locations.models import Location
 
 # Получение модели пользователя
@@ -22,7 +24,7 @@ class ServiceCategory(TimeStampedModel):
     def __str__(self):
         return self.name
 
-class Service(TimeStampedModel):
+class Service(TimeStampedModel, RatingAggregateModel):
     """Модель услуги"""
     category = models.ForeignKey(ServiceCategory, on_delete=models.CASCADE, related_name='services', verbose_name="Категория")
     name = models.CharField(max_length=100, verbose_name="Название")
@@ -38,6 +40,36 @@ class Service(TimeStampedModel):
         
     def __str__(self):
         return self.name
+    
+    def save(self, *args, **kwargs):
+        """
+        Сохраняет услугу; при изменении длительности пересчитывает окончание записей на нее
+        и бронь предстоящих записей. Если предстоящие записи при новой длительности
+        пересекутся с другими, вызывает booking.DurationConflict и услуга не сохраняется.
+        """
+        old_duration = None
+        if self.pk:
+            old_duration = Service.objects.filter(pk=self.pk).values_list('duration', flat=True).first()
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if old_duration is not None and old_duration != self.duration:
+                from appointments.booking import resync_service_appointments, upcoming_service_appointments
+                from appointments.models import Appointment
+                from appointments.signals import appointments_changed
+                
+                upcoming = resync_service_appointments(self)
+                # Отмененные записи время не бронируют, а бронь прошедших не мешает новым
+                # записям, поэтому им достаточно сдвинуть окончание
+                others = self.appointments.filter(starts_at__isnull=False).exclude(
+                    pk__in=upcoming_service_appointments(self).values('pk')
+                )
+                pks = [appointment.pk for appointment in upcoming] + list(others.values_list('pk', flat=True))
+                others.update(
+                    ends_at=ExpressionWrapper(F('starts_at') + self.duration, output_field=DateTimeField()),
+                    updated=Now(),
+                )
+                appointments_changed.send(sender=Appointment, pks=pks)
 
 class ServiceReview(TimeStampedModel):
     """Модель отзыва об услуге"""
@@ -52,10 +84,35 @@ class ServiceReview(TimeStampedModel):
         verbose_name = "Отзыв об услуге"
         verbose_name_plural = "Отзывы об услугах"
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['service', 'is_published', 'created'], name='servicereview_published_idx'),
+            models.Index(fields=['is_published', 'created'], name='servicereview_pub_created_idx'),
+            models.Index(fields=['updated'], name='servicereview_updated_idx'),
+        ]
         
     def __str__(self):
         return f"Отзыв на {self.service.name} от {self.user.get_full_name() or self.user.username}"
     
+    def save(self, *args, **kwargs):
+        """Сохраняет отзыв и обновляет рейтинг услуги и филиала в одной транзакции"""
+        from .ratings import apply_rating_changes
+        
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                # Прежние значения читаются с блокировкой строки: иначе два одновременных
+                # изменения отзыва вычтут из статистики одну и ту же прежнюю оценку
+                previous = ServiceReview.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'service_id', 'location_id', 'rating', 'is_published'
+                ).first()
+            super().save(*args, **kwargs)
+            changes = []
+            if previous and previous[3]:
+                changes.append((previous[0], previous[1], previous[2], -1))
+            if self.is_published:
+                changes.append((self.service_id, self.location_id, self.rating, 1))
+            apply_rating_changes(changes)
+    
     def get_stars_display(self):
     
         if self.rating is None:
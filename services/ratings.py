@@ -0,0 +1,122 @@
+"""
+Хранимая статистика оценок услуг и филиалов.
+
+Service и Location хранят число опубликованных оценок по звездам, их общее
+количество и среднее значение (см. core.models.RatingAggregateModel). Счетчики
+изменяются инкрементально в той же транзакции, что и сам отзыв, поэтому
+страницам и API не нужно перебирать отзывы. recompute_ratings() пересчитывает
+статистику заново, если она разошлась с отзывами.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Value, When
+from django.db.models.functions import Cast, Now
+
+from core.cache import bump_version
+from locations.models import Location
+from .models import Service, ServiceReview
+
+STARS = range(1, 6)
+
+
+def _average_expression():
+    """Среднее значение оценок, вычисляемое по гистограмме в самой базе данных"""
+    weighted = sum((F(f'rating_{star}_count') * star for star in STARS), Value(0))
+    return Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=Cast(weighted, FloatField()) / F('rating_count'),
+        output_field=FloatField(),
+    )
+
+
+def _apply(model, deltas):
+    changed = set()
+    for (pk, rating), delta in deltas.items():
+        if not delta:
+            continue
+        field = f'rating_{rating}_count'
+        model.objects.filter(pk=pk).update(**{
+            field: F(field) + delta,
+            'rating_count': F('rating_count') + delta,
+        })
+        changed.add(pk)
+
+    if changed:
+        model.objects.filter(pk__in=changed).update(rating_avg=_average_expression(), updated=Now())
+        # update() не отправляет сигналы, поэтому версию для кэша меняем явно
+        transaction.on_commit(lambda: bump_version(model))
+
+
+def apply_rating_changes(changes):
+    """
+    Применяет изменения оценок к статистике услуг и филиалов.
+    changes - последовательность кортежей (service_id, location_id, rating, delta),
+    где delta - на сколько изменилось число опубликованных оценок.
+    """
+    service_deltas = Counter()
+    location_deltas = Counter()
+    for service_id, location_id, rating, delta in changes:
+        service_deltas[service_id, rating] += delta
+        location_deltas[location_id, rating] += delta
+
+    with transaction.atomic():
+        _apply(Service, service_deltas)
+        _apply(Location, location_deltas)
+
+
+def set_reviews_published(queryset, is_published):
+    """
+    Публикует или скрывает отзывы из queryset и обновляет статистику оценок.
+    Возвращает количество отзывов, у которых изменился статус.
+    """
+    delta = 1 if is_published else -1
+    with transaction.atomic():
+        rows = list(
+            queryset.exclude(is_published=is_published)
+            .select_for_update()
+            .values_list('pk', 'service_id', 'location_id', 'rating')
+        )
+        if not rows:
+            return 0
+
+        ServiceReview.objects.filter(pk__in=[row[0] for row in rows]).update(
+            is_published=is_published, updated=Now()
+        )
+        transaction.on_commit(lambda: bump_version(ServiceReview))
+        apply_rating_changes(
+            (service_id, location_id, rating, delta) for _, service_id, location_id, rating in rows
+        )
+    return len(rows)
+
+
+def recompute_ratings():
+    """Пересчитывает статистику оценок всех услуг и филиалов по опубликованным отзывам"""
+    updated = 0
+    fields = ['rating_avg', 'rating_count'] + [f'rating_{star}_count' for star in STARS]
+
+    with transaction.atomic():
+        for model, key in ((Service, 'service_id'), (Location, 'location_id')):
+            histograms = {}
+            counts = (
+                ServiceReview.objects.filter(is_published=True)
+                .values_list(key, 'rating')
+                .annotate(count=Count('id'))
+                .order_by()
+            )
+            for pk, rating, count in counts:
+                histograms.setdefault(pk, Counter())[rating] = count
+
+            objects = list(model.objects.only('pk'))
+            for obj in objects:
+                histogram = histograms.get(obj.pk, Counter())
+                total = sum(histogram.values())
+                for star in STARS:
+                    setattr(obj, f'rating_{star}_count', histogram[star])
+                obj.rating_count = total
+                obj.rating_avg = sum(star * histogram[star] for star in STARS) / total if total else 0
+            model.objects.bulk_update(objects, fields, batch_size=500)
+            transaction.on_commit(lambda model=model: bump_version(model))
+            updated += len(objects)
+
+    return updated
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import ServiceReview
+from .ratings import apply_rating_changes
+
+
+@receiver(post_delete, sender=ServiceReview)
+def remove_deleted_review_rating(sender, instance, **kwargs):
+    """Убирает оценку удаленного отзыва из статистики (в том числе при массовом и каскадном удалении)"""
+    if instance.is_published:
+        apply_rating_changes([(instance.service_id, instance.location_id, instance.rating, -1)])
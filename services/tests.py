@@ -1,3 +1,161 @@
+import datetime
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-# Create your tests here.
+from appointments.booking import DurationConflict, SlotUnavailable
+from appointments.models import Appointment, SlotReservation
+from appointments.tests import create_catalog
+from .forms import ServiceAdminForm
+from locations.models import Location
+from .models import Service, ServiceReview
+
+User = get_user_model()
+
+
+class ServiceDurationChangeTest(TestCase):
+    """Изменение длительности услуги перестраивает бронь ее предстоящих записей"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog(duration=datetime.timedelta(minutes=45))
+        cls.client_user = User.objects.create_user('client')
+        cls.date = datetime.date.today() + datetime.timedelta(days=7)
+
+    def book(self, time, service=None):
+        return Appointment.objects.create(
+            client=self.client_user, service=service or self.service, location=self.location,
+            date=self.date, time=time,
+        )
+
+    def test_longer_duration_reserves_new_cells(self):
+        appointment = self.book(datetime.time(10, 0))
+        self.service.duration = datetime.timedelta(minutes=120)
+        self.service.save()
+
+        appointment.refresh_from_db()
+        self.assertEqual(appointment.ends_at - appointment.starts_at, datetime.timedelta(minutes=120))
+        self.assertEqual(appointment.reservations.count(), 8)
+        with self.assertRaises(SlotUnavailable):
+            self.book(datetime.time(11, 0))
+
+    def test_conflict_rejects_change(self):
+        appointment = self.book(datetime.time(10, 0))
+        other_service, _ = create_catalog(duration=datetime.timedelta(minutes=30))
+        self.book(datetime.time(11, 0), service=other_service)
+
+        self.service.duration = datetime.timedelta(minutes=120)
+        with self.assertRaises(DurationConflict) as error:
+            self.service.save()
+        self.assertEqual(error.exception.appointments, [appointment])
+
+        self.service.refresh_from_db()
+        self.assertEqual(self.service.duration, datetime.timedelta(minutes=45))
+        self.assertEqual(appointment.reservations.count(), 3)
+        self.assertEqual(SlotReservation.objects.count(), 5)
+
+    def test_admin_form_reports_conflict(self):
+        self.book(datetime.time(10, 0))
+        other_service, _ = create_catalog(duration=datetime.timedelta(minutes=30))
+        self.book(datetime.time(11, 0), service=other_service)
+
+        data = {
+            'name': self.service.name, 'category': self.service.category_id, 'description': 'LPG',
+            'price': '2000', 'duration': '02:00:00', 'is_active': 'on',
+        }
+        form = ServiceAdminForm(data, instance=self.service)
+        self.assertFalse(form.is_valid())
+        self.assertIn('duration', form.errors)
+
+        data['duration'] = '00:30:00'
+        self.assertTrue(ServiceAdminForm(data, instance=self.service).is_valid())
+
+    def test_shorter_duration_frees_cells(self):
+        appointment = self.book(datetime.time(10, 0))
+        self.service.duration = datetime.timedelta(minutes=30)
+        self.service.save()
+        self.assertEqual(appointment.reservations.count(), 2)
+        self.book(datetime.time(10, 30))
+
+
+class ServiceReviewRatingTest(TestCase):
+    """Статистика оценок меняется вместе с отзывом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        cls.user = User.objects.create_user('client')
+
+    def test_edit_and_unpublish(self):
+        review = ServiceReview.objects.create(
+            user=self.user, service=self.service, location=self.location, rating=5, comment="Отлично",
+        )
+        review.rating = 3
+        review.save()
+        self.service.refresh_from_db()
+        self.assertEqual(self.service.rating_histogram, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0})
+        self.assertEqual(self.service.rating_avg, 3)
+
+        review.is_published = False
+        review.save()
+        review.save()
+        self.service.refresh_from_db()
+        self.location.refresh_from_db()
+        self.assertEqual(self.service.rating_count, 0)
+        self.assertEqual(self.location.rating_count, 0)
+
+    def test_stale_instance_keeps_statistics(self):
+        stale = Service.objects.get(pk=self.service.pk)
+        ServiceReview.objects.create(
+            user=self.user, service=self.service, location=self.location, rating=4, comment="Хорошо",
+        )
+        # Услугу и филиал сохраняют объекты, загруженные до появления отзыва
+        stale.name = "LPG массаж тела"
+        stale.save()
+        Location.objects.get(pk=self.location.pk).save()
+
+        self.service.refresh_from_db()
+        self.location.refresh_from_db()
+        self.assertEqual(self.service.name, "LPG массаж тела")
+        self.assertEqual((self.service.rating_count, self.service.rating_avg), (1, 4))
+        self.assertEqual(self.location.rating_histogram, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+
+class ServiceReviewAdminTest(TestCase):
+    """Массовая публикация и скрытие отзывов в админ-панели"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.service, cls.location = create_catalog()
+        user = User.objects.create_user('client')
+        cls.reviews = [
+            ServiceReview.objects.create(
+                user=user, service=cls.service, location=cls.location, rating=rating,
+                comment="Отзыв", is_published=published,
+            )
+            for rating, published in ((5, True), (3, False), (1, False))
+        ]
+        cls.admin = User.objects.create_superuser('admin')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def run_action(self, action, reviews):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/admin/services/servicereview/', {
+                'action': action, '_selected_action': [review.pk for review in reviews],
+            })
+        self.assertEqual(response.status_code, 302)
+        self.service.refresh_from_db()
+        self.location.refresh_from_db()
+
+    def test_publish_and_unpublish(self):
+        self.run_action('publish_reviews', self.reviews)
+        self.assertEqual(self.service.rating_histogram, {1: 1, 2: 0, 3: 1, 4: 0, 5: 1})
+        self.assertEqual((self.service.rating_count, self.service.rating_avg), (3, 3))
+        self.assertEqual(self.location.rating_count, 3)
+
+        self.run_action('unpublish_reviews', self.reviews[:2])
+        self.assertEqual(self.service.rating_histogram, {1: 1, 2: 0, 3: 0, 4: 0, 5: 0})
+        self.assertEqual((self.service.rating_count, self.service.rating_avg), (1, 1))
+        self.assertEqual(ServiceReview.objects.filter(is_published=True).get(), self.reviews[2])
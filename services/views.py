@@ -5,11 +5,13 @@ from django.urls import reverse_lazy
 from django.contrib import messages
 from .models import ServiceCategory, Service, ServiceReview
 from .forms import ServiceReviewForm
-from locations.models import Location
+from locations.cache import get_active_locations
+from core.page_cache import PageCacheMixin
 
-class ServiceCategoryListView(ListView):
+class ServiceCategoryListView(PageCacheMixin, ListView):
     """Список всех категорий услуг"""
     model = ServiceCategory
+    page_cache_models = (ServiceCategory, Service)
     template_name = 'services/category_list.html'
     context_object_name = 'categories'
 
@@ -18,9 +20,10 @@ class ServiceCategoryListView(ListView):
         context['all_services'] = Service.objects.filter(is_active=True).order_by('category', 'name')
         return context
 
-class ServiceListView(ListView):
+class ServiceListView(PageCacheMixin, ListView):
     """Список услуг в конкретной категории"""
     model = Service
+    page_cache_models = (ServiceCategory, Service)
     template_name = 'services/service_list.html'
     context_object_name = 'services'
     
@@ -33,11 +36,23 @@ class ServiceListView(ListView):
         context['category'] = self.category
         return context
 
-class ServiceDetailView(DetailView):
+class ServiceDetailView(PageCacheMixin, DetailView):
     """Детальная информация об услуге"""
     model = Service
     template_name = 'services/service_detail.html'
     context_object_name = 'service'
+    page_cache_models = (ServiceCategory, Service, ServiceReview)
+    page_cache_holes = {'review_form': 'services/includes/review_form.html'}
+    
+    def get_hole_context(self, name):
+        """Форма отзыва зависит от того, оставлял ли пользователь отзыв на услугу"""
+        context = {}
+        if name == 'review_form' and self.request.user.is_authenticated:
+            context['user_reviewed'] = ServiceReview.objects.filter(
+                service_id=self.kwargs['pk'],
+                user=self.request.user
+            ).exists()
+        return context
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -56,26 +71,15 @@ class ServiceDetailView(DetailView):
             is_published=True
         ).order_by('-created')[:5]
         
-        # Средний рейтинг
-        reviews = ServiceReview.objects.filter(service=self.object, is_published=True)
-        if reviews.exists():
-            avg_rating = sum(review.rating for review in reviews) / len(reviews)
-            context['avg_rating'] = avg_rating
-            context['review_count'] = len(reviews)
+        # Средний рейтинг хранится в самой услуге (см. services.ratings)
+        if self.object.rating_count:
+            context['avg_rating'] = self.object.rating_avg
+            context['review_count'] = self.object.rating_count
         
-        # Проверяем, может ли пользователь оставить отзыв
-        if self.request.user.is_authenticated:
-            # Отображаем форму для создания отзыва
-            context['review_form'] = ServiceReviewForm()
-            
-            # Проверяем, оставил ли пользователь уже отзыв
-            context['user_reviewed'] = ServiceReview.objects.filter(
-                service=self.object, 
-                user=self.request.user
-            ).exists()
+        # Форма отзыва рендерится для каждого пользователя отдельно (см. get_hole_context)
         
         # Добавляем список филиалов для формы отзыва
-        context['locations'] = Location.objects.filter(is_active=True)
+        context['locations'] = get_active_locations()
         
         return context
     
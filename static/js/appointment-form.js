@@ -1,66 +1,87 @@
 document.addEventListener('DOMContentLoaded', function() {
     const dateInput = document.getElementById('id_date');
     const timeInput = document.getElementById('id_time');
-    
-    if (!dateInput || !timeInput) {
+    const serviceInput = document.getElementById('id_service');
+    const locationInput = document.getElementById('id_location');
+
+    if (!dateInput || !timeInput || !serviceInput || !locationInput) {
         return; // Выходим, если элементы не найдены
     }
-    
-    // Рабочие часы по дням недели (0 = воскресенье, 1 = понедельник, ..., 6 = суббота)
-    const workingHours = {
-        1: { start: '10:00', end: '22:00' }, // Понедельник
-        2: { start: '10:00', end: '22:00' }, // Вторник
-        3: { start: '10:00', end: '22:00' }, // Среда
-        4: { start: '10:00', end: '22:00' }, // Четверг
-        5: { start: '10:00', end: '22:00' }, // Пятница
-        6: { start: '10:00', end: '20:00' }, // Суббота
-        0: { start: '10:00', end: '20:00' }  // Воскресенье
-    };
-    
-    // Функция получения названия дня недели
-    function getDayName(dayOfWeek) {
-        const days = [
-            'воскресенье', 'понедельник', 'вторник', 
-            'среду', 'четверг', 'пятницу', 'субботу'
-        ];
-        return days[dayOfWeek];
+
+    // Свободное время, полученное с сервера для текущих услуги, филиала и даты
+    let availableSlots = null;
+
+    // Контейнер для кнопок со свободным временем
+    function getSlotsContainer() {
+        let container = document.getElementById('time-slots');
+        if (!container) {
+            container = document.createElement('div');
+            container.id = 'time-slots';
+            container.className = 'mt-2';
+            timeInput.parentNode.appendChild(container);
+        }
+        return container;
     }
-    
-    // Функция обновления доступных часов
-    function updateAvailableHours() {
-        if (!dateInput.value) return;
-        
-        const selectedDate = new Date(dateInput.value);
-        const dayOfWeek = selectedDate.getDay(); // 0-6 (Вс-Сб)
-        
-        // Получаем рабочие часы для выбранного дня
-        const hours = workingHours[dayOfWeek];
-        
-        // Устанавливаем минимальное и максимальное время
-        timeInput.setAttribute('min', hours.start);
-        timeInput.setAttribute('max', hours.end);
-        
-        // Проверяем, что выбранное время находится в пределах рабочих часов
-        if (timeInput.value) {
-            if (timeInput.value < hours.start) {
-                timeInput.value = hours.start;
-            }
-            if (timeInput.value > hours.end) {
-                timeInput.value = hours.end;
-            }
+
+    // Отображение свободного времени в виде кнопок
+    function renderSlots(slots) {
+        const container = getSlotsContainer();
+        container.innerHTML = '';
+
+        if (!slots.length) {
+            const empty = document.createElement('small');
+            empty.className = 'form-text text-muted';
+            empty.textContent = 'На выбранную дату нет свободного времени. Пожалуйста, выберите другую дату или филиал.';
+            container.appendChild(empty);
+            return;
         }
-        
-        // Добавляем подсказку под полем времени
-        let timeHelp = document.getElementById('time-help');
-        if (!timeHelp) {
-            timeHelp = document.createElement('small');
-            timeHelp.id = 'time-help';
-            timeHelp.className = 'form-text text-muted mt-1';
-            timeInput.parentNode.appendChild(timeHelp);
+
+        slots.forEach(function(slot) {
+            const button = document.createElement('button');
+            button.type = 'button';
+            button.className = 'btn btn-sm me-1 mb-1 ' + (slot === timeInput.value ? 'btn-primary' : 'btn-outline-primary');
+            button.textContent = slot;
+            button.addEventListener('click', function() {
+                timeInput.value = slot;
+                renderSlots(slots);
+            });
+            container.appendChild(button);
+        });
+    }
+
+    // Загрузка свободного времени с сервера
+    function updateAvailableSlots() {
+        availableSlots = null;
+        if (!dateInput.value || !serviceInput.value || !locationInput.value) {
+            getSlotsContainer().innerHTML = '';
+            return;
         }
-        timeHelp.textContent = `Рабочие часы в ${getDayName(dayOfWeek)}: ${hours.start} - ${hours.end}`;
+
+        const params = new URLSearchParams({
+            service: serviceInput.value,
+            start: dateInput.value,
+            end: dateInput.value
+        });
+        fetch(`/api/v1/locations/${locationInput.value}/availability/?${params}`, {
+            headers: { 'Accept': 'application/json' }
+        })
+            .then(function(response) {
+                if (!response.ok) {
+                    throw new Error(response.statusText);
+                }
+                return response.json();
+            })
+            .then(function(data) {
+                const day = data.days.find(function(item) { return item.date === dateInput.value; });
+                availableSlots = day ? day.slots : [];
+                renderSlots(availableSlots);
+            })
+            .catch(function() {
+                // Если расписание недоступно, окончательную проверку выполнит сервер
+                getSlotsContainer().innerHTML = '';
+            });
     }
-    
+
     // Устанавливаем сегодняшнюю дату как минимальную
     const today = new Date();
     const year = today.getFullYear();
@@ -68,30 +89,25 @@ document.addEventListener('DOMContentLoaded', function() {
     const day = String(today.getDate()).padStart(2, '0');
     const todayFormatted = `${year}-${month}-${day}`;
     dateInput.setAttribute('min', todayFormatted);
-    
+
     // Добавляем обработчики событий
-    dateInput.addEventListener('change', updateAvailableHours);
-    timeInput.addEventListener('focus', updateAvailableHours);
-    
-    // Если дата уже выбрана, обновляем доступные часы
+    dateInput.addEventListener('change', updateAvailableSlots);
+    serviceInput.addEventListener('change', updateAvailableSlots);
+    locationInput.addEventListener('change', updateAvailableSlots);
+
+    // Если данные уже выбраны, загружаем свободное время
     if (dateInput.value) {
-        updateAvailableHours();
+        updateAvailableSlots();
     }
-    
+
     // Дополнительная проверка перед отправкой формы
-    const form = document.querySelector('form');
+    const form = timeInput.form;
     if (form) {
         form.addEventListener('submit', function(e) {
-            if (dateInput.value && timeInput.value) {
-                const selectedDate = new Date(dateInput.value);
-                const dayOfWeek = selectedDate.getDay();
-                const hours = workingHours[dayOfWeek];
-                
-                if (timeInput.value < hours.start || timeInput.value > hours.end) {
-                    e.preventDefault();
-                    alert(`Пожалуйста, выберите время в рабочие часы: ${hours.start} - ${hours.end}`);
-                }
+            if (availableSlots && timeInput.value && !availableSlots.includes(timeInput.value.slice(0, 5))) {
+                e.preventDefault();
+                alert('Выбранное время занято. Пожалуйста, выберите одно из свободных значений.');
             }
         });
     }
-});
\ No newline at end of file
+});